@@ -0,0 +1,342 @@
+# author: Jayce Ning
+
+"""
+Benchmark of the overhead of the framework apart from the latency of the language model.
+The io, cot, tot, got and dgot graphs of generate_abstract.py are executed over synthetic articles of
+different sizes with the deterministic MockLanguageModel, the results are written as JSON.
+Every method and size runs in a fresh process, so that its peak memory is measured on its own.
+
+python benchmarks/benchmark.py --sizes 500 2000 8000 --articles 3 --output bench.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import multiprocessing
+import json
+import os
+import platform
+import random
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import generate_abstract as ga
+from graph_of_thoughts import controller, operations
+from utils import scoring_context
+
+METHODS = ["io", "cot", "tot", "got", "dgot"]
+
+
+class Timings:
+    """
+    Thread-safe accumulator of the number of calls and the total time per name.
+    """
+
+    def __init__(self) -> None:
+        self.lock: threading.Lock = threading.Lock()
+        self.totals: Dict[str, List[float]] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        with self.lock:
+            total = self.totals.setdefault(name, [0, 0.0])
+            total[0] += 1
+            total[1] += seconds
+
+    @contextlib.contextmanager
+    def measure(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def wrap(self, name: str, function: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            with self.measure(name):
+                return function(*args, **kwargs)
+
+        return timed
+
+    def total(self, prefix: str = "") -> float:
+        with self.lock:
+            return sum(total for name, (_, total) in self.totals.items() if name.startswith(prefix))
+
+    def report(self, prefix: str = "") -> Dict[str, Dict]:
+        with self.lock:
+            return {
+                name[len(prefix) :]: {"count": count, "total_s": total, "mean_s": total / count}
+                for name, (count, total) in sorted(self.totals.items())
+                if name.startswith(prefix)
+            }
+
+
+class TimedPrompter(ga.GenAbstractPrompter):
+    """
+    GenAbstractPrompter that measures the time spent building the prompts.
+    """
+
+    def __init__(self, max_input_prompt_tokens: int, timings: Timings) -> None:
+        super().__init__(max_input_prompt_tokens)
+        self.timings = timings
+
+    def generate_prompt(self, *args, **kwargs) -> str:
+        with self.timings.measure("prompt/generate_prompt"):
+            return super().generate_prompt(*args, **kwargs)
+
+    def aggregation_prompt(self, *args, **kwargs) -> str:
+        with self.timings.measure("prompt/aggregation_prompt"):
+            return super().aggregation_prompt(*args, **kwargs)
+
+
+def peak_rss_mb() -> float:
+    """
+    Return the peak resident set size of the process in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def synthetic_article(num_words: int, num_references: int, seed: int) -> Dict:
+    """
+    Create a deterministic synthetic article, the sections and references grow with its size.
+
+    :param num_words: Number of words of the introduction.
+    :type num_words: int
+    :param num_references: Number of references.
+    :type num_references: int
+    :param seed: Seed of the article.
+    :type seed: int
+    :return: The initial state of the graphs.
+    :rtype: Dict
+    """
+    rng = random.Random(seed)
+    vocabulary = [
+        "".join(rng.choice("abcdefghiklmnoprstuvw") for _ in range(rng.randint(3, 10))) for _ in range(3000)
+    ]
+
+    def text(length: int) -> str:
+        return " ".join(rng.choice(vocabulary) for _ in range(length)) + "."
+
+    sections = {
+        name: text(num_words // 2)
+        for name in ["Methods", "Results", "Discussion", "Conclusions"][: 1 + num_words // 2000]
+    }
+    return {
+        "origin_title": text(12),
+        "origin_abstract": text(250),
+        "origin_introduction": text(num_words),
+        "origin_info": sections,
+        "reference_info": {text(10): text(200) for _ in range(num_references)},
+        "current": "",
+    }
+
+
+def build_graph(method: str, node_num: int, max_concurrent_queries: Optional[int]) -> operations.GraphOfOperations:
+    if method in ("tot", "got"):
+        return getattr(ga, method)(node_num, max_concurrent_queries)
+    if method == "dgot":
+        return ga.dgot(node_num, None, max_concurrent_queries)
+    return getattr(ga, method)()
+
+
+def instrument(graph: operations.GraphOfOperations, timings: Timings) -> None:
+    """
+    Measure the wall time of every operation and the time of the scoring functions.
+    The operations are named by their position in the graph and their type.
+    """
+    for position, operation in enumerate(graph.operations):
+        name = f"operation/{position:02d}_{operation.__class__.__name__}"
+        operation.execute = timings.wrap(name, operation.execute)
+        aexecute = operation.aexecute
+
+        async def timed_aexecute(*args, name=name, aexecute=aexecute, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await aexecute(*args, **kwargs)
+            finally:
+                timings.add(name, time.perf_counter() - start)
+
+        operation.aexecute = timed_aexecute
+        if getattr(operation, "scoring_function", None) is not None:
+            operation.scoring_function = timings.wrap(
+                f"scoring/{operation.__class__.__name__}", operation.scoring_function
+            )
+
+
+def benchmark_cell(
+    method: str,
+    size: int,
+    num_articles: int,
+    num_references: int,
+    node_num: int,
+    max_input_prompt_tokens: int,
+    lm_options: Dict,
+    max_parallel_operations: int = 1,
+    max_concurrent_queries: Optional[int] = None,
+    use_async: bool = False,
+) -> Dict:
+    """
+    Execute one method on `num_articles` synthetic articles of one size.
+    The peak resident set size is that of the process, so the cell should run in a process of its own.
+
+    :return: The measurements of the method and size.
+    :rtype: Dict
+    """
+    ga.generate_prompt_nums.setdefault(str(max_input_prompt_tokens), 0)
+    ga.cut_abstract_nums.setdefault(str(max_input_prompt_tokens), 0)
+    controller_class = controller.AsyncController if use_async else controller.Controller
+    articles = [synthetic_article(size, num_references, seed) for seed in range(num_articles)]
+    timings = Timings()
+    lm = controller.MockLanguageModel(**lm_options)
+    num_requests = 0
+    lm_latency = 0.0
+    start = time.perf_counter()
+    for article in articles:
+        lm.reset_usage()
+        graph = build_graph(method, node_num, max_concurrent_queries)
+        instrument(graph, timings)
+        executor = controller_class(
+            lm,
+            graph,
+            TimedPrompter(max_input_prompt_tokens, timings),
+            ga.GenAbstractParser(),
+            {**article, "method": method},
+            max_parallel_operations=max_parallel_operations,
+            scoring_context_factory=scoring_context,
+        )
+        with timings.measure("article"):
+            executor.run()
+        num_requests += lm.num_requests
+        lm_latency += lm.total_latency
+    wall_time = time.perf_counter() - start
+    return {
+        "method": method,
+        "size_words": size,
+        "num_articles": num_articles,
+        "wall_time_s": wall_time,
+        "articles_per_s": num_articles / wall_time,
+        "lm_requests": num_requests,
+        "lm_requests_per_s": num_requests / wall_time,
+        "lm_latency_s": lm_latency,
+        "prompt_build_s": timings.total("prompt/"),
+        "scoring_s": timings.total("scoring/"),
+        "operations": timings.report("operation/"),
+        "prompts": timings.report("prompt/"),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_benchmark(
+    methods: List[str],
+    sizes: List[int],
+    num_articles: int,
+    num_references: int,
+    node_num: int,
+    max_input_prompt_tokens: int,
+    lm_options: Dict,
+    max_parallel_operations: int = 1,
+    max_concurrent_queries: Optional[int] = None,
+    use_async: bool = False,
+) -> Dict:
+    """
+    Execute every method on `num_articles` synthetic articles of every size.
+    Every method and size is executed in a new process, so that its peak memory does not include
+    the memory of the earlier ones.
+
+    :return: The configuration and the measurements of every method and size.
+    :rtype: Dict
+    """
+    # spawn starts every cell from a fresh interpreter instead of a copy of this process
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for size in sizes:
+        for method in methods:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result = pool.submit(
+                    benchmark_cell,
+                    method,
+                    size,
+                    num_articles,
+                    num_references,
+                    node_num,
+                    max_input_prompt_tokens,
+                    lm_options,
+                    max_parallel_operations,
+                    max_concurrent_queries,
+                    use_async,
+                ).result()
+            results.append(result)
+            print(
+                f"{method:5s} {size:6d} words: {result['wall_time_s']:.3f}s, prompts {result['prompt_build_s']:.3f}s, "
+                f"scoring {result['scoring_s']:.3f}s, peak {result['peak_rss_mb']:.1f} MB",
+                file=sys.stderr,
+            )
+    return {
+        "timestamp": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "config": {
+            "methods": methods,
+            "sizes": sizes,
+            "num_articles": num_articles,
+            "num_references": num_references,
+            "node_num": node_num,
+            "max_input_prompt_tokens": max_input_prompt_tokens,
+            "max_parallel_operations": max_parallel_operations,
+            "max_concurrent_queries": max_concurrent_queries,
+            "use_async": use_async,
+            "lm": lm_options,
+        },
+        "results": results,
+        "peak_rss_mb": max((result["peak_rss_mb"] for result in results), default=0.0),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the framework with a mock language model")
+    parser.add_argument("--methods", nargs="+", default=METHODS, choices=METHODS, help="Graphs to execute")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[500, 2000, 8000], help="Words of the synthetic introductions")
+    parser.add_argument("--articles", type=int, default=3, help="Number of articles per size")
+    parser.add_argument("--references", type=int, default=5, help="Number of references per article")
+    parser.add_argument("--node_num", type=int, default=3, help="Branch factor of tot, got and dgot")
+    parser.add_argument("--prompt_length", type=int, default=4096, help="Maximum number of input prompt tokens")
+    parser.add_argument("--latency", type=str, default="constant", choices=controller.MockLanguageModel.latency_distributions, help="Latency distribution of the mock model")
+    parser.add_argument("--mean_latency", type=float, default=0.0, help="Mean latency of a request in seconds")
+    parser.add_argument("--latency_spread", type=float, default=0.5, help="Relative spread of the latency")
+    parser.add_argument("--response_tokens", type=int, default=150, help="Words per mock response")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the mock model")
+    parser.add_argument("--max_parallel_operations", type=int, default=1, help="Number of ready operations executed concurrently")
+    parser.add_argument("--max_concurrent_queries", type=int, default=None, help="Number of concurrent LM requests of each operation")
+    parser.add_argument("--use_async", action="store_true", help="Execute the graphs with the asynchronous controller")
+    parser.add_argument("--output", type=str, default=None, help="JSON file for the results, printed if not given")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        args.methods,
+        args.sizes,
+        args.articles,
+        args.references,
+        args.node_num,
+        args.prompt_length,
+        {
+            "latency": args.latency,
+            "mean_latency": args.mean_latency,
+            "latency_spread": args.latency_spread,
+            "response_tokens": args.response_tokens,
+            "seed": args.seed,
+        },
+        args.max_parallel_operations,
+        args.max_concurrent_queries,
+        args.use_async,
+    )
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as json_file:
+            json.dump(report, json_file, indent=2)
@@ -7,16 +7,27 @@ import datetime
 import time
 import json
 import csv
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from statistics import fmean
-from typing import Dict, List, Callable, Set, Union
+from typing import Dict, List, Callable, Optional, Set, Tuple, Union
 from graph_of_thoughts import controller, operations, prompter, parser
-from utils import read_pmc, read_pm, rouge1_f_test_introduction, rouge1_f_gold_summary, process_data_for_all_tasks, draw_line_box_bar_figure
+from graph_of_thoughts.profiler import Profiler, trace_span
+from graph_of_thoughts.metrics import registry as metrics_registry
+from utils import read_pmc, read_pm, rouge1_f_test_introduction, rouge1_f_gold_summary, scoring_context, process_data_for_all_tasks, draw_line_box_bar_figure
+from utils.tokenizer import get_encoding_for_model, count_tokens, truncate_to_tokens
+from utils.corpus_store import PackedCorpus
+from utils.citation_graph import GraphReader
+from utils.reference_cache import ReferenceCache
 from tqdm import tqdm
 import argparse
 import tiktoken
 
 generate_prompt_nums = {}
 cut_abstract_nums = {}
+# Guards the prompt counters, prompts are created from several threads.
+prompt_nums_lock = threading.Lock()
 
 
 class GenAbstractPrompter(prompter.Prompter):
@@ -91,10 +102,75 @@ Here is the origin article information <origin>:
 {reference}
 """
 
-    def __init__(self, max_input_prompt_tokens):
+    def __init__(self, max_input_prompt_tokens, reference_cache=None, use_reference_summaries=False):
         super().__init__()
 
         self.max_input_prompt_tokens = max_input_prompt_tokens
+        # corpus-level cache of the reference blocks keyed by PMID
+        self.reference_cache = reference_cache
+        self.use_reference_summaries = use_reference_summaries
+
+    def truncate_prompt(self, prompt: str, encoding: tiktoken.Encoding) -> str:
+        """
+        Cut a prompt that is too long to exactly `max_input_prompt_tokens` tokens.
+
+        :param prompt: The prompt to be truncated.
+        :type prompt: str
+        :param encoding: The tokenizer.
+        :type encoding: tiktoken.Encoding
+        :return: The truncated prompt.
+        :rtype: str
+        """
+        with trace_span("truncate_prompt", "tokenize", chars=len(prompt)):
+            truncated_prompt, cut = truncate_to_tokens(
+                prompt, self.max_input_prompt_tokens, encoding
+            )
+        if cut is not None:
+            logging.debug(
+                f"Prompt truncated to {self.max_input_prompt_tokens} tokens at character {cut} of {len(prompt)}"
+            )
+        return truncated_prompt
+
+    def reference_prompt(
+        self, reference_info: Dict[str, str], encoding: tiktoken.Encoding, reference_ids: Optional[List[str]] = None
+    ) -> Tuple[str, int]:
+        """
+        Build the <reference> block of a prompt and count its tokens. If the PMIDs of the references are known,
+        the block is taken from the reference cache, where each reference is stored and tokenised once for all
+        articles that cite it.
+
+        :param reference_info: The abstracts of the references keyed by their titles.
+        :type reference_info: Dict[str, str]
+        :param encoding: The tokenizer.
+        :type encoding: tiktoken.Encoding
+        :param reference_ids: The PMIDs of the references. Defaults to None.
+        :type reference_ids: Optional[List[str]]
+        :return: The reference block, empty if there are no references, and its number of tokens. Without
+            the PMIDs the number is 0 and the references are not checked against `max_input_prompt_tokens`.
+        :rtype: Tuple[str, int]
+        """
+        if self.reference_cache is not None and reference_ids is not None:
+            if len(reference_ids) == 0:
+                return '', 0
+            reference = self.reference_cache.block(reference_ids, self.use_reference_summaries)
+            reference_len = self.reference_cache.num_tokens(
+                reference_ids, self.use_reference_summaries
+            ) + count_tokens('<reference></reference>', encoding)
+            if self.use_reference_summaries and logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug(
+                    "Reference block of %s tokens instead of %s",
+                    reference_len,
+                    self.reference_cache.num_tokens(reference_ids),
+                )
+            return reference, reference_len
+        reference = ''
+        if len(reference_info.keys())>0:
+            reference += '<reference>'
+            for key in reference_info.keys():
+                reference += '<title>' + key + '</title>'
+                reference += '<abstract>' + reference_info[key] + '</abstract>'
+            reference += '</reference>'
+        return reference, 0
 
     def aggregation_prompt(self, state_dicts: List[Dict], **kwargs) -> str:
         """
@@ -109,9 +185,10 @@ Here is the origin article information <origin>:
 
         global generate_prompt_nums
         global cut_abstract_nums
-        generate_prompt_nums[str(self.max_input_prompt_tokens)] += 1
+        with prompt_nums_lock:
+            generate_prompt_nums[str(self.max_input_prompt_tokens)] += 1
 
-        encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        encoding = get_encoding_for_model("gpt-3.5-turbo")
 
         prompt = self.aggregate_full_prompt_base.format(
             num_abstract=len(state_dicts),
@@ -121,6 +198,7 @@ Here is the origin article information <origin>:
                 abstract=state_dict["current"], num=i + 1
             )
 
+        # 含有当前摘要，只编码一次，不进入缓存
         base_len = len(encoding.encode(prompt))
 
         origin = ''
@@ -130,30 +208,26 @@ Here is the origin article information <origin>:
         for key in state_dicts[0]["origin_info"].keys():
             origin += '<' + key + '>' + state_dicts[0]["origin_info"][key] + '</' + key + '>'
 
-        origin_len = len(encoding.encode(origin))
+        origin_len = count_tokens(origin, encoding)
         if base_len + origin_len > self.max_input_prompt_tokens:
-            cut_abstract_nums[str(self.max_input_prompt_tokens)] += 1
+            with prompt_nums_lock:
+                cut_abstract_nums[str(self.max_input_prompt_tokens)] += 1
             prompt += self.aggregate_full_prompt_end.format(
                 origin=origin, reference=reference
             )
-            prompt_token_count = len(encoding.encode(prompt))
-            idx = len(prompt)
-            while prompt_token_count > self.max_input_prompt_tokens:
-                prompt = prompt[:idx]
-                prompt_token_count = len(encoding.encode(prompt))
-                # print(prompt_token_count)
-                idx = idx - 100
-            return prompt
+            return self.truncate_prompt(prompt, encoding)
         
-        if len(state_dicts[0]["reference_info"].keys())>0:
-            reference += '<reference>'
-            for key in state_dicts[0]["reference_info"].keys():
-                reference += '<title>' + key + '</title>'
-                reference += '<abstract>' + state_dicts[0]["reference_info"][key] + '</abstract>'
-            reference += '</reference>'
+        reference, reference_len = self.reference_prompt(
+            state_dicts[0]["reference_info"], encoding, state_dicts[0].get("reference_ids")
+        )
         prompt += self.aggregate_full_prompt_end.format(
             origin=origin, reference=reference
         )
+        # 参考文献超出长度限制时截断
+        if base_len + origin_len + reference_len > self.max_input_prompt_tokens:
+            with prompt_nums_lock:
+                cut_abstract_nums[str(self.max_input_prompt_tokens)] += 1
+            return self.truncate_prompt(prompt, encoding)
 
         return prompt
 
@@ -167,6 +241,7 @@ Here is the origin article information <origin>:
         method: str,
         #parts: Set[str],
         current: str,
+        reference_ids: Optional[List[str]] = None,
         **kwargs,
     ) -> str:
         """
@@ -182,6 +257,8 @@ Here is the origin article information <origin>:
         :type parts: Set[str]
         :param current: The intermediate solution.
         :type current: str
+        :param reference_ids: The PMIDs of the references, used to look them up in the reference cache.
+        :type reference_ids: Optional[List[str]]
         :param kwargs: Additional keyword arguments.
         :return: The generate prompt.
         :rtype: str
@@ -190,9 +267,10 @@ Here is the origin article information <origin>:
 
         global generate_prompt_nums
         global cut_abstract_nums
-        generate_prompt_nums[str(self.max_input_prompt_tokens)] += 1
+        with prompt_nums_lock:
+            generate_prompt_nums[str(self.max_input_prompt_tokens)] += 1
 
-        encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        encoding = get_encoding_for_model("gpt-3.5-turbo")
 
         prompt = ""
         if method.startswith("io") or method.startswith("cot"):
@@ -201,7 +279,7 @@ Here is the origin article information <origin>:
             else:
                 prompt += self.generate_abstract_prompt_cot_start
             
-            base_len = len(encoding.encode(prompt))
+            base_len = count_tokens(prompt, encoding)
 
             origin = ''
             reference = ''
@@ -210,30 +288,24 @@ Here is the origin article information <origin>:
             for key in origin_info.keys():
                 origin += '<' + key + '>' + origin_info[key] + '</' + key + '>'
 
-            origin_len = len(encoding.encode(origin))
+            origin_len = count_tokens(origin, encoding)
             if base_len + origin_len > self.max_input_prompt_tokens:
-                cut_abstract_nums[str(self.max_input_prompt_tokens)] += 1
+                with prompt_nums_lock:
+                    cut_abstract_nums[str(self.max_input_prompt_tokens)] += 1
                 prompt += self.aggregate_full_prompt_end.format(
                     origin=origin, reference=reference
                 )
-                prompt_token_count = len(encoding.encode(prompt))
-                idx = len(prompt)
-                while prompt_token_count > self.max_input_prompt_tokens:
-                    prompt = prompt[:idx]
-                    prompt_token_count = len(encoding.encode(prompt))
-                    # print(prompt_token_count)
-                    idx = idx - 100
-                return prompt
+                return self.truncate_prompt(prompt, encoding)
 
-            if len(reference_info.keys())>0:
-                reference += '<reference>'
-                for key in reference_info.keys():
-                    reference += '<title>' + key + '</title>'
-                    reference += '<abstract>' + reference_info[key] + '</abstract>'
-                reference += '</reference>'
+            reference, reference_len = self.reference_prompt(reference_info, encoding, reference_ids)
             prompt += self.generate_abstract_prompt_block.format(
                 origin=origin, reference=reference
             )
+            # 参考文献超出长度限制时截断
+            if base_len + origin_len + reference_len > self.max_input_prompt_tokens:
+                with prompt_nums_lock:
+                    cut_abstract_nums[str(self.max_input_prompt_tokens)] += 1
+                return self.truncate_prompt(prompt, encoding)
 
             return prompt
 
@@ -242,7 +314,7 @@ Here is the origin article information <origin>:
             if current is None or current == "":
                 prompt += self.generate_abstract_prompt_start
 
-                base_len = len(encoding.encode(prompt))
+                base_len = count_tokens(prompt, encoding)
 
                 origin = ''
                 reference = ''
@@ -251,35 +323,29 @@ Here is the origin article information <origin>:
                 for key in origin_info.keys():
                     origin += '<' + key + '>' + origin_info[key] + '</' + key + '>'
 
-                origin_len = len(encoding.encode(origin))
+                origin_len = count_tokens(origin, encoding)
                 if base_len + origin_len > self.max_input_prompt_tokens:
-                    cut_abstract_nums[str(self.max_input_prompt_tokens)] += 1
+                    with prompt_nums_lock:
+                        cut_abstract_nums[str(self.max_input_prompt_tokens)] += 1
                     prompt += self.aggregate_full_prompt_end.format(
                         origin=origin, reference=reference
                     )
-                    prompt_token_count = len(encoding.encode(prompt))
-                    idx = len(prompt)
-                    while prompt_token_count > self.max_input_prompt_tokens:
-                        prompt = prompt[:idx]
-                        prompt_token_count = len(encoding.encode(prompt))
-                        # print(prompt_token_count)
-                        idx = idx - 100
-                    return prompt
-
-                if len(reference_info.keys())>0:
-                    reference += '<reference>'
-                    for key in reference_info.keys():
-                        reference += '<title>' + key + '</title>'
-                        reference += '<abstract>' + reference_info[key] + '</abstract>'
-                    reference += '</reference>'
+                    return self.truncate_prompt(prompt, encoding)
+
+                reference, reference_len = self.reference_prompt(reference_info, encoding, reference_ids)
                 prompt += self.generate_abstract_prompt_block.format(
                     origin=origin, reference=reference
                 )
+                # 参考文献超出长度限制时截断
+                if base_len + origin_len + reference_len > self.max_input_prompt_tokens:
+                    with prompt_nums_lock:
+                        cut_abstract_nums[str(self.max_input_prompt_tokens)] += 1
+                    return self.truncate_prompt(prompt, encoding)
 
                 return prompt
             else:
                 prompt += self.improve_abstract_prompt_start
-                base_len = len(encoding.encode(prompt))
+                base_len = count_tokens(prompt, encoding)
 
                 origin = ''
                 reference = ''
@@ -288,33 +354,27 @@ Here is the origin article information <origin>:
                 for key in origin_info.keys():
                     origin += '<' + key + '>' + origin_info[key] + '</' + key + '>'
 
-                origin_len = len(encoding.encode(origin))
+                origin_len = count_tokens(origin, encoding)
                 if base_len + origin_len > self.max_input_prompt_tokens:
-                    cut_abstract_nums[str(self.max_input_prompt_tokens)] += 1
+                    with prompt_nums_lock:
+                        cut_abstract_nums[str(self.max_input_prompt_tokens)] += 1
                     prompt += self.aggregate_full_prompt_end.format(
                         origin=origin, reference=reference
                     )
-                    prompt_token_count = len(encoding.encode(prompt))
-                    idx = len(prompt)
-                    while prompt_token_count > self.max_input_prompt_tokens:
-                        prompt = prompt[:idx]
-                        prompt_token_count = len(encoding.encode(prompt))
-                        # print(prompt_token_count)
-                        idx = idx - 100
-                    return prompt
-
-                if len(reference_info.keys())>0:
-                    reference += '<reference>'
-                    for key in reference_info.keys():
-                        reference += '<title>' + key + '</title>'
-                        reference += '<abstract>' + reference_info[key] + '</abstract>'
-                    reference += '</reference>'
+                    return self.truncate_prompt(prompt, encoding)
+
+                reference, reference_len = self.reference_prompt(reference_info, encoding, reference_ids)
                 prompt += self.improve_abstract_prompt_block.format(
                     abstract = current
                 )
                 prompt += self.improve_abstract_prompt_end.format(
                     origin=origin, reference=reference
                 )
+                # 参考文献超出长度限制时截断
+                if base_len + origin_len + reference_len > self.max_input_prompt_tokens:
+                    with prompt_nums_lock:
+                        cut_abstract_nums[str(self.max_input_prompt_tokens)] += 1
+                    return self.truncate_prompt(prompt, encoding)
 
                 return prompt
         else:
@@ -497,7 +557,7 @@ def io() -> operations.GraphOfOperations:
     operations_graph = operations.GraphOfOperations()
 
     operations_graph.append_operation(operations.Generate(1, 1))
-    operations_graph.append_operation(operations.Score(1, False, rouge1_f_gold_summary))
+    operations_graph.append_operation(operations.Score(1, True, rouge1_f_gold_summary))
 
     return operations_graph
 
@@ -512,72 +572,86 @@ def cot() -> operations.GraphOfOperations:
     operations_graph = operations.GraphOfOperations()
 
     operations_graph.append_operation(operations.Generate(1, 1))
-    operations_graph.append_operation(operations.Score(1, False, rouge1_f_gold_summary))
+    operations_graph.append_operation(operations.Score(1, True, rouge1_f_gold_summary))
 
     return operations_graph
 
 
-def tot(branch_factor: int) -> operations.GraphOfOperations:
+def tot(
+    branch_factor: int, max_concurrent_queries: Optional[int] = None
+) -> operations.GraphOfOperations:
     """
     Generates the Graph of Operations for the ToT method.
 
+    :param max_concurrent_queries: Maximum number of concurrent LM requests of each operation.
+    :type max_concurrent_queries: Optional[int]
     :return: Graph of Operations
     :rtype: GraphOfOperations
     """
     operations_graph = operations.GraphOfOperations()
 
-    operations_graph.append_operation(operations.Generate(1, branch_factor))
-    operations_graph.append_operation(operations.Score(branch_factor, False, rouge1_f_test_introduction))
+    operations_graph.append_operation(operations.Generate(1, branch_factor, max_concurrent_queries))
+    operations_graph.append_operation(operations.Score(branch_factor, True, rouge1_f_test_introduction))
     keep_best_1 = operations.KeepBestN(1, True)
     operations_graph.append_operation(keep_best_1)
 
     for _ in range(2):
-        operations_graph.append_operation(operations.Generate(1, branch_factor))
-        operations_graph.append_operation(operations.Score(branch_factor, False, rouge1_f_test_introduction))
+        operations_graph.append_operation(operations.Generate(1, branch_factor, max_concurrent_queries))
+        operations_graph.append_operation(operations.Score(branch_factor, True, rouge1_f_test_introduction))
         keep_best_2 = operations.KeepBestN(1, True)
         keep_best_2.add_predecessor(keep_best_1)
         operations_graph.append_operation(keep_best_2)
         keep_best_1 = keep_best_2
     
-    operations_graph.append_operation(operations.Score(1, False, rouge1_f_gold_summary))
+    operations_graph.append_operation(operations.Score(1, True, rouge1_f_gold_summary))
 
     return operations_graph
 
 
-def got(branch_factor: int) -> operations.GraphOfOperations:
+def got(
+    branch_factor: int, max_concurrent_queries: Optional[int] = None
+) -> operations.GraphOfOperations:
     """
     Generates the Graph of Operations for the GoT method, where generate thoughts
     are merged.
 
+    :param max_concurrent_queries: Maximum number of concurrent LM requests of each operation.
+    :type max_concurrent_queries: Optional[int]
     :return: Graph of Operations
     :rtype: GraphOfOperations
     """
     operations_graph = operations.GraphOfOperations()
 
-    operations_graph.append_operation(operations.Generate(1, branch_factor))
-    operations_graph.append_operation(operations.Score(branch_factor, False, rouge1_f_test_introduction))
+    operations_graph.append_operation(operations.Generate(1, branch_factor, max_concurrent_queries))
+    operations_graph.append_operation(operations.Score(branch_factor, True, rouge1_f_test_introduction))
     keep_best = operations.KeepBestN(3, True)
     operations_graph.append_operation(keep_best)
-    operations_graph.append_operation(operations.Aggregate(branch_factor))
-    operations_graph.append_operation(operations.Score(branch_factor, False, rouge1_f_test_introduction))
+    operations_graph.append_operation(operations.Aggregate(branch_factor, max_concurrent_queries))
+    operations_graph.append_operation(operations.Score(branch_factor, True, rouge1_f_test_introduction))
     keep_best2 = operations.KeepBestN(1, True)
     keep_best2.add_predecessor(keep_best)
     operations_graph.append_operation(keep_best2)
-    operations_graph.append_operation(operations.Generate(1, branch_factor))
-    operations_graph.append_operation(operations.Score(branch_factor, False, rouge1_f_test_introduction))
+    operations_graph.append_operation(operations.Generate(1, branch_factor, max_concurrent_queries))
+    operations_graph.append_operation(operations.Score(branch_factor, True, rouge1_f_test_introduction))
     keep_best3 = operations.KeepBestN(1, True)
     keep_best3.add_predecessor(keep_best2)
     operations_graph.append_operation(keep_best3)
-    operations_graph.append_operation(operations.Score(1, False, rouge1_f_gold_summary))
+    operations_graph.append_operation(operations.Score(1, True, rouge1_f_gold_summary))
 
     return operations_graph
 
 
-def dgot(branch_factor: int, thresh: List[float]) -> operations.GraphOfOperations:
+def dgot(
+    branch_factor: int,
+    thresh: List[float],
+    max_concurrent_queries: Optional[int] = None,
+) -> operations.GraphOfOperations:
     """
     Generates the Graph of Operations for the GoT method, where generate thoughts
     are merged.
 
+    :param max_concurrent_queries: Maximum number of concurrent LM requests of each operation.
+    :type max_concurrent_queries: Optional[int]
     :return: Graph of Operations
     :rtype: GraphOfOperations
 
@@ -590,24 +664,97 @@ def dgot(branch_factor: int, thresh: List[float]) -> operations.GraphOfOperation
         thresh = [0.29, 0.31, 0.32]
     operations_graph = operations.GraphOfOperations()
 
-    operations_graph.append_operation(operations.DGenerateScore(1, branch_factor, rouge1_f_test_introduction, thresh[0]))
-    operations_graph.append_operation(operations.Score(branch_factor, False, rouge1_f_test_introduction))
+    operations_graph.append_operation(operations.DGenerateScore(1, branch_factor, rouge1_f_test_introduction, thresh[0], max_concurrent_queries))
+    operations_graph.append_operation(operations.Score(branch_factor, True, rouge1_f_test_introduction))
     keep_best = operations.KeepBestN(branch_factor, True)
     operations_graph.append_operation(keep_best)
-    operations_graph.append_operation(operations.DAggregate(branch_factor, rouge1_f_test_introduction, thresh[1], thresh[0]))
-    operations_graph.append_operation(operations.Score(branch_factor, False, rouge1_f_test_introduction))
+    operations_graph.append_operation(operations.DAggregate(branch_factor, rouge1_f_test_introduction, thresh[1], thresh[0], max_concurrent_queries))
+    operations_graph.append_operation(operations.Score(branch_factor, True, rouge1_f_test_introduction))
     keep_best2 = operations.KeepBestN(1, True)
     keep_best2.add_predecessor(keep_best)
     operations_graph.append_operation(keep_best2)
-    operations_graph.append_operation(operations.DGenerateScore(1, branch_factor, rouge1_f_test_introduction, thresh[2]))
-    operations_graph.append_operation(operations.Score(branch_factor, False, rouge1_f_test_introduction))
+    operations_graph.append_operation(operations.DGenerateScore(1, branch_factor, rouge1_f_test_introduction, thresh[2], max_concurrent_queries))
+    operations_graph.append_operation(operations.Score(branch_factor, True, rouge1_f_test_introduction))
     keep_best3 = operations.KeepBestN(1, True)
     keep_best3.add_predecessor(keep_best2)
     operations_graph.append_operation(keep_best3)
-    operations_graph.append_operation(operations.Score(1, False, rouge1_f_gold_summary))
+    operations_graph.append_operation(operations.Score(1, True, rouge1_f_gold_summary))
 
     return operations_graph
 
+class SharedBudget:
+    """
+    Budget in dollars that is shared by the concurrently executed runs.
+    It is charged with the actual cost of every language model request.
+    """
+
+    def __init__(self, budget: float) -> None:
+        """
+        Initializes the shared budget.
+
+        :param budget: Language model budget in dollars.
+        :type budget: float
+        """
+        self.lock = threading.Lock()
+        self._remaining = budget
+
+    def charge(self, prompt_tokens: int, completion_tokens: int, cost: float) -> None:
+        """
+        Deducts the cost of a single request. Used as usage callback of the language models.
+
+        :param prompt_tokens: Number of prompt tokens used by the request.
+        :type prompt_tokens: int
+        :param completion_tokens: Number of completion tokens used by the request.
+        :type completion_tokens: int
+        :param cost: Cost of the request in dollars.
+        :type cost: float
+        """
+        with self.lock:
+            self._remaining -= cost
+
+    @property
+    def remaining(self) -> float:
+        """
+        The remaining budget in dollars.
+        """
+        with self.lock:
+            return self._remaining
+
+
+def create_lm(
+    lm_name: str, cache: Union[bool, controller.ResponseCache] = False
+) -> controller.AbstractLanguageModel:
+    """
+    Creates the language model client for the given configuration key.
+
+    :param lm_name: Name of the language model to be used.
+    :type lm_name: str
+    :param cache: Flag to cache responses in memory, or the response cache to use. Defaults to False.
+    :type cache: Union[bool, ResponseCache]
+    :return: The language model.
+    :rtype: AbstractLanguageModel
+    """
+    if "internlm" in lm_name:
+        lm = controller.InternLM2(
+            "./graph_of_thoughts/controller/config.json",
+            model_name=lm_name,
+            cache=cache,
+        )
+    elif "chatglm" in lm_name:
+        lm = controller.ChatGLM(
+            "./graph_of_thoughts/controller/config.json",
+            model_name=lm_name,
+            cache=cache,
+        )
+    elif "chatgpt" in lm_name:
+        lm = controller.ChatGPT(
+            "./graph_of_thoughts/controller/config.json",
+            model_name=lm_name,
+            cache=cache,
+        )
+    return lm
+
+
 def run(
     data_ids: List[int],
     methods: List[Callable[[], operations.GraphOfOperations]],
@@ -620,10 +767,24 @@ def run(
     data_path: str, #= './data/available_induc_test_graph.json',
     save_pmc_folder: str, # = './data/available_induc_test/pmc/',
     save_pm_folder: str, # = './data/available_induc_test/pm/',
+    max_parallel_operations: int = 1,
+    use_async: bool = False,
+    max_concurrent_queries: Optional[int] = None,
+    workers: int = 1,
+    cache_path: Optional[str] = None,
+    corpus_path: Optional[str] = None,
+    summarize_references: bool = False,
+    reference_cache_path: Optional[str] = None,
+    profile: bool = False,
+    metrics_port: Optional[int] = None,
+    release_thoughts: bool = False,
+    spill_dir: Optional[str] = None,
 ) -> float:
     """
     Controller function that executes each specified method for each specified
     sample while the budget is not exhausted.
+    Each combination of sample, method, input prompt length and node number is a
+    cell, up to `workers` cells are executed concurrently.
 
     :param data_ids: Indices of the sample to be run.
     :type data_ids: List[int]
@@ -639,20 +800,50 @@ def run(
     :type budget: float
     :param lm_name: Name of the language model to be used.
     :type lm_name: str
+    :param max_parallel_operations: Maximum number of ready operations the controller executes concurrently.
+    :type max_parallel_operations: int
+    :param use_async: Whether to execute the operations with the asynchronous controller.
+    :type use_async: bool
+    :param max_concurrent_queries: Maximum number of concurrent LM requests of each operation.
+    :type max_concurrent_queries: Optional[int]
+    :param workers: Number of cells that are executed concurrently. Defaults to 1.
+    :type workers: int
+    :param cache_path: Path to a SQLite database in which the LM responses are cached across runs.
+                       Defaults to None (no caching).
+    :type cache_path: Optional[str]
+    :param corpus_path: Path to a packed corpus written by get_data.py, the articles are loaded from it instead
+                        of the JSON files in `save_pmc_folder` and `save_pm_folder`. Defaults to None.
+    :type corpus_path: Optional[str]
+    :param summarize_references: Whether the abstracts of the references are replaced in the prompts by
+                                 one-sentence summaries, which the LM generates once per reference. Defaults to False.
+    :type summarize_references: bool
+    :param reference_cache_path: Path to a JSON file in which the summaries of the references are kept
+                                 across runs. Defaults to None.
+    :type reference_cache_path: Optional[str]
+    :param profile: Whether the operations, prompts, LM requests, parsing and scoring of all cells are
+                    profiled. The spans are written to trace.json (Chrome trace) and profile.csv. Defaults to False.
+    :type profile: bool
+    :param metrics_port: Port on which the LM latency, token, cost, cache and retry metrics are served in the
+                         Prometheus text format while the cells are executed. Defaults to None (not served).
+                         A snapshot of the metrics is written to metrics.json in any case.
+    :type metrics_port: Optional[int]
+    :param release_thoughts: Whether the controllers release the thoughts of an operation once all of its
+                             successors have been executed, which bounds the memory of wide graphs. Defaults to False.
+    :type release_thoughts: bool
+    :param spill_dir: Directory in which the released operations are spilled to temporary files, so that the
+                      output graphs still contain their thoughts. Defaults to None (released operations are
+                      written without thoughts).
+    :type spill_dir: Optional[str]
     :return: Spent budget in dollars.
     :rtype: float
     """
 
     orig_budget = budget
-    # 打开JSON文件
-    with open(data_path, 'r') as json_file:
-        # 从文件中加载JSON数据
-        data = json.load(json_file)
-
-    if data_ids is None or len(data_ids) == 0:
-        data_ids = list(range(len(data['PMCid'])))
-    selected_data = [data['PMCid'][i] for i in data_ids]
-    selected_data_reference = [data['references'][i] for i in data_ids]
+    # 只读取选中的文章，不加载整个图文件
+    with GraphReader(data_path) as graph:
+        if data_ids is None or len(data_ids) == 0:
+            data_ids = list(range(len(graph)))
+        selected_data, selected_data_reference = graph.select(data_ids)
 
     if not os.path.exists(os.path.join(os.path.dirname(__file__), "results")):
         os.makedirs(os.path.join(os.path.dirname(__file__), "results"))
@@ -680,122 +871,185 @@ def run(
     )
 
     inference_time_dict = {}
+    inference_queue_time_dict = {}
     inference_num_dict = {}
 
+    cells = []
     for method in methods:
         for max_input_prompt_tokens in max_input_prompt_tokens_list:
             for node_num in node_nums:
+                cell_name = method.__name__+'_'+str(max_input_prompt_tokens)+'_'+str(node_num)
                 os.makedirs(
-                    os.path.join(os.path.dirname(__file__), folder_name, method.__name__+'_'+str(max_input_prompt_tokens)+'_'+str(node_num))
+                    os.path.join(os.path.dirname(__file__), folder_name, cell_name)
                 )
-                inference_time_dict[method.__name__+'_'+str(max_input_prompt_tokens)+'_'+str(node_num)] = 0
-                inference_num_dict[method.__name__+'_'+str(max_input_prompt_tokens)+'_'+str(node_num)] = 0
-    
+                inference_time_dict[cell_name] = 0
+                inference_queue_time_dict[cell_name] = 0
+                inference_num_dict[cell_name] = 0
+
     # 遍历每篇文章数据
-    for index, data in tqdm(enumerate(selected_data), total=len(selected_data)):
-        logging.info(f"Running data {data}")
-        if budget <= 0.0:
-            logging.error(
-                f"Budget has been depleted, stopping. Data {data} has not been run."
-            )
-            break
+    for index, data in enumerate(selected_data):
+        for method in methods:
+            for max_input_prompt_tokens in max_input_prompt_tokens_list:
+                for node_num in node_nums:
+                    cells.append((index, data, method, max_input_prompt_tokens, node_num))
+
+    shared_budget = SharedBudget(budget)
+    response_cache = (
+        controller.SQLiteResponseCache(cache_path) if cache_path is not None else False
+    )
+    # language model clients, one per worker thread
+    worker_state = threading.local()
+
+    corpus = PackedCorpus(corpus_path) if corpus_path is not None else None
+    # 参考文献按PMID缓存，引用同一文献的文章共享
+    reference_cache = ReferenceCache()
+    if reference_cache_path is not None and os.path.exists(reference_cache_path):
+        reference_cache.load(reference_cache_path)
+    profiler = Profiler() if profile else None
+    metrics_server = metrics_registry.serve(metrics_port) if metrics_port is not None else None
+
+    @functools.lru_cache(maxsize=2 * workers)
+    def load_article(data: str):
+        if corpus is not None:
+            return corpus.article(data)
         # 读取源文章及参考文献数据
         # 源文章
-        #save_pmc_folder = './data/available_induc_test/pmc/'
-        origin_path = save_pmc_folder + data + '.json'
         # dict = {'article_title_text': article_title_text, 'abstract_text': abstract_text,
         #       'introduction_text': introduction_text, 'sec_dict': sec_dict}
+        origin_path = save_pmc_folder + data + '.json'
         with open(origin_path, 'r') as json_file:
             pmc_dict = json.load(json_file)
         # 参考文献
-        #save_pm_folder = './data/available_induc_test/pm/'
         reference_path = save_pm_folder + data + '.json'
         with open(reference_path, 'r') as json_file:
             reference_title_abstract_dict = json.load(json_file)
+        return pmc_dict, reference_title_abstract_dict
 
-        for method in methods:
-            for max_input_prompt_tokens in max_input_prompt_tokens_list:
-                for node_num in node_nums:
-                    logging.info(f"Running method {method.__name__}")
-                    logging.info(f"Input prompt tokens length {max_input_prompt_tokens}")
-                    logging.info(f"Node number {node_num}")
-                    logging.info(f"Budget left: {budget}")
-                    # record start time
-                    start_time = time.time()
-
-                    if budget <= 0.0:
-                        logging.error(
-                            f"Budget has been depleted, stopping. Method {method.__name__} has not been run."
-                        )
-                        break
-                    if "internlm" in lm_name:
-                        lm = controller.InternLM2(
-                            "./graph_of_thoughts/controller/config.json",
-                            model_name=lm_name,
-                            cache=False,
-                        )
-                    elif "chatglm" in lm_name:
-                        lm = controller.ChatGLM(
-                            "./graph_of_thoughts/controller/config.json",
-                            model_name=lm_name,
-                            cache=False,
-                        )
-                    elif "chatgpt" in lm_name:
-                        lm = controller.ChatGPT(
-                            "./graph_of_thoughts/controller/config.json",
-                            model_name=lm_name,
-                            cache=False,
-                        )
-                    if method.__name__=="tot" or method.__name__=="got":
-                        operations_graph = method(node_num)
-                    elif method.__name__=="dgot":
-                        operations_graph = method(node_num, thresh)
-                    else:
-                        operations_graph = method()
-                    executor = controller.Controller(
-                        lm,
-                        operations_graph,
-                        GenAbstractPrompter(max_input_prompt_tokens=max_input_prompt_tokens),
-                        GenAbstractParser(),
-                        {
-                            "origin_title": pmc_dict["article_title_text"],
-                            "origin_abstract": pmc_dict["abstract_text"],
-                            "origin_introduction": pmc_dict["introduction_text"],
-                            "origin_info": pmc_dict["sec_dict"],
-                            "reference_info": reference_title_abstract_dict,
-                            "current": "",
-                            "method": method.__name__,
-                        },
-                    )
-                    try:
-                        executor.run()
-                    except Exception as e:
-                        logging.error(f"Exception: {e}")
-
-                    # record end time
-                    end_time = time.time()
-                    execution_time = end_time - start_time
-                    inference_time_dict[method.__name__+'_'+str(max_input_prompt_tokens)+'_'+str(node_num)] += execution_time
-                    inference_num_dict[method.__name__+'_'+str(max_input_prompt_tokens)+'_'+str(node_num)] += 1
-
-                    path = os.path.join(
-                        os.path.dirname(__file__),
-                        folder_name,
-                        method.__name__+'_'+str(max_input_prompt_tokens)+'_'+str(node_num),
-                        f"{data_ids[0] + index}.json",
-                    )
-                    # for operation in operations_graph.operations:
-                    #     for thought in operation.thoughts:
-                    #         thought.state["parts"] = list(thought.state["parts"])
-                    # 输出结果与 gold summary 比较
+    def run_cell(index, data, method, max_input_prompt_tokens, node_num, submit_time):
+        # record start time
+        start_time = time.time()
+        cell_name = method.__name__+'_'+str(max_input_prompt_tokens)+'_'+str(node_num)
+        logging.info(f"Running data {data}")
+        logging.info(f"Running method {method.__name__}")
+        logging.info(f"Input prompt tokens length {max_input_prompt_tokens}")
+        logging.info(f"Node number {node_num}")
+        logging.info(f"Budget left: {shared_budget.remaining}")
+
+        if shared_budget.remaining <= 0.0:
+            logging.error(
+                f"Budget has been depleted, stopping. Method {method.__name__} has not been run on data {data}."
+            )
+            return None
+
+        pmc_dict, reference_title_abstract_dict = load_article(data)
+        reference_ids = reference_cache.add_article(
+            selected_data_reference[index], reference_title_abstract_dict
+        )
 
-                    executor.output_graph(path)
-                    budget -= lm.cost
+        lm = getattr(worker_state, "lm", None)
+        if lm is None:
+            lm = create_lm(lm_name, response_cache)
+            lm.usage_callbacks.append(shared_budget.charge)
+            worker_state.lm = lm
+        if summarize_references and reference_ids is not None:
+            # 每篇参考文献只摘要一次，费用计入总预算
+            with trace_span("summarize_references", "lm", references=len(reference_ids)):
+                reference_cache.summarize(lm, reference_ids)
+        lm.reset_usage()
+
+        if method.__name__=="tot" or method.__name__=="got":
+            operations_graph = method(node_num, max_concurrent_queries)
+        elif method.__name__=="dgot":
+            operations_graph = method(node_num, thresh, max_concurrent_queries)
+        else:
+            operations_graph = method()
+        controller_class = (
+            controller.AsyncController if use_async else controller.Controller
+        )
+        executor = controller_class(
+            lm,
+            operations_graph,
+            GenAbstractPrompter(
+                max_input_prompt_tokens=max_input_prompt_tokens,
+                reference_cache=reference_cache,
+                use_reference_summaries=summarize_references,
+            ),
+            GenAbstractParser(),
+            {
+                "origin_title": pmc_dict["article_title_text"],
+                "origin_abstract": pmc_dict["abstract_text"],
+                "origin_introduction": pmc_dict["introduction_text"],
+                "origin_info": pmc_dict["sec_dict"],
+                "reference_info": reference_title_abstract_dict,
+                "reference_ids": reference_ids,
+                "current": "",
+                "method": method.__name__,
+            },
+            max_parallel_operations=max_parallel_operations,
+            scoring_context_factory=scoring_context,
+            profiler=profiler,
+            release_thoughts=release_thoughts,
+            spill_dir=spill_dir,
+        )
+        try:
+            executor.run()
+        except Exception as e:
+            logging.error(f"Exception: {e}")
+
+        # record end time
+        end_time = time.time()
+
+        path = os.path.join(
+            os.path.dirname(__file__),
+            folder_name,
+            cell_name,
+            f"{data_ids[0] + index}.json",
+        )
+        # 输出结果与 gold summary 比较
+        executor.output_graph(path)
+        # 删除溢出到磁盘的中间结果
+        executor.close()
+        return cell_name, end_time - start_time, start_time - submit_time
+
+    def profile_cell(index, data, method, max_input_prompt_tokens, node_num, submit_time):
+        if profiler is None:
+            return run_cell(index, data, method, max_input_prompt_tokens, node_num, submit_time)
+        # 每个单元一个 span，包含其引用摘要与全部操作
+        cell_name = method.__name__+'_'+str(max_input_prompt_tokens)+'_'+str(node_num)
+        with profiler.span(cell_name, "cell", data=data):
+            return run_cell(index, data, method, max_input_prompt_tokens, node_num, submit_time)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        submit_time = time.time()
+        futures = [pool.submit(profile_cell, *cell, submit_time) for cell in cells]
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            result = future.result()
+            if result is None:
+                continue
+            cell_name, execution_time, queue_time = result
+            inference_time_dict[cell_name] += execution_time
+            inference_queue_time_dict[cell_name] += queue_time
+            inference_num_dict[cell_name] += 1
+    budget = shared_budget.remaining
+    with open(os.path.join(os.path.dirname(__file__), folder_name, "metrics.json"), "w") as f:
+        json.dump(metrics_registry.snapshot(), f)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    if profiler is not None:
+        profiler.to_chrome_trace(os.path.join(os.path.dirname(__file__), folder_name, "trace.json"))
+        profiler.to_csv(os.path.join(os.path.dirname(__file__), folder_name, "profile.csv"))
+    if corpus is not None:
+        corpus.close()
+    if summarize_references and reference_cache_path is not None:
+        reference_cache.save(reference_cache_path)
+    if response_cache:
+        logging.info(f"Response cache statistics: {response_cache.stats()}")
 
     # save inference time as .txt
-    data_to_write = "approach_max_input_prompt_length time(s) inference_num time_per_inference\n"
+    data_to_write = "approach_max_input_prompt_length time(s) inference_num time_per_inference queue_time(s) queue_time_per_inference\n"
     for key, value in inference_time_dict.items():
-        data_to_write += f"{key} {value} {inference_num_dict[key]} {value/inference_num_dict[key]}\n"
+        num = max(inference_num_dict[key], 1)
+        data_to_write += f"{key} {value} {inference_num_dict[key]} {value/num} {inference_queue_time_dict[key]} {inference_queue_time_dict[key]/num}\n"
 
     file_name = os.path.join(
                 os.path.dirname(__file__),
@@ -843,6 +1097,17 @@ if __name__ == "__main__":
     parser.add_argument('--thresh_a', type=float, default=0.31, help='threshold for dgot aggregate transformation')
     parser.add_argument('--thresh_i', type=float, default=0.32, help='threshold for dgot inprove transformation')
     parser.add_argument('--prompt_length', type=int, default=4096, help='Length of input prompt')
+    parser.add_argument('--max_parallel_operations', type=int, default=1, help='Number of ready operations executed concurrently')
+    parser.add_argument('--use_async', action='store_true', help='Query the language model asynchronously')
+    parser.add_argument('--max_concurrent_queries', type=int, default=None, help='Number of concurrent LM requests of each operation')
+    parser.add_argument('--workers', type=int, default=1, help='Number of article/config cells run concurrently')
+    parser.add_argument('--cache_path', type=str, default=None, help='SQLite file to cache LM responses across runs')
+    parser.add_argument('--summarize_references', action='store_true', help='Replace the reference abstracts by one-sentence summaries')
+    parser.add_argument('--metrics_port', type=int, default=None, help='Serve live LM metrics for Prometheus on this port')
+    parser.add_argument('--profile', action='store_true', help='Write a Chrome trace and a CSV summary of the operations')
+    parser.add_argument('--release_thoughts', action='store_true', help='Release the thoughts of operations whose successors have all been executed')
+    parser.add_argument('--spill_dir', type=str, default=None, help='Directory for spilling released thoughts to disk, so they are kept in the output graphs')
+    parser.add_argument('--reference_cache_path', type=str, default=None, help='JSON file to keep the reference summaries across runs')
     args = parser.parse_args()
 
     mode = args.mode
@@ -854,6 +1119,9 @@ if __name__ == "__main__":
         data_path = './data/available_induc_train_graph.json'
         save_pmc_folder = './data/available_induc_train/pmc/'
         save_pm_folder = './data/available_induc_train/pm/'
+    corpus_path = f'./data/available_induc_{mode}/corpus.bin'
+    if not os.path.exists(corpus_path):
+        corpus_path = None
 
     budget = 3000000000
     samples = [item for item in range(int(args.begin), int(args.end))]
@@ -880,7 +1148,7 @@ if __name__ == "__main__":
         generate_prompt_nums[str(max_input_prompt_tokens)] = 0
         cut_abstract_nums[str(max_input_prompt_tokens)] = 0
 
-    spent, result_folder_path = run(samples, approaches, thresh, args.task, max_input_prompt_tokens_list, node_nums, budget, args.model, data_path, save_pmc_folder, save_pm_folder)
+    spent, result_folder_path = run(samples, approaches, thresh, args.task, max_input_prompt_tokens_list, node_nums, budget, args.model, data_path, save_pmc_folder, save_pm_folder, args.max_parallel_operations, args.use_async, args.max_concurrent_queries, args.workers, args.cache_path, corpus_path, args.summarize_references, args.reference_cache_path, args.profile, args.metrics_port, args.release_thoughts, args.spill_dir)
 
     logging.info(f"Spent {spent} out of {budget} budget.")
 
@@ -1,108 +1,105 @@
-import requests
 import os
 import json
-import time
+import logging
 from tqdm import tqdm
-from bs4 import BeautifulSoup
 import argparse
+from concurrent.futures import ProcessPoolExecutor
 
-from utils import read_pmc, read_pm
+from utils import extract_pmc, extract_pm
+from utils.downloader import Downloader, EFETCH_URL
+from utils.manifest import Manifest
+from utils.citation_graph import CitationGraph, GraphReader
+from utils.corpus_store import PackedCorpusWriter
 
 
-def download_one_pmc_article(pmc_id, save_path):
+def download_one_pmc_article(pmc_id, save_path, downloader):
     # 构建PMC文章的URL
     # https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pmc&id=5436877
-    article_url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pmc&id={pmc_id}"
-    
-    # 发送GET请求
-    response = requests.get(article_url)
-    
-    # 检查响应
-    if response.status_code == 200:
-        # 获取文章内容
-        article_content = response.text
-        # 在这里，您可以对文章内容进行处理，保存到文件或者进行其他操作
-        # 例如，保存到文件
-        with open(f"{save_path}/{pmc_id}.html", "w", encoding="utf-8") as file:
-            file.write(article_content)
-        print(f"Article {pmc_id} downloaded successfully.")
-        return 1
-    else:
-        print(f"Error occurred while downloading article {pmc_id}.")
-        return 0
-
-def download_one_pm_article(pm_id, save_path):
-    # 构建PMC文章的URL
-    # https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pmc&id=5436877
-    article_url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pubmed&id={pm_id}"
-    
-    # 发送GET请求
-    response = requests.get(article_url)
-    
-    # 检查响应
-    if response.status_code == 200:
-        # 获取文章内容
-        article_content = response.text
-        # 在这里，您可以对文章内容进行处理，保存到文件或者进行其他操作
-        # 例如，保存到文件
-        with open(f"{save_path}/{pm_id}.html", "w", encoding="utf-8") as file:
-            file.write(article_content)
-        print(f"Article {pm_id} downloaded successfully.")
-        return 1
-    else:
-        print(f"Error occurred while downloading article {pm_id}.")
-        return 0
+    return downloader.download_one("pmc", pmc_id, save_path)
+
+def download_one_pm_article(pm_id, save_path, downloader):
+    # https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pubmed&id=5436877
+    return downloader.download_one("pubmed", pm_id, save_path)
     
-def download_pmc_article(data, mode, num):
+def download_pmc_article(graph, mode, num, downloader, manifest=None, verify=False):
     ###################################
     # 下载 PMC 文章
     ###################################
     save_path = f"./data/{mode}/pmc/"
-    if not os.path.exists(save_path):
-        # 如果文件夹不存在，则创建它
-        os.makedirs(save_path)
-
-    PMC_num = 0
-    for key in tqdm(data['PMCid'], total=num, desc="Downloading articles"):
-        pmc_id = data['PMCid'][key][3:]
-        while not download_one_pmc_article(pmc_id, save_path):
-            time.sleep(1)
-        # res = download_one_pmc_article(pmc_id, save_path)
-        PMC_num += 1 # res
-        if PMC_num >= num:
-            break
+
+    pmc_ids = [pmc_id[3:] for pmc_id in graph.pmc_ids[:num]]
+    # 校验已下载文件的哈希值，损坏的文件重新下载
+    if manifest is not None and verify:
+        manifest.verify("pmc", pmc_ids)
+    # 并发下载，失败的请求以指数退避重试，超过重试次数后放弃；清单中已完成的文章会被跳过
+    results = downloader.download("pmc", pmc_ids, save_path, desc="Downloading articles", manifest=manifest)
+    PMC_num = sum(results.values())
+    failed = [pmc_id for pmc_id, res in results.items() if not res]
+    if len(failed) > 0:
+        print("下载失败的PMC文章：", failed)
     print("下载PMC文章数量为：", PMC_num)
 
-def download_pm_article(data, mode, num):
+def download_pm_article(graph, mode, num, downloader, batch_size=1, manifest=None, verify=False):
     ###################################
     # 下载 pubmed 文章
     ###################################
     # 使用集合（set）来存储不重复的元素
     unique_elements = set()
 
-    # 遍历字典的值（列表），将元素添加到集合中
-    PMC_num = 0
-    for key in data['references']:
-        unique_elements.update(data['references'][key])
-        PMC_num += 1
-        if PMC_num >= num:
-            break
+    # 遍历参考文献列表，将元素添加到集合中
+    for reference_list in graph.references[:num]:
+        unique_elements.update(reference_list)
 
     save_path = f"./data/{mode}/pm/"
-    if not os.path.exists(save_path):
-        # 如果文件夹不存在，则创建它
-        os.makedirs(save_path)
-        
-    pm_num = 0    
-    for key in tqdm(unique_elements, total=len(unique_elements), desc="Downloading articles"):
-        pm_id = key
-        while not download_one_pm_article(pm_id, save_path):
-            time.sleep(1)
-        # res = download_pm_article(pm_id, save_path)
-        pm_num += 1  # res
+
+    if manifest is not None and verify:
+        manifest.verify("pubmed", unique_elements)
+    # batch_size > 1 时每个请求获取多篇文章，再按 PMID 拆分保存
+    results = downloader.download("pubmed", sorted(unique_elements), save_path, desc="Downloading articles", batch_size=batch_size, manifest=manifest)
+    pm_num = sum(results.values())
+    failed = [pm_id for pm_id, res in results.items() if not res]
+    if len(failed) > 0:
+        print("下载失败的pm文章：", failed)
     print("下载pm文章数量为：", pm_num)
 
-def process_raw_data(mode, selected_data):
+def extract_records(extract, paths, workers=1):
+    # 解析是CPU密集型任务，多个进程按块分配文件，结果顺序与paths一致
+    if workers <= 1 or len(paths) <= 1:
+        return [extract(path) for path in tqdm(paths)]
+    chunksize = max(1, len(paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(tqdm(executor.map(extract, paths, chunksize=chunksize), total=len(paths)))
+
+def extract_pmc_data(mode, selected_data, workers=1):
+    # 每篇源文章只解析一次，提取标题、摘要、引言、章节及是否可用
+    paths = {}
+    for data in selected_data:
+        path = f'./data/{mode}/pmc/' + data + '.html'
+        if data in paths:
+            continue
+        if not os.path.exists(path):
+            print("文章不存在：", data)
+            continue
+        paths[data] = path
+    return dict(zip(paths, extract_records(extract_pmc, list(paths.values()), workers)))
+
+def extract_pm_data(mode, selected_data, pmc_records, workers=1):
+    # 只解析可用源文章的参考文献，每篇参考文献只解析一次
+    paths = {}
+    for index, data in enumerate(selected_data):
+        if data not in pmc_records or not pmc_records[data]['available']:
+            continue
+        for pm_id in selected_data_reference[index]:
+            path = f'./data/{mode}/pm/' + pm_id + '.html'
+            if pm_id in paths:
+                continue
+            if not os.path.exists(path):
+                print("参考文献不存在：", pm_id)
+                continue
+            paths[pm_id] = path
+    return dict(zip(paths, extract_records(extract_pm, list(paths.values()), workers)))
+
+def process_raw_data(mode, selected_data, pmc_records, pm_records, save_json=True):
     # 遍历每篇文章数据
     save_folder = f'./data/available_induc_{mode}/'
     if not os.path.exists(save_folder):
@@ -115,142 +112,86 @@ def process_raw_data(mode, selected_data):
         os.makedirs(save_pm_folder)
 
 
+    # 打包的语料库，共享的参考文献只保存一次
+    writer = PackedCorpusWriter(save_folder + 'corpus.bin')
     for index, data in tqdm(enumerate(selected_data), total=len(selected_data)):
         # 读取源文章及参考文献数据
         # 源文章
-        origin_path = f'./data/{mode}/pmc/' + data + '.html'
-        article_title_text, abstract_text, introduction_text, sec_dict = read_pmc(origin_path)
-        if article_title_text == "":
+        if data not in pmc_records:
+            continue
+        record = pmc_records[data]
+        if record['article_title_text'] == "":
             print("article_title_text error:", data)
-        elif abstract_text == "":
+        elif record['abstract_text'] == "":
             print("abstract_text error:", data)
-        elif introduction_text == "":
+        elif record['introduction_text'] == "":
             print("introduction_text error:", data)
         else:
-            dict = {'article_title_text': article_title_text, 'abstract_text': abstract_text,
-                'introduction_text': introduction_text, 'sec_dict': sec_dict}
+            dict = {'article_title_text': record['article_title_text'], 'abstract_text': record['abstract_text'],
+                'introduction_text': record['introduction_text'], 'sec_dict': record['sec_dict']}
             
-            json_file_path = save_pmc_folder + data + '.json'
-            with open(json_file_path, 'w') as json_file:
-                json.dump(dict, json_file)
+            if save_json:
+                json_file_path = save_pmc_folder + data + '.json'
+                with open(json_file_path, 'w') as json_file:
+                    json.dump(dict, json_file)
         
             # 参考文献
             reference_title_abstract_dict = {}
+            reference_list = []
             for pm_id in selected_data_reference[index]:
-                reference_path = f'./data/{mode}/pm/' + pm_id + '.html'
-                reference_title_text, reference_abstract_text = read_pm(reference_path)
-                reference_title_abstract_dict[reference_title_text] = reference_abstract_text
-            json_file_path = save_pm_folder + data + '.json'
-            with open(json_file_path, 'w') as json_file:
-                json.dump(reference_title_abstract_dict, json_file)
-
-def get_availabe_pmc_data(mode, selected_data):
+                if pm_id not in pm_records:
+                    continue
+                reference_title_abstract_dict[pm_records[pm_id]['title_text']] = pm_records[pm_id]['abstract_text']
+                writer.add_reference(pm_id, pm_records[pm_id]['title_text'], pm_records[pm_id]['abstract_text'])
+                reference_list.append(pm_id)
+            if save_json:
+                json_file_path = save_pm_folder + data + '.json'
+                with open(json_file_path, 'w') as json_file:
+                    json.dump(reference_title_abstract_dict, json_file)
+
+            writer.add_article(data, dict, reference_list)
+    writer.close()
+
+def get_availabe_pmc_data(selected_data, pmc_records):
     available_num = 0
     available_pmc_list = []
+    available_pmc_set = set()
     available_pmc_idx = []
 
     for index, data in enumerate(selected_data):
-        path = f'./data/{mode}/pmc/' + data + '.html'
-        # 打开并读取HTML文件
-        with open(path, 'r', encoding='utf-8') as file:
-            html_content = file.read()
-        # 使用Beautiful Soup解析HTML内容
-        soup = BeautifulSoup(html_content, "html.parser")
-        # 查找<sec>标签，并指定sec-type为"intro"
-        sec_tag = soup.find_all("sec")
-        
-        # sec_dict = {}
-        
-        # 如果找到了<sec>标签
-        if sec_tag:
-            # print(len(sec_tag))
-            # 查找<title>标签
-            for tag in sec_tag:
-                title_tag = tag.find("title")
-                if title_tag:
-                    #sec_dict[title_tag.text] = tag.text
-                    if title_tag.text in ['Introduction', 'INTRODUCTION', '1. Introduction', '1 INTRODUCTION', 'introduction']:
-                        # 查找<abstract>标签
-                        abstract_tag = soup.find("abstract")
-                        
-                        # 提取<abstract>标签中的文本内容
-                        if abstract_tag:
-                            # abstract_text = abstract_tag.text
-                            available_num += 1
-                            available_pmc_list.append(data)
-                            available_pmc_idx.append(index)
-                            
-                        else:
-                            print("Abstract tag not found in the HTML content.")
-                        
-        else:
-            print("No <sec> tag found in the HTML content.")
-            print("wrong data: ", data)
-
+        # 有引言章节和摘要的文章可用
+        if data in pmc_records and pmc_records[data]['available'] and data not in available_pmc_set:
+            available_num += 1
+            available_pmc_list.append(data)
+            available_pmc_set.add(data)
+            available_pmc_idx.append(index)
 
     print("可用文章数量:", available_num)
     return available_pmc_list, available_pmc_idx
 
-def get_availabe_pm_data(mode, available_pmc_idx):
+def get_availabe_pm_data(available_pmc_idx, pm_records):
     available_pm_list = []
+    available_pm_set = set()
     available_pm_num = 0
     for reference_list_idx in available_pmc_idx:
         for i in selected_data_reference[reference_list_idx]:
-            if i not in available_pm_list:
-                # 打开并读取HTML文件
-                path = f'./data/{mode}/pm/' + i + '.html'
-                with open(path, 'r', encoding='utf-8') as file:
-                    html_content = file.read()
-                
-                # 使用Beautiful Soup解析HTML内容
-                soup = BeautifulSoup(html_content, "html.parser")
-                
-                # 查找<title>标签
-                title_tag = soup.find("articletitle")
-                
-                # 提取<title>标签中的文本内容
-                if title_tag:
-                    #title_text = title_tag.text
-                    # 查找<abstract>标签
-                    abstract_tag = soup.find("abstract")
-                    
-                    # 提取<abstract>标签中的文本内容
-                    if abstract_tag:
-                        #abstract_text = abstract_tag.text
-                        # print("Abstract:", abstract_text)
-                        available_pm_list.append(i)
-                        available_pm_num += 1
-                    else:
-                        print("Abstract tag not found in the HTML content.")
+            # 有标题和摘要的参考文献可用
+            if i not in available_pm_set and i in pm_records and pm_records[i]['available']:
+                available_pm_list.append(i)
+                available_pm_set.add(i)
+                available_pm_num += 1
     print("pm可用文章数量：", available_pm_num)
     return available_pm_list
 
-def generate_available_dict(selected_data, selected_data_reference, available_pm_list, required_num):
-    available_graph_dict = {}
-    available_graph_dict['PMCid'] = []
-    available_graph_dict['references'] = []
+def generate_available_dict(graph, selected_data, available_pmc_list, available_pm_list, required_num):
+    # 选出可用且所有参考文献都可用的前required_num篇文章
+    available_pmc_set = set(available_pmc_list)
+    available_idx = [index for index, data in enumerate(selected_data) if data in available_pmc_set]
+    selected_idx = graph.select_available(available_idx, available_pm_list, required_num)
 
-    data_num = 0
-    for index, data in enumerate(selected_data):
-        if data in available_pmc_list:
-            reference_list = selected_data_reference[index]
-            if reference_list == []:
-                available_graph_dict['PMCid'].append(data)
-                available_graph_dict['references'].append([])
-                data_num += 1
-            else:
-                no_flag = 0
-                for i in reference_list:
-                    if i not in available_pm_list:
-                        no_flag += 1
-                    else:
-                        pass
-                if no_flag == 0:
-                    available_graph_dict['PMCid'].append(data)
-                    available_graph_dict['references'].append(reference_list)
-                    data_num += 1
-        if data_num >= required_num:
-            break
+    available_graph_dict = {}
+    available_graph_dict['PMCid'] = [selected_data[index] for index in selected_idx]
+    available_graph_dict['references'] = [graph.references[index] for index in selected_idx]
         
     print(len(available_graph_dict['references']))
     return available_graph_dict
@@ -261,39 +202,64 @@ if __name__ == "__main__":
     """
     parser = argparse.ArgumentParser()
     parser.add_argument('--required_num', type=int, default=100, help='Number of articles data required')
+    parser.add_argument('--requests_per_second', type=float, default=3, help='Maximum number of E-utilities requests per second (10 are allowed with an API key)')
+    parser.add_argument('--workers', type=int, default=4, help='Number of concurrent downloads and of processes extracting the downloaded articles')
+    parser.add_argument('--max_retries', type=int, default=5, help='Number of retries of a failed request')
+    parser.add_argument('--batch_size', type=int, default=200, help='Number of references fetched per request')
+    parser.add_argument('--api_key', type=str, default=None, help='NCBI API key')
+    parser.add_argument('--base_url', type=str, default=EFETCH_URL, help='URL of the efetch endpoint')
+    parser.add_argument('--packed_only', action='store_true', help='Only write the packed corpus, not the JSON files per article')
+    parser.add_argument('--verify', action='store_true', help='Re-hash the downloaded files and download corrupted ones again')
     args = parser.parse_args()
 
+    logging.basicConfig(level=logging.INFO)
+    downloader = Downloader(
+        base_url=args.base_url,
+        requests_per_second=args.requests_per_second,
+        max_workers=args.workers,
+        max_retries=args.max_retries,
+        api_key=args.api_key,
+    )
+
     required_num = args.required_num
     # About half of the downloaded articles are not available
     download_num = 2 * required_num
     modes = ['test', 'train']
 
     for mode in modes:
-        # 打开JSON文件
-        with open(f'./PubMedCite/induc_graph/{mode}_graph.json', 'r') as json_file:
-            # 从文件中加载JSON数据
-            data = json.load(json_file)
+        # 只读取前download_num篇文章，不加载整个图文件
+        # 引文图索引，用于筛选所有参考文献都可用的文章
+        with GraphReader(f'./PubMedCite/induc_graph/{mode}_graph.json') as graph_reader:
+            graph = CitationGraph.from_rows(graph_reader.rows(0, download_num))
+
+        # 记录每篇文章的下载状态，中断后重新运行只下载未完成的文章
+        manifest = Manifest(f'./data/{mode}/manifest.jsonl')
 
         print('Downloading pmc article')
-        download_pmc_article(data, mode, download_num)
+        download_pmc_article(graph, mode, download_num, downloader, manifest, args.verify)
         print('Downloading pm article')
         # 
-        download_pm_article(data, mode, download_num)
+        download_pm_article(graph, mode, download_num, downloader, args.batch_size, manifest, args.verify)
+
+        data_ids = list(range(len(graph)))
 
-        data_ids = list(range(download_num))
+        selected_data = [graph.pmc_ids[i][3:] for i in data_ids]
+        selected_data_reference = [graph.references[i] for i in data_ids]
 
-        selected_data = [data['PMCid'][f'{i}'][3:] for i in data_ids]
-        selected_data_reference = [data['references'][f'{i}'] for i in data_ids]
+        print('Extracting pmc data')
+        pmc_records = extract_pmc_data(mode, selected_data, args.workers)
+        print('Extracting pm data')
+        pm_records = extract_pm_data(mode, selected_data, pmc_records, args.workers)
 
         print('Processing raw data')
-        process_raw_data(mode, selected_data)
+        process_raw_data(mode, selected_data, pmc_records, pm_records, not args.packed_only)
 
         print('Get availabe pmc data')
-        available_pmc_list, available_pmc_idx = get_availabe_pmc_data(mode, selected_data)
+        available_pmc_list, available_pmc_idx = get_availabe_pmc_data(selected_data, pmc_records)
         print('Get availabe pm data')
-        available_pm_list = get_availabe_pm_data(mode, available_pmc_idx)
+        available_pm_list = get_availabe_pm_data(available_pmc_idx, pm_records)
         print('Generating available dict')
-        available_graph_dict = generate_available_dict(selected_data, selected_data_reference, available_pm_list, required_num)
+        available_graph_dict = generate_available_dict(graph, selected_data, available_pmc_list, available_pm_list, required_num)
 
         save_path = f'./data/available_induc_{mode}_graph.json'
         # 将排序后的列表保存为JSON文件
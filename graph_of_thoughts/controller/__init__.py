@@ -3,4 +3,7 @@ from .chatglm import ChatGLM
 from .internlm2 import InternLM2
 from .llamachat_hf import Llama2HF
 from .abstract_language_model import AbstractLanguageModel
+from .mock_language_model import MockLanguageModel
+from .response_cache import ResponseCache, MemoryResponseCache, SQLiteResponseCache
 from .controller import Controller
+from .async_controller import AsyncController
@@ -7,10 +7,20 @@
 # main author: Nils Blach
 
 from abc import ABC, abstractmethod
-from typing import List, Dict, Union, Any
+from contextlib import contextmanager
+from typing import List, Dict, Union, Any, Awaitable, Callable, Iterator, Optional, Tuple
+import asyncio
+import contextvars
+import functools
 import json
 import os
 import logging
+import random
+import threading
+import time
+
+from .response_cache import ResponseCache, MemoryResponseCache
+from graph_of_thoughts.metrics import metrics
 
 
 class AbstractLanguageModel(ABC):
@@ -19,7 +29,10 @@ class AbstractLanguageModel(ABC):
     """
 
     def __init__(
-        self, config_path: str = "", model_name: str = "", cache: bool = False
+        self,
+        config_path: str = "",
+        model_name: str = "",
+        cache: Union[bool, ResponseCache] = False,
     ) -> None:
         """
         Initialize the AbstractLanguageModel instance with configuration, model details, and caching options.
@@ -28,19 +41,31 @@ class AbstractLanguageModel(ABC):
         :type config_path: str
         :param model_name: Name of the language model. Defaults to "".
         :type model_name: str
-        :param cache: Flag to determine whether to cache responses. Defaults to False.
-        :type cache: bool
+        :param cache: Flag to determine whether to cache responses in memory, or the response
+                      cache to use, e.g. a persistent SQLiteResponseCache. Defaults to False.
+        :type cache: Union[bool, ResponseCache]
         """
         self.logger = logging.getLogger(self.__class__.__name__)
         self.config: Dict = None
         self.model_name: str = model_name
-        self.cache = cache
-        if self.cache:
-            self.respone_cache: Dict[str, List[Any]] = {}
+        if isinstance(cache, ResponseCache):
+            self.response_cache: Optional[ResponseCache] = cache
+        elif cache:
+            self.response_cache = MemoryResponseCache()
+        else:
+            self.response_cache = None
+        self.cache: bool = self.response_cache is not None
+        # Number of requests per query and number of responses, distinguishes repeated samples in the cache.
+        self.sample_indices: Dict[Tuple[str, int], int] = {}
+        self.sample_indices_lock: threading.Lock = threading.Lock()
         self.load_config(config_path)
         self.prompt_tokens: int = 0
         self.completion_tokens: int = 0
         self.cost: float = 0.0
+        # Guards the usage counters, operations may query the model from several threads.
+        self.usage_lock: threading.Lock = threading.Lock()
+        # Called with the prompt tokens, completion tokens and cost of every request.
+        self.usage_callbacks: List[Callable[[int, int, float], None]] = []
 
     def load_config(self, path: str) -> None:
         """
@@ -59,11 +84,128 @@ class AbstractLanguageModel(ABC):
 
         self.logger.debug(f"Loaded config from {path} for {self.model_name}")
 
+    def update_usage(self, prompt_tokens: int, completion_tokens: int) -> float:
+        """
+        Add the token usage of a single request to the counters and update the cost.
+        The usage callbacks are notified with the usage and cost of the request.
+        Safe to call from multiple threads.
+
+        :param prompt_tokens: Number of prompt tokens used by the request.
+        :type prompt_tokens: int
+        :param completion_tokens: Number of completion tokens used by the request.
+        :type completion_tokens: int
+        :return: The accumulated cost after the update.
+        :rtype: float
+        """
+        with self.usage_lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            prompt_tokens_k = float(self.prompt_tokens) / 1000.0
+            completion_tokens_k = float(self.completion_tokens) / 1000.0
+            previous_cost = self.cost
+            self.cost = (
+                self.prompt_token_cost * prompt_tokens_k
+                + self.response_token_cost * completion_tokens_k
+            )
+            cost = self.cost
+        labels = self.metric_labels()
+        metrics.lm_prompt_tokens.inc(prompt_tokens, **labels)
+        metrics.lm_completion_tokens.inc(completion_tokens, **labels)
+        metrics.lm_cost.inc(cost - previous_cost, **labels)
+        for callback in self.usage_callbacks:
+            callback(prompt_tokens, completion_tokens, cost - previous_cost)
+        return cost
+
+    def reset_usage(self) -> None:
+        """
+        Reset the usage counters, the cost and the sample indices of the response cache,
+        e.g. before the model is reused for another run.
+        """
+        with self.usage_lock:
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.cost = 0.0
+        with self.sample_indices_lock:
+            self.sample_indices.clear()
+
+    def metric_labels(self) -> Dict[str, str]:
+        """
+        Return the labels of the metrics of the model: the backend, the model and the type of the
+        operation that sends the request.
+
+        :return: The label values.
+        :rtype: Dict[str, str]
+        """
+        return {
+            "backend": self.__class__.__name__,
+            "model": getattr(self, "model_id", self.model_name),
+            "operation": metrics.current_operation(),
+        }
+
+    @contextmanager
+    def observe_request(self) -> Iterator[None]:
+        """
+        Measure the latency of a single request to the model and count it, and count it as error if it raises.
+        Backends wrap every request they send, including the attempts of retries.
+        """
+        labels = self.metric_labels()
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            metrics.lm_errors.inc(**labels)
+            raise
+        finally:
+            metrics.lm_request_seconds.observe(time.perf_counter() - start, **labels)
+            metrics.lm_requests.inc(**labels)
+
+    def record_retry(self) -> None:
+        """
+        Count a failed request or sample that is requested again.
+        """
+        metrics.lm_retries.inc(**self.metric_labels())
+
     def clear_cache(self) -> None:
         """
         Clear the response cache.
         """
-        self.respone_cache.clear()
+        self.response_cache.clear()
+
+    def get_sampling_parameters(self) -> Dict:
+        """
+        Return the parameters that influence the sampled responses, e.g. the temperature.
+        They are part of the cache key, so that responses sampled with different settings are not mixed.
+
+        :return: The sampling parameters.
+        :rtype: Dict
+        """
+        return {}
+
+    def get_cache_key(self, query: str, num_responses: int) -> Optional[str]:
+        """
+        Create the cache key of a request.
+        Repeated requests with the same query are distinguished by their sample index,
+        so that e.g. several single-sample requests do not return the same cached response.
+
+        :param query: The query to be posed to the language model.
+        :type query: str
+        :param num_responses: The number of desired responses.
+        :type num_responses: int
+        :return: The cache key or None if caching is disabled.
+        :rtype: Optional[str]
+        """
+        if self.response_cache is None:
+            return None
+        with self.sample_indices_lock:
+            sample_index = self.sample_indices.get((query, num_responses), 0)
+            self.sample_indices[(query, num_responses)] = sample_index + 1
+        return ResponseCache.make_key(
+            self.model_id,
+            self.get_sampling_parameters(),
+            query,
+            num_responses,
+            sample_index,
+        )
 
     @abstractmethod
     def query(self, query: str, num_responses: int = 1) -> Any:
@@ -90,3 +232,83 @@ class AbstractLanguageModel(ABC):
         :rtype: List[str]
         """
         pass
+
+    async def aquery(self, query: str, num_responses: int = 1) -> Any:
+        """
+        Asynchronously query the language model.
+        The default implementation runs the blocking `query` in the default executor of
+        the running event loop. Backends that talk to a server override this method with
+        a native implementation, so that no thread is needed per request.
+
+        :param query: The query to be posed to the language model.
+        :type query: str
+        :param num_responses: The number of desired responses.
+        :type num_responses: int
+        :return: The language model's response(s), in the same format as returned by `query`.
+        :rtype: Any
+        """
+        loop = asyncio.get_running_loop()
+        # the query runs in the context of the caller, e.g. inside its profiling span
+        return await loop.run_in_executor(
+            None,
+            functools.partial(
+                contextvars.copy_context().run, self.query, query, num_responses
+            ),
+        )
+
+    async def aget_response_texts(
+        self, query_responses: Union[List[Dict], Dict]
+    ) -> List[str]:
+        """
+        Asynchronously extract response texts from the language model's response(s).
+
+        :param query_responses: The responses returned from `aquery`.
+        :type query_responses: Union[List[Dict], Dict]
+        :return: List of textual responses.
+        :rtype: List[str]
+        """
+        return self.get_response_texts(query_responses)
+
+    async def aclose(self) -> None:
+        """
+        Release resources held for asynchronous queries, e.g. HTTP sessions.
+        """
+        pass
+
+    async def _agather_responses(
+        self, achat: Callable[[], Awaitable[Dict]], num_responses: int
+    ) -> List[Dict]:
+        """
+        Request several single responses concurrently.
+        Mirrors the retry behaviour of the blocking backends: failed requests are
+        repeated until the desired number of responses is reached or as many
+        requests as responses have failed.
+
+        :param achat: Coroutine function that requests a single response.
+        :type achat: Callable[[], Awaitable[Dict]]
+        :param num_responses: Number of desired responses.
+        :type num_responses: int
+        :return: List of the received responses.
+        :rtype: List[Dict]
+        """
+        responses = []
+        total_num_attempts = num_responses
+        while num_responses > 0 and total_num_attempts > 0:
+            results = await asyncio.gather(
+                *[achat() for _ in range(num_responses)], return_exceptions=True
+            )
+            failed = False
+            for result in results:
+                if isinstance(result, BaseException):
+                    self.logger.warning(
+                        f"Error in {self.model_name}: {result}, trying again"
+                    )
+                    total_num_attempts -= 1
+                    failed = True
+                    self.record_retry()
+                else:
+                    responses.append(result)
+                    num_responses -= 1
+            if failed and num_responses > 0 and total_num_attempts > 0:
+                await asyncio.sleep(random.randint(1, 3))
+        return responses
@@ -0,0 +1,132 @@
+# Copyright (c) 2023 ETH Zurich.
+#                    All rights reserved.
+#
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+#
+# main author: Nils Blach
+
+import asyncio
+from typing import Dict, List
+from .controller import Controller
+from graph_of_thoughts.operations import Operation
+
+
+class AsyncController(Controller):
+    """
+    Controller that executes the Graph of Operations on an asyncio event loop.
+    Operations use the asynchronous interface of the language model, so independent
+    branches and the LM requests within an operation are in flight at the same time
+    without a thread per request.
+    """
+
+    def run(self) -> None:
+        """
+        Run the controller from synchronous code by executing `arun` on a new event loop.
+        The asynchronous resources of the language model are released afterwards.
+
+        :raises AssertionError: If the Graph of Operation has no roots.
+        :raises AssertionError: If the successor of an operation is not in the Graph of Operations.
+        """
+        asyncio.run(self._run_and_close())
+
+    async def _run_and_close(self) -> None:
+        """
+        Execute `arun` and close the asynchronous resources of the language model,
+        which are bound to the event loop created by `run`.
+        """
+        try:
+            await self.arun()
+        finally:
+            await self.lm.aclose()
+
+    async def arun(self) -> None:
+        """
+        Asynchronously execute the operations from the Graph of Operations based on
+        their readiness. Every ready operation is started immediately, at most
+        `max_parallel_operations` operations are executed at the same time.
+
+        :raises AssertionError: If the Graph of Operation has no roots.
+        :raises AssertionError: If the successor of an operation is not in the Graph of Operations.
+        """
+        self.logger.debug("Checking that the program is in a valid state")
+        assert self.graph.roots is not None, "The operations graph has no root"
+        self.logger.debug("The program is in a valid state")
+
+        execution_queue = [
+            operation
+            for operation in self.graph.operations
+            if operation.can_be_executed()
+        ]
+        self.reset_consumers()
+
+        with self.profiling_span("arun"), self.scoring_context():
+            await self._arun_operations(execution_queue)
+
+        self.logger.info("All operations executed")
+        self.run_executed = True
+
+    async def _arun_operations(self, execution_queue: List[Operation]) -> None:
+        """
+        Start every ready operation immediately and release the successors as soon as
+        all of their predecessors have been executed.
+
+        :param execution_queue: The operations that are ready for execution.
+        :type execution_queue: List[Operation]
+        """
+        semaphore = asyncio.Semaphore(self.max_parallel_operations)
+        scheduled = set(execution_queue)
+        running: Dict[asyncio.Task, Operation] = {
+            asyncio.ensure_future(
+                self._aexecute_operation(operation, semaphore)
+            ): operation
+            for operation in execution_queue
+        }
+        try:
+            while len(running) > 0:
+                done, _ = await asyncio.wait(
+                    running, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    current_operation = running.pop(task)
+                    # re-raise exceptions of the operation
+                    task.result()
+                    self._release_consumed(current_operation)
+                    for operation in self._ready_successors(current_operation):
+                        if operation in scheduled:
+                            continue
+                        scheduled.add(operation)
+                        running[
+                            asyncio.ensure_future(
+                                self._aexecute_operation(operation, semaphore)
+                            )
+                        ] = operation
+        finally:
+            pending: List[asyncio.Task] = list(running)
+            for task in pending:
+                task.cancel()
+            if len(pending) > 0:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def _aexecute_operation(
+        self, operation: Operation, semaphore: asyncio.Semaphore
+    ) -> None:
+        """
+        Asynchronously execute a single operation with the controller's language model,
+        prompter, parser and problem parameters.
+
+        :param operation: The operation to execute.
+        :type operation: Operation
+        :param semaphore: Limits the number of concurrently executed operations.
+        :type semaphore: asyncio.Semaphore
+        """
+        async with semaphore:
+            self.logger.info("Executing operation %s", operation.operation_type)
+            await operation.aexecute(
+                self.lm,
+                self.prompter,
+                self.parser,
+                profiler=self.profiler,
+                **self.problem_parameters,
+            )
+            self.logger.info("Operation %s executed", operation.operation_type)
@@ -8,9 +8,11 @@ import requests
 import json
 
 from .abstract_language_model import AbstractLanguageModel
+from .http_session import HTTPSessionMixin
+from .response_cache import ResponseCache
 
 
-class ChatGLM(AbstractLanguageModel):
+class ChatGLM(HTTPSessionMixin, AbstractLanguageModel):
     """
     The ChatGLM class handles interactions with the ChatGLM using the provided configuration.
 
@@ -18,7 +20,7 @@ class ChatGLM(AbstractLanguageModel):
     """
 
     def __init__(
-        self, config_path: str = "", model_name: str = "chatglm", cache: bool = False
+        self, config_path: str = "", model_name: str = "chatglm", cache: Union[bool, ResponseCache] = False
     ) -> None:
         """
         Initialize the ChatGLM instance with configuration, model details, and caching options.
@@ -27,8 +29,8 @@ class ChatGLM(AbstractLanguageModel):
         :type config_path: str
         :param model_name: Name of the model, default is 'chatglm'. Used to select the correct configuration.
         :type model_name: str
-        :param cache: Flag to determine whether to cache responses. Defaults to False.
-        :type cache: bool
+        :param cache: Flag to determine whether to cache responses in memory, or the response cache to use. Defaults to False.
+        :type cache: Union[bool, ResponseCache]
         """
         super().__init__(config_path, model_name, cache)
         self.config: Dict = self.config[model_name]
@@ -45,7 +47,6 @@ class ChatGLM(AbstractLanguageModel):
         # The stop sequence is a sequence of tokens that the model will stop generating at (it will not generate the stop sequence).
         # self.stop: Union[str, List[str]] = self.config["stop"]
 
-
     def query(self, query: str, num_responses: int = 1) -> Dict:
         """
         Query the ChatGLM model for responses.
@@ -57,8 +58,11 @@ class ChatGLM(AbstractLanguageModel):
         :return: Response(s) from the ChatGLM model.
         :rtype: Dict
         """
-        if self.cache and query in self.respone_cache:
-            return self.respone_cache[query]
+        cache_key = self.get_cache_key(query, num_responses)
+        if cache_key is not None:
+            response = self.response_cache.get(cache_key)
+            if response is not None:
+                return response
 
         if num_responses == 1:
             response = self.chat([{"role": "user", "content": query}], num_responses)
@@ -78,11 +82,12 @@ class ChatGLM(AbstractLanguageModel):
                     self.logger.warning(
                         f"Error in chatglm: {e}, trying again with {next_try} samples"
                     )
+                    self.record_retry()
                     time.sleep(random.randint(1, 3))
                     total_num_attempts -= 1
 
-        if self.cache:
-            self.respone_cache[query] = response
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response)
         return response
 
     def chat(self, messages: List[Dict], num_responses: int = 1) -> Dict:
@@ -111,21 +116,69 @@ class ChatGLM(AbstractLanguageModel):
         json_data = json.dumps(data)
 
         # 发送POST请求
-        response = requests.post(url, headers=headers, data=json_data).text
-        response = json.loads(response)
+        with self.observe_request():
+            response = requests.post(url, headers=headers, data=json_data).text
+            response = json.loads(response)
     
-        self.prompt_tokens += response["prompt_token"]
-        self.completion_tokens += response["response_token"]
-        prompt_tokens_k = float(self.prompt_tokens) / 1000.0
-        completion_tokens_k = float(self.completion_tokens) / 1000.0
-        self.cost = (
-            self.prompt_token_cost * prompt_tokens_k
-            + self.response_token_cost * completion_tokens_k
-        )
-        self.logger.info(
-            f"This is the response from chatglm: {response}"
-            f"\nThis is the cost of the response: {self.cost}"
-        )
+        cost = self.update_usage(response["prompt_token"], response["response_token"])
+        # the raw response is not logged, the response texts are logged by the operations
+        self.logger.info("Response from chatglm, accumulated cost: %s", cost)
+        return response
+
+    async def aquery(self, query: str, num_responses: int = 1) -> Dict:
+        """
+        Asynchronously query the ChatGLM model for responses.
+
+        :param query: The query to be posed to the language model.
+        :type query: str
+        :param num_responses: Number of desired responses, default is 1.
+        :type num_responses: int
+        :return: Response(s) from the ChatGLM model.
+        :rtype: Dict
+        """
+        cache_key = self.get_cache_key(query, num_responses)
+        if cache_key is not None:
+            response = self.response_cache.get(cache_key)
+            if response is not None:
+                return response
+
+        messages = [{"role": "user", "content": query}]
+        if num_responses == 1:
+            response = await self.achat(messages, num_responses)
+        else:
+            # chatglm interface is set to single query, the queries are sent concurrently
+            response = await self._agather_responses(
+                lambda: self.achat(messages, 1), num_responses
+            )
+
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response)
+        return response
+
+    async def achat(self, messages: List[Dict], num_responses: int = 1) -> Dict:
+        """
+        Asynchronously send chat messages to the ChatGLM Model and retrieve the model's response.
+
+        :param messages: A list of message dictionaries for the chat.
+        :type messages: List[Dict]
+        :param num_responses: Number of desired responses, default is 1.
+        :type num_responses: int
+        :return: The ChatGLM model's response.
+        :rtype: Dict
+        """
+        data = {
+            "prompt": messages[0]["content"],
+            "history": []
+        }
+        session = self._get_session()
+        with self.observe_request():
+            async with session.post(self.url, json=data) as http_response:
+                http_response.raise_for_status()
+                response = json.loads(await http_response.text())
+
+        cost = self.update_usage(response["prompt_token"], response["response_token"])
+        # the raw response is not logged, the response texts are logged by the operations
+        self.logger.info("Response from chatglm, accumulated cost: %s", cost)
         return response
 
     def get_response_texts(self, query_response: Union[List[Dict], Dict]) -> List[str]:
@@ -14,6 +14,7 @@ import time
 from typing import List, Dict, Union
 
 from .abstract_language_model import AbstractLanguageModel
+from .response_cache import ResponseCache
 
 
 class ChatGPT(AbstractLanguageModel):
@@ -24,7 +25,7 @@ class ChatGPT(AbstractLanguageModel):
     """
 
     def __init__(
-        self, config_path: str = "", model_name: str = "chatgpt", cache: bool = False
+        self, config_path: str = "", model_name: str = "chatgpt", cache: Union[bool, ResponseCache] = False
     ) -> None:
         """
         Initialize the ChatGPT instance with configuration, model details, and caching options.
@@ -33,8 +34,8 @@ class ChatGPT(AbstractLanguageModel):
         :type config_path: str
         :param model_name: Name of the model, default is 'chatgpt'. Used to select the correct configuration.
         :type model_name: str
-        :param cache: Flag to determine whether to cache responses. Defaults to False.
-        :type cache: bool
+        :param cache: Flag to determine whether to cache responses in memory, or the response cache to use. Defaults to False.
+        :type cache: Union[bool, ResponseCache]
         """
         super().__init__(config_path, model_name, cache)
         self.config: Dict = self.config[model_name]
@@ -73,8 +74,11 @@ class ChatGPT(AbstractLanguageModel):
         :return: Response(s) from the OpenAI model.
         :rtype: Dict
         """
-        if self.cache and query in self.respone_cache:
-            return self.respone_cache[query]
+        cache_key = self.get_cache_key(query, num_responses)
+        if cache_key is not None:
+            response = self.response_cache.get(cache_key)
+            if response is not None:
+                return response
 
         if num_responses == 1:
             response = self.chat([{"role": "user", "content": query}], num_responses)
@@ -94,11 +98,12 @@ class ChatGPT(AbstractLanguageModel):
                     self.logger.warning(
                         f"Error in chatgpt: {e}, trying again with {next_try} samples"
                     )
+                    self.record_retry()
                     time.sleep(random.randint(1, 3))
                     total_num_attempts -= 1
 
-        if self.cache:
-            self.respone_cache[query] = response
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response)
         return response
 
     @backoff.on_exception(
@@ -116,29 +121,98 @@ class ChatGPT(AbstractLanguageModel):
         :return: The OpenAI model's response.
         :rtype: Dict
         """
-        response = openai.ChatCompletion.create(
-            model=self.model_id,
-            messages=messages,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens,
-            n=num_responses,
-            stop=self.stop,
+        with self.observe_request():
+            response = openai.ChatCompletion.create(
+                model=self.model_id,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                n=num_responses,
+                stop=self.stop,
+            )
+
+        cost = self.update_usage(
+            response["usage"]["prompt_tokens"], response["usage"]["completion_tokens"]
         )
+        # the raw response is not logged, the response texts are logged by the operations
+        self.logger.info("Response from chatgpt, accumulated cost: %s", cost)
+        return response
 
-        self.prompt_tokens += response["usage"]["prompt_tokens"]
-        self.completion_tokens += response["usage"]["completion_tokens"]
-        prompt_tokens_k = float(self.prompt_tokens) / 1000.0
-        completion_tokens_k = float(self.completion_tokens) / 1000.0
-        self.cost = (
-            self.prompt_token_cost * prompt_tokens_k
-            + self.response_token_cost * completion_tokens_k
-        )
-        self.logger.info(
-            f"This is the response from chatgpt: {response}"
-            f"\nThis is the cost of the response: {self.cost}"
+    async def aquery(self, query: str, num_responses: int = 1) -> Dict:
+        """
+        Asynchronously query the OpenAI model for responses.
+
+        :param query: The query to be posed to the language model.
+        :type query: str
+        :param num_responses: Number of desired responses, default is 1.
+        :type num_responses: int
+        :return: Response(s) from the OpenAI model.
+        :rtype: Dict
+        """
+        cache_key = self.get_cache_key(query, num_responses)
+        if cache_key is not None:
+            response = self.response_cache.get(cache_key)
+            if response is not None:
+                return response
+
+        messages = [{"role": "user", "content": query}]
+        if num_responses == 1:
+            response = await self.achat(messages, num_responses)
+        else:
+            # single queries to satisfy the score function, sent concurrently
+            response = await self._agather_responses(
+                lambda: self.achat(messages, 1), num_responses
+            )
+
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response)
+        return response
+
+    @backoff.on_exception(
+        backoff.expo, openai.error.OpenAIError, max_time=10, max_tries=6
+    )
+    async def achat(self, messages: List[Dict], num_responses: int = 1) -> Dict:
+        """
+        Asynchronously send chat messages to the OpenAI model and retrieve the model's response.
+        Implements backoff on OpenAI error.
+
+        :param messages: A list of message dictionaries for the chat.
+        :type messages: List[Dict]
+        :param num_responses: Number of desired responses, default is 1.
+        :type num_responses: int
+        :return: The OpenAI model's response.
+        :rtype: Dict
+        """
+        with self.observe_request():
+            response = await openai.ChatCompletion.acreate(
+                model=self.model_id,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                n=num_responses,
+                stop=self.stop,
+            )
+
+        cost = self.update_usage(
+            response["usage"]["prompt_tokens"], response["usage"]["completion_tokens"]
         )
+        # the raw response is not logged, the response texts are logged by the operations
+        self.logger.info("Response from chatgpt, accumulated cost: %s", cost)
         return response
 
+    def get_sampling_parameters(self) -> Dict:
+        """
+        Return the parameters that influence the sampled responses.
+
+        :return: The sampling parameters.
+        :rtype: Dict
+        """
+        return {
+            "temperature": self.temperature,
+            "max_tokens": self.max_tokens,
+            "stop": self.stop,
+        }
+
     def get_response_texts(self, query_response: Union[List[Dict], Dict]) -> List[str]:
         """
         Extract the response texts from the query response.
@@ -6,13 +6,19 @@
 #
 # main author: Nils Blach
 
+import contextvars
 import json
 import logging
-from typing import List
+import os
+import tempfile
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import IO, Callable, ContextManager, Dict, List, Optional, Tuple, Union
 from .abstract_language_model import AbstractLanguageModel
-from graph_of_thoughts.operations import GraphOfOperations, Thought
+from graph_of_thoughts.operations import GraphOfOperations, Operation, Thought
 from graph_of_thoughts.prompter import Prompter
 from graph_of_thoughts.parser import Parser
+from graph_of_thoughts.profiler import Profiler
 
 
 class Controller:
@@ -29,6 +35,11 @@ class Controller:
         prompter: Prompter,
         parser: Parser,
         problem_parameters: dict,
+        max_parallel_operations: int = 1,
+        scoring_context_factory: Callable[[dict], ContextManager] = None,
+        profiler: Optional[Profiler] = None,
+        release_thoughts: bool = False,
+        spill_dir: Optional[str] = None,
     ) -> None:
         """
         Initialize the Controller instance with the language model,
@@ -44,6 +55,28 @@ class Controller:
         :type parser: Parser
         :param problem_parameters: Initial parameters/state of the problem.
         :type problem_parameters: dict
+        :param max_parallel_operations: Maximum number of ready operations that are executed
+                                        concurrently. Defaults to 1, which executes the operations
+                                        one after another.
+        :type max_parallel_operations: int
+        :param scoring_context_factory: Creates a context manager from the problem parameters that is
+                                        entered for the duration of the run, e.g. to build per-problem
+                                        data for the scoring functions once and release it afterwards.
+                                        Defaults to None.
+        :type scoring_context_factory: Callable[[dict], ContextManager]
+        :param profiler: Records a span of the run and of every operation, with child spans for the prompts,
+                         the requests to the LM, parsing and scoring. Defaults to None.
+        :type profiler: Optional[Profiler]
+        :param release_thoughts: Whether the thoughts of an operation are released as soon as all of its
+                                 successors have been executed, so that the memory of a run is bounded by
+                                 the operations in flight instead of the whole graph. The thoughts of the
+                                 leaves are kept for `get_final_thoughts`. Defaults to False.
+        :type release_thoughts: bool
+        :param spill_dir: Directory of a temporary file to which the released operations are written, so that
+                          `output_graph` still contains their thoughts. Defaults to None, in which case
+                          the released operations are written without thoughts.
+        :type spill_dir: Optional[str]
+        :raises AssertionError: If `max_parallel_operations` is not greater than zero.
         """
         self.logger = logging.getLogger(self.__class__.__module__)
         self.lm = lm
@@ -51,6 +84,23 @@ class Controller:
         self.prompter = prompter
         self.parser = parser
         self.problem_parameters = problem_parameters
+        assert (
+            max_parallel_operations > 0
+        ), "The controller must be allowed to execute at least one operation"
+        self.max_parallel_operations = max_parallel_operations
+        self.scoring_context_factory = scoring_context_factory
+        self.profiler = profiler
+        self.release_thoughts = release_thoughts
+        self.spill_dir = spill_dir
+        self.spill_file: Optional[IO[bytes]] = None
+        # per released operation and thought: the offset of the spilled thought, or the thought itself if it
+        # is shared with an operation that is not released; None if the thoughts were dropped
+        self.released: Dict[Operation, Optional[List[Union[int, Thought]]]] = {}
+        self.pending_consumers: Dict[Operation, int] = {}
+        # references of the executed operations that are not released to thought and state objects, by id
+        self.references: Dict[int, int] = {}
+        # released thoughts that are kept until the object with the id is no longer referenced
+        self.kept: Dict[int, List[Tuple[List[Union[int, Thought]], int, Thought]]] = {}
         self.run_executed = False
 
     def run(self) -> None:
@@ -58,6 +108,8 @@ class Controller:
         Run the controller and execute the operations from the Graph of
         Operations based on their readiness.
         Ensures the program is in a valid state before execution.
+        If `max_parallel_operations` is greater than one, all ready operations
+        are executed concurrently, otherwise they are executed one after another.
         :raises AssertionError: If the Graph of Operation has no roots.
         :raises AssertionError: If the successor of an operation is not in the Graph of Operations.
         """
@@ -70,23 +122,333 @@ class Controller:
             for operation in self.graph.operations
             if operation.can_be_executed()
         ]
+        self.reset_consumers()
 
-        while len(execution_queue) > 0:
-            current_operation = execution_queue.pop(0)
-            self.logger.info("Executing operation %s", current_operation.operation_type)
-            current_operation.execute(
-                self.lm, self.prompter, self.parser, **self.problem_parameters
-            )
-            self.logger.info("Operation %s executed", current_operation.operation_type)
-            for operation in current_operation.successors:
-                assert (
-                    operation in self.graph.operations
-                ), "The successor of an operation is not in the operations graph"
-                if operation.can_be_executed():
-                    execution_queue.append(operation)
+        with self.profiling_span("run"), self.scoring_context():
+            if self.max_parallel_operations > 1:
+                self._run_parallel(execution_queue)
+            else:
+                while len(execution_queue) > 0:
+                    current_operation = execution_queue.pop(0)
+                    self._execute_operation(current_operation)
+                    self._release_consumed(current_operation)
+                    execution_queue.extend(self._ready_successors(current_operation))
         self.logger.info("All operations executed")
         self.run_executed = True
 
+    def scoring_context(self) -> ContextManager:
+        """
+        Create the scoring context of the problem parameters, which is entered while the operations are executed.
+
+        :return: The context manager created by `scoring_context_factory`, or a no-op context if there is none.
+        :rtype: ContextManager
+        """
+        if self.scoring_context_factory is None:
+            return nullcontext()
+        return self.scoring_context_factory(self.problem_parameters)
+
+    def profiling_span(self, name: str) -> ContextManager:
+        """
+        Create a span of the profiler that contains the spans of the operations.
+
+        :param name: Name of the span.
+        :type name: str
+        :return: The span of the profiler, or a no-op context if there is no profiler.
+        :rtype: ContextManager
+        """
+        if self.profiler is None:
+            return nullcontext()
+        return self.profiler.span(
+            name, "controller", operations=len(self.graph.operations)
+        )
+
+    def _run_parallel(self, execution_queue: List[Operation]) -> None:
+        """
+        Execute the operations with a bounded pool of worker threads.
+        Every ready operation is dispatched immediately and successors are
+        released as soon as all of their predecessors have been executed.
+
+        :param execution_queue: The operations that are ready for execution.
+        :type execution_queue: List[Operation]
+        """
+        scheduled = set(execution_queue)
+        with ThreadPoolExecutor(
+            max_workers=self.max_parallel_operations,
+            thread_name_prefix="controller",
+        ) as pool:
+            # the operations run in the context of the controller, e.g. inside its profiling span
+            running = {
+                pool.submit(
+                    contextvars.copy_context().run, self._execute_operation, operation
+                ): operation
+                for operation in execution_queue
+            }
+            while len(running) > 0:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    current_operation = running.pop(future)
+                    # re-raise exceptions of the operation in the controller thread
+                    future.result()
+                    self._release_consumed(current_operation)
+                    for operation in self._ready_successors(current_operation):
+                        if operation in scheduled:
+                            continue
+                        scheduled.add(operation)
+                        running[
+                            pool.submit(
+                                contextvars.copy_context().run,
+                                self._execute_operation,
+                                operation,
+                            )
+                        ] = operation
+
+    def reset_consumers(self) -> None:
+        """
+        Count the successors of every operation that still have to consume its thoughts.
+        """
+        self.pending_consumers = {
+            operation: len(operation.successors) for operation in self.graph.operations
+        }
+        self.references = {}
+        self.kept = {}
+
+    def _release_consumed(self, operation: Operation) -> None:
+        """
+        Release the thoughts of the predecessors of an executed operation whose successors have all been
+        executed, if `release_thoughts` is set. The leaves are never released. If there is a `spill_dir`,
+        the references of the operation to its thought and state objects are counted first.
+
+        :param operation: The executed operation.
+        :type operation: Operation
+        """
+        if not self.release_thoughts:
+            return
+        if self.spill_dir is not None:
+            self._count_references(operation.get_thoughts(), 1)
+        for predecessor in operation.predecessors:
+            self.pending_consumers[predecessor] -= 1
+            if (
+                self.pending_consumers[predecessor] == 0
+                and predecessor not in self.graph.leaves
+            ):
+                self._release(predecessor)
+
+    def _release(self, operation: Operation) -> None:
+        """
+        Drop the thoughts of the operation. If there is a `spill_dir`, they are spilled to the temporary file
+        as soon as their thought and state objects are not shared with an operation that is not released, since
+        such a state may still be updated, e.g. by a scoring function. Until then they are kept in memory, so
+        that `output_graph` is unchanged.
+
+        :param operation: The operation whose thoughts are no longer needed for the execution.
+        :type operation: Operation
+        """
+        spill = self.spill_dir is not None
+        thoughts = list(operation.get_thoughts())
+        self.released[operation] = list(thoughts) if spill else None
+        operation.release_thoughts()
+        if spill:
+            entries = self.released[operation]
+            unreferenced = self._count_references(thoughts, -1)
+            for index, thought in enumerate(thoughts):
+                self._spill_or_keep(entries, index, thought)
+            # thoughts of earlier released operations that were kept for the objects of this operation
+            for object_id in unreferenced:
+                for kept_entries, index, thought in self.kept.pop(object_id, []):
+                    self._spill_or_keep(kept_entries, index, thought)
+        self.logger.debug(
+            "Released the thoughts of operation %d (%s)",
+            operation.id,
+            "spilled" if spill else "dropped",
+        )
+
+    def _count_references(self, thoughts: List[Thought], delta: int) -> List[int]:
+        """
+        Add to the number of references to the thought and state objects of thoughts.
+
+        :param thoughts: The thoughts of an operation that was executed or released.
+        :type thoughts: List[Thought]
+        :param delta: 1 for an executed, -1 for a released operation.
+        :type delta: int
+        :return: The ids of the objects that are no longer referenced.
+        :rtype: List[int]
+        """
+        unreferenced = []
+        for thought in thoughts:
+            for object_id in (id(thought), id(thought.state)):
+                count = self.references.get(object_id, 0) + delta
+                if count > 0:
+                    self.references[object_id] = count
+                else:
+                    self.references.pop(object_id, None)
+                    unreferenced.append(object_id)
+        return unreferenced
+
+    def _spill_or_keep(
+        self, entries: List[Union[int, Thought]], index: int, thought: Thought
+    ) -> None:
+        """
+        Spill a released thought, or keep it until its thought and state objects are no longer referenced.
+
+        :param entries: The entries of the released operation.
+        :type entries: List[Union[int, Thought]]
+        :param index: The index of the thought in the entries.
+        :type index: int
+        :param thought: The thought.
+        :type thought: Thought
+        """
+        if entries[index] is not thought:
+            return
+        for object_id in (id(thought), id(thought.state)):
+            if object_id in self.references:
+                self.kept.setdefault(object_id, []).append((entries, index, thought))
+                return
+        entries[index] = self._spill_thought(thought)
+
+    def _spill_thought(self, thought: Thought) -> int:
+        """
+        Append a thought to the temporary file.
+
+        :param thought: The thought.
+        :type thought: Thought
+        :return: The offset of the thought in the file.
+        :rtype: int
+        """
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(
+                dir=self.spill_dir, prefix="spill_", suffix=".jsonl"
+            )
+        self.spill_file.seek(0, os.SEEK_END)
+        offset = self.spill_file.tell()
+        record = {
+            "state": dict(thought.state),
+            "score": thought.score,
+            "flags": [
+                thought.scored,
+                thought.valid,
+                thought.validated,
+                thought.solved,
+                thought.compared_to_ground_truth,
+            ],
+        }
+        self.spill_file.write((json.dumps(record) + "\n").encode("utf-8"))
+        return offset
+
+    def close(self) -> None:
+        """
+        Remove the temporary file of the spilled operations, afterwards they are written without thoughts.
+        """
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+            self.released = dict.fromkeys(self.released)
+            self.kept = {}
+
+    def _execute_operation(self, operation: Operation) -> None:
+        """
+        Execute a single operation with the controller's language model, prompter,
+        parser and problem parameters.
+
+        :param operation: The operation to execute.
+        :type operation: Operation
+        """
+        self.logger.info("Executing operation %s", operation.operation_type)
+        operation.execute(
+            self.lm,
+            self.prompter,
+            self.parser,
+            profiler=self.profiler,
+            **self.problem_parameters,
+        )
+        self.logger.info("Operation %s executed", operation.operation_type)
+
+    def _ready_successors(self, operation: Operation) -> List[Operation]:
+        """
+        Collect the successors of an executed operation that are ready for execution.
+
+        :param operation: The executed operation.
+        :type operation: Operation
+        :return: List of successors whose predecessors have all been executed.
+        :rtype: List[Operation]
+        :raises AssertionError: If the successor of an operation is not in the Graph of Operations.
+        """
+        ready = []
+        for successor in operation.successors:
+            assert (
+                successor in self.graph.operations
+            ), "The successor of an operation is not in the operations graph"
+            if successor.can_be_executed():
+                ready.append(successor)
+        return ready
+
+    def _serialize_operation(
+        self, operation: Operation, thoughts: Optional[List[Thought]] = None
+    ) -> dict:
+        """
+        Serialize the thoughts of an operation and their scores, validity and solved flags.
+
+        :param operation: The operation.
+        :type operation: Operation
+        :param thoughts: The thoughts of the operation. Defaults to None, in which case they are
+                         retrieved from the operation.
+        :type thoughts: Optional[List[Thought]]
+        :return: The serialized operation.
+        :rtype: dict
+        """
+        if thoughts is None:
+            thoughts = operation.get_thoughts()
+        operation_serialized = {
+            "operation": operation.operation_type.name,
+            "thoughts": [dict(thought.state) for thought in thoughts],
+        }
+        if any([thought.scored for thought in thoughts]):
+            operation_serialized["scored"] = [thought.scored for thought in thoughts]
+            operation_serialized["scores"] = [thought.score for thought in thoughts]
+        if any([thought.validated for thought in thoughts]):
+            operation_serialized["validated"] = [thought.validated for thought in thoughts]
+            operation_serialized["validity"] = [thought.valid for thought in thoughts]
+        if any([thought.compared_to_ground_truth for thought in thoughts]):
+            operation_serialized["compared_to_ground_truth"] = [
+                thought.compared_to_ground_truth for thought in thoughts
+            ]
+            operation_serialized["problem_solved"] = [thought.solved for thought in thoughts]
+        return operation_serialized
+
+    def _load_released(self, operation: Operation) -> dict:
+        """
+        Serialize a released operation from its spilled and kept thoughts.
+
+        :param operation: The released operation.
+        :type operation: Operation
+        :return: The serialized operation, without thoughts if they were dropped.
+        :rtype: dict
+        """
+        entries = self.released[operation]
+        if entries is None:
+            return {
+                "operation": operation.operation_type.name,
+                "thoughts": [],
+                "released": True,
+            }
+        thoughts = []
+        for entry in entries:
+            if isinstance(entry, Thought):
+                thoughts.append(entry)
+                continue
+            self.spill_file.seek(entry)
+            record = json.loads(self.spill_file.readline())
+            thought = Thought(record["state"])
+            thought.score = record["score"]
+            (
+                thought.scored,
+                thought.valid,
+                thought.validated,
+                thought.solved,
+                thought.compared_to_ground_truth,
+            ) = record["flags"]
+            thoughts.append(thought)
+        return self._serialize_operation(operation, thoughts)
+
     def get_final_thoughts(self) -> List[List[Thought]]:
         """
         Retrieve the final thoughts after all operations have been executed.
@@ -107,38 +469,10 @@ class Controller:
         """
         output = []
         for operation in self.graph.operations:
-            operation_serialized = {
-                "operation": operation.operation_type.name,
-                "thoughts": [thought.state for thought in operation.get_thoughts()],
-            }
-            if any([thought.scored for thought in operation.get_thoughts()]):
-                operation_serialized["scored"] = [
-                    thought.scored for thought in operation.get_thoughts()
-                ]
-                operation_serialized["scores"] = [
-                    thought.score for thought in operation.get_thoughts()
-                ]
-            if any([thought.validated for thought in operation.get_thoughts()]):
-                operation_serialized["validated"] = [
-                    thought.validated for thought in operation.get_thoughts()
-                ]
-                operation_serialized["validity"] = [
-                    thought.valid for thought in operation.get_thoughts()
-                ]
-            if any(
-                [
-                    thought.compared_to_ground_truth
-                    for thought in operation.get_thoughts()
-                ]
-            ):
-                operation_serialized["compared_to_ground_truth"] = [
-                    thought.compared_to_ground_truth
-                    for thought in operation.get_thoughts()
-                ]
-                operation_serialized["problem_solved"] = [
-                    thought.solved for thought in operation.get_thoughts()
-                ]
-            output.append(operation_serialized)
+            if operation in self.released:
+                output.append(self._load_released(operation))
+            else:
+                output.append(self._serialize_operation(operation))
 
         output.append(
             {
@@ -0,0 +1,47 @@
+# author: Jayce Ning
+
+import asyncio
+from typing import Optional
+
+import aiohttp
+
+
+class HTTPSessionMixin:
+    """
+    Per event loop aiohttp session for the language models that are served over HTTP.
+
+    Used together with AbstractLanguageModel, whose `aclose` hook it implements.
+    """
+
+    # HTTP session for asynchronous queries, created lazily for the running event loop.
+    _session: Optional[aiohttp.ClientSession] = None
+    _session_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Return the HTTP session of the running event loop, creating it if necessary.
+        The connection pool is not limited, the number of in-flight requests is bounded by the callers.
+
+        :return: The HTTP session.
+        :rtype: aiohttp.ClientSession
+        """
+        loop = asyncio.get_running_loop()
+        if (
+            self._session is None
+            or self._session.closed
+            or self._session_loop is not loop
+        ):
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=0)
+            )
+            self._session_loop = loop
+        return self._session
+
+    async def aclose(self) -> None:
+        """
+        Close the HTTP session used for asynchronous queries.
+        """
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._session_loop = None
@@ -6,11 +6,13 @@ import time
 from typing import List, Dict, Union
 
 from .abstract_language_model import AbstractLanguageModel
+from .http_session import HTTPSessionMixin
+from .response_cache import ResponseCache
 
 from lmdeploy.serve.openai.api_client import APIClient
 
 
-class InternLM2(AbstractLanguageModel):
+class InternLM2(HTTPSessionMixin, AbstractLanguageModel):
     """
     The InternLM2 class handles interactions with the InternLM2(use LMDeploy to accerate inference) 
     using the provided configuration.
@@ -19,7 +21,7 @@ class InternLM2(AbstractLanguageModel):
     """
 
     def __init__(
-        self, config_path: str = "", model_name: str = "internlm2", cache: bool = False
+        self, config_path: str = "", model_name: str = "internlm2", cache: Union[bool, ResponseCache] = False
     ) -> None:
         """
         Initialize the InternLM2 instance with configuration, model details, and caching options.
@@ -28,8 +30,8 @@ class InternLM2(AbstractLanguageModel):
         :type config_path: str
         :param model_name: Name of the model, default is 'internlm2'. Used to select the correct configuration.
         :type model_name: str
-        :param cache: Flag to determine whether to cache responses. Defaults to False.
-        :type cache: bool
+        :param cache: Flag to determine whether to cache responses in memory, or the response cache to use. Defaults to False.
+        :type cache: Union[bool, ResponseCache]
         """
         super().__init__(config_path, model_name, cache)
         self.config: Dict = self.config[model_name]
@@ -61,8 +63,11 @@ class InternLM2(AbstractLanguageModel):
         :return: Response(s) from the InternLM2 model.
         :rtype: Dict
         """
-        if self.cache and query in self.respone_cache:
-            return self.respone_cache[query]
+        cache_key = self.get_cache_key(query, num_responses)
+        if cache_key is not None:
+            response = self.response_cache.get(cache_key)
+            if response is not None:
+                return response
 
         if num_responses == 1:
             response = self.chat([{"role": "user", "content": query}], num_responses)
@@ -82,11 +87,12 @@ class InternLM2(AbstractLanguageModel):
                     self.logger.warning(
                         f"Error in internlm2: {e}, trying again with {next_try} samples"
                     )
+                    self.record_retry()
                     time.sleep(random.randint(1, 3))
                     total_num_attempts -= 1
 
-        if self.cache:
-            self.respone_cache[query] = response
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response)
         return response
 
     # @backoff.on_exception(
@@ -106,23 +112,91 @@ class InternLM2(AbstractLanguageModel):
 
         # LMDeploy /v1/chat/completions interface
         messages = [{"role": "user", "content": messages[0]["content"]}]
-        for item in self.api_client.chat_completions_v1(model=self.model_name, messages=messages, temperature=self.temperature, top_p=self.top_p):
-            response = item
-
-        self.prompt_tokens += response["usage"]["prompt_tokens"]
-        self.completion_tokens += response["usage"]["completion_tokens"]
-        prompt_tokens_k = float(self.prompt_tokens) / 1000.0
-        completion_tokens_k = float(self.completion_tokens) / 1000.0
-        self.cost = (
-            self.prompt_token_cost * prompt_tokens_k
-            + self.response_token_cost * completion_tokens_k
+        with self.observe_request():
+            for item in self.api_client.chat_completions_v1(model=self.model_name, messages=messages, temperature=self.temperature, top_p=self.top_p):
+                response = item
+
+        cost = self.update_usage(
+            response["usage"]["prompt_tokens"], response["usage"]["completion_tokens"]
         )
-        self.logger.info(
-            f"This is the response from internlm2: {response}"
-            f"\nThis is the cost of the response: {self.cost}"
+        # the raw response is not logged, the response texts are logged by the operations
+        self.logger.info("Response from internlm2, accumulated cost: %s", cost)
+        return response
+
+    async def aquery(self, query: str, num_responses: int = 1) -> Dict:
+        """
+        Asynchronously query the InternLM2 model for responses.
+
+        :param query: The query to be posed to the language model.
+        :type query: str
+        :param num_responses: Number of desired responses, default is 1.
+        :type num_responses: int
+        :return: Response(s) from the InternLM2 model.
+        :rtype: Dict
+        """
+        cache_key = self.get_cache_key(query, num_responses)
+        if cache_key is not None:
+            response = self.response_cache.get(cache_key)
+            if response is not None:
+                return response
+
+        messages = [{"role": "user", "content": query}]
+        if num_responses == 1:
+            response = await self.achat(messages, num_responses)
+        else:
+            # internlm2 interface is set to single query, the queries are sent concurrently
+            response = await self._agather_responses(
+                lambda: self.achat(messages, 1), num_responses
+            )
+
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response)
+        return response
+
+    async def achat(self, messages: List[Dict], num_responses: int = 1) -> Dict:
+        """
+        Asynchronously send chat messages to the InternLM2 Model and retrieve the model's response.
+
+        :param messages: A list of message dictionaries for the chat.
+        :type messages: List[Dict]
+        :param num_responses: Number of desired responses, default is 1.
+        :type num_responses: int
+        :return: The InternLM2 model's response.
+        :rtype: Dict
+        """
+
+        # LMDeploy /v1/chat/completions interface
+        data = {
+            "model": self.model_name,
+            "messages": [{"role": "user", "content": messages[0]["content"]}],
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "stream": False,
+        }
+        session = self._get_session()
+        with self.observe_request():
+            async with session.post(
+                self.url.rstrip("/") + "/v1/chat/completions", json=data
+            ) as http_response:
+                http_response.raise_for_status()
+                response = await http_response.json()
+
+        cost = self.update_usage(
+            response["usage"]["prompt_tokens"], response["usage"]["completion_tokens"]
         )
+        # the raw response is not logged, the response texts are logged by the operations
+        self.logger.info("Response from internlm2, accumulated cost: %s", cost)
         return response
 
+    def get_sampling_parameters(self) -> Dict:
+        """
+        Return the parameters that influence the sampled responses.
+
+        :return: The sampling parameters.
+        :rtype: Dict
+        """
+        return {"temperature": self.temperature, "top_p": self.top_p}
+
     def get_response_texts(self, query_response: Union[List[Dict], Dict]) -> List[str]:
         """
         Extract the response texts from the query response.
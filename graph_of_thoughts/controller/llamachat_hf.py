@@ -11,6 +11,7 @@ import torch
 import transformers
 from typing import List, Dict, Union
 from .abstract_language_model import AbstractLanguageModel
+from .response_cache import ResponseCache
 
 
 class Llama2HF(AbstractLanguageModel):
@@ -19,7 +20,7 @@ class Llama2HF(AbstractLanguageModel):
     """
 
     def __init__(
-        self, config_path: str = "", model_name: str = "llama7b-hf", cache: bool = False
+        self, config_path: str = "", model_name: str = "llama7b-hf", cache: Union[bool, ResponseCache] = False
     ) -> None:
         """
         Initialize an instance of the Llama2HF class with configuration, model details, and caching options.
@@ -29,8 +30,8 @@ class Llama2HF(AbstractLanguageModel):
         :param model_name: Specifies the name of the LLaMA model variant. Defaults to "llama7b-hf".
                            Used to select the correct configuration.
         :type model_name: str
-        :param cache: Flag to determine whether to cache responses. Defaults to False.
-        :type cache: bool
+        :param cache: Flag to determine whether to cache responses in memory, or the response cache to use. Defaults to False.
+        :type cache: Union[bool, ResponseCache]
         """
         super().__init__(config_path, model_name, cache)
         self.config: Dict = self.config[model_name]
@@ -84,29 +85,46 @@ class Llama2HF(AbstractLanguageModel):
         :return: Response(s) from the LLaMA 2 model.
         :rtype: List[Dict]
         """
-        if self.cache and query in self.respone_cache:
-            return self.respone_cache[query]
+        cache_key = self.get_cache_key(query, num_responses)
+        if cache_key is not None:
+            response = self.response_cache.get(cache_key)
+            if response is not None:
+                return response
         sequences = []
         query = f"<s><<SYS>>You are a helpful assistant. Always follow the intstructions precisely and output the response exactly in the requested format.<</SYS>>\n\n[INST] {query} [/INST]"
         for _ in range(num_responses):
-            sequences.extend(
-                self.generate_text(
-                    query,
-                    do_sample=True,
-                    top_k=self.top_k,
-                    num_return_sequences=1,
-                    eos_token_id=self.tokenizer.eos_token_id,
-                    max_length=self.max_tokens,
+            with self.observe_request():
+                sequences.extend(
+                    self.generate_text(
+                        query,
+                        do_sample=True,
+                        top_k=self.top_k,
+                        num_return_sequences=1,
+                        eos_token_id=self.tokenizer.eos_token_id,
+                        max_length=self.max_tokens,
+                    )
                 )
-            )
         response = [
             {"generated_text": sequence["generated_text"][len(query) :].strip()}
             for sequence in sequences
         ]
-        if self.cache:
-            self.respone_cache[query] = response
+        if cache_key is not None:
+            self.response_cache.put(cache_key, response)
         return response
 
+    def get_sampling_parameters(self) -> Dict:
+        """
+        Return the parameters that influence the sampled responses.
+
+        :return: The sampling parameters.
+        :rtype: Dict
+        """
+        return {
+            "temperature": self.temperature,
+            "top_k": self.top_k,
+            "max_tokens": self.max_tokens,
+        }
+
     def get_response_texts(self, query_responses: List[Dict]) -> List[str]:
         """
         Extract the response texts from the query response.
@@ -0,0 +1,218 @@
+# author: Jayce Ning
+
+import asyncio
+import math
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Tuple, Union
+
+from .abstract_language_model import AbstractLanguageModel
+
+
+class MockLanguageModel(AbstractLanguageModel):
+    """
+    Deterministic language model for benchmarks and tests, which measures the overhead of the framework
+    apart from the latency of a real model.
+
+    Every response is an <Abstract> built from words of the prompt, so that the responses can be parsed and
+    scored like real ones. The latency of the requests is drawn from a configurable distribution. Each
+    response only depends on the seed, the prompt and the number of earlier responses to the same prompt,
+    so the responses are the same for every run, whether the samples of a prompt are requested together
+    or one by one.
+    """
+
+    latency_distributions = ("constant", "uniform", "exponential", "lognormal")
+
+    def __init__(
+        self,
+        config_path: str = "",
+        model_name: str = "mock",
+        cache: bool = False,
+        latency: str = "constant",
+        mean_latency: float = 0.0,
+        latency_spread: float = 0.5,
+        response_tokens: Union[int, Tuple[int, int]] = 150,
+        prompt_token_cost: float = 0.0,
+        response_token_cost: float = 0.0,
+        seed: int = 0,
+    ) -> None:
+        """
+        Initialize the MockLanguageModel instance.
+
+        :param config_path: Not used, the mock model needs no configuration. Defaults to "".
+        :type config_path: str
+        :param model_name: Name of the model. Defaults to "mock".
+        :type model_name: str
+        :param cache: Flag to determine whether to cache responses in memory. Defaults to False.
+        :type cache: bool
+        :param latency: Distribution of the latency of a request: "constant", "uniform" (mean +- spread * mean),
+                        "exponential" or "lognormal" (sigma = spread). Defaults to "constant".
+        :type latency: str
+        :param mean_latency: Mean latency of a request in seconds. Defaults to 0.0.
+        :type mean_latency: float
+        :param latency_spread: Relative spread of the latency. Defaults to 0.5.
+        :type latency_spread: float
+        :param response_tokens: Number of words of a response, or the range from which it is drawn. Defaults to 150.
+        :type response_tokens: Union[int, Tuple[int, int]]
+        :param prompt_token_cost: Price per 1000 prompt tokens. Defaults to 0.0.
+        :type prompt_token_cost: float
+        :param response_token_cost: Price per 1000 response tokens. Defaults to 0.0.
+        :type response_token_cost: float
+        :param seed: Seed of the responses and latencies. Defaults to 0.
+        :type seed: int
+        :raises AssertionError: If the latency distribution is unknown.
+        """
+        assert latency in self.latency_distributions, f"Unknown latency distribution {latency}"
+        super().__init__(config_path, model_name, cache)
+        self.model_id: str = model_name
+        self.latency: str = latency
+        self.mean_latency: float = mean_latency
+        self.latency_spread: float = latency_spread
+        self.response_tokens: Union[int, Tuple[int, int]] = response_tokens
+        self.prompt_token_cost: float = prompt_token_cost
+        self.response_token_cost: float = response_token_cost
+        self.seed: int = seed
+        self.sample_counts: Dict[str, int] = {}
+        self.stats_lock: threading.Lock = threading.Lock()
+        self.num_requests: int = 0
+        self.total_latency: float = 0.0
+
+    def load_config(self, path: str) -> None:
+        """
+        Load the configuration only if a path is given, the mock model needs none.
+
+        :param path: Path to the config file.
+        :type path: str
+        """
+        if path == "":
+            self.config = {}
+        else:
+            super().load_config(path)
+
+    def reset_usage(self) -> None:
+        """
+        Reset the usage counters and the sample counts, so that a repeated run gets the same responses.
+        """
+        super().reset_usage()
+        with self.stats_lock:
+            self.sample_counts.clear()
+            self.num_requests = 0
+            self.total_latency = 0.0
+
+    def _plan(self, query: str, num_responses: int) -> Tuple[List[str], float]:
+        """
+        Create the responses and the latency of a request.
+
+        :param query: The query.
+        :type query: str
+        :param num_responses: The number of desired responses.
+        :type num_responses: int
+        :return: The responses and the latency in seconds.
+        :rtype: Tuple[List[str], float]
+        """
+        with self.stats_lock:
+            index = self.sample_counts.get(query, 0)
+            self.sample_counts[query] = index + num_responses
+        rng = random.Random(f"{self.seed}:{index}:{num_responses}:{query}")
+        if self.latency == "constant":
+            latency = self.mean_latency
+        elif self.latency == "uniform":
+            latency = rng.uniform(
+                self.mean_latency * (1 - self.latency_spread), self.mean_latency * (1 + self.latency_spread)
+            )
+        elif self.latency == "exponential":
+            latency = rng.expovariate(1 / self.mean_latency) if self.mean_latency > 0 else 0.0
+        else:
+            # lognormal with the given mean
+            sigma = self.latency_spread
+            latency = (
+                rng.lognormvariate(0, sigma) * self.mean_latency / math.exp(sigma**2 / 2)
+                if self.mean_latency > 0
+                else 0.0
+            )
+
+        words = re.findall(r"[A-Za-z]+", query) or ["abstract"]
+        responses = []
+        for sample in range(index, index + num_responses):
+            rng = random.Random(f"{self.seed}:{sample}:{query}")
+            num_words = (
+                self.response_tokens
+                if isinstance(self.response_tokens, int)
+                else rng.randint(*self.response_tokens)
+            )
+            responses.append(
+                "<Abstract>" + " ".join(rng.choice(words) for _ in range(num_words)) + "</Abstract>"
+            )
+        return responses, max(latency, 0.0)
+
+    def _account(self, query: str, responses: List[str], latency: float) -> None:
+        with self.stats_lock:
+            self.num_requests += 1
+            self.total_latency += latency
+        # about four characters per token
+        self.update_usage(len(query) // 4, sum(len(response) // 4 for response in responses))
+
+    def query(self, query: str, num_responses: int = 1) -> List[str]:
+        """
+        Query the mock model, sleeping for the latency of the request.
+
+        :param query: The query to be posed to the language model.
+        :type query: str
+        :param num_responses: Number of desired responses, default is 1.
+        :type num_responses: int
+        :return: The responses.
+        :rtype: List[str]
+        """
+        cache_key = self.get_cache_key(query, num_responses)
+        if cache_key is not None:
+            response = self.response_cache.get(cache_key)
+            if response is not None:
+                return response
+        responses, latency = self._plan(query, num_responses)
+        with self.observe_request():
+            if latency > 0:
+                time.sleep(latency)
+        self._account(query, responses, latency)
+        if cache_key is not None:
+            self.response_cache.put(cache_key, responses)
+        return responses
+
+    async def aquery(self, query: str, num_responses: int = 1) -> List[str]:
+        """
+        Asynchronously query the mock model, awaiting the latency of the request without blocking a thread.
+
+        :param query: The query to be posed to the language model.
+        :type query: str
+        :param num_responses: Number of desired responses, default is 1.
+        :type num_responses: int
+        :return: The responses.
+        :rtype: List[str]
+        """
+        cache_key = self.get_cache_key(query, num_responses)
+        if cache_key is not None:
+            response = self.response_cache.get(cache_key)
+            if response is not None:
+                return response
+        responses, latency = self._plan(query, num_responses)
+        with self.observe_request():
+            if latency > 0:
+                await asyncio.sleep(latency)
+        self._account(query, responses, latency)
+        if cache_key is not None:
+            self.response_cache.put(cache_key, responses)
+        return responses
+
+    def get_response_texts(self, query_response: Union[List[str], str]) -> List[str]:
+        """
+        Return the texts of the responses.
+
+        :param query_response: The responses returned by `query`.
+        :type query_response: Union[List[str], str]
+        :return: List of response strings.
+        :rtype: List[str]
+        """
+        if isinstance(query_response, str):
+            return [query_response]
+        return list(query_response)
@@ -0,0 +1,309 @@
+# author: Jayce Ning
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from graph_of_thoughts.metrics import metrics
+
+
+class ResponseCache(ABC):
+    """
+    Abstract base class for caches of language model responses.
+    Responses are stored under keys created by `make_key` and the cache counts its hits and misses.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialize the hit and miss counters.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.hits: int = 0
+        self.misses: int = 0
+        self.stats_lock: threading.Lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        model_id: str,
+        sampling_parameters: Dict,
+        query: str,
+        num_responses: int,
+        sample_index: int,
+    ) -> str:
+        """
+        Create the cache key of a request.
+
+        :param model_id: Id of the queried model.
+        :type model_id: str
+        :param sampling_parameters: Parameters that influence the sampled responses, e.g. the temperature.
+        :type sampling_parameters: Dict
+        :param query: The query posed to the language model.
+        :type query: str
+        :param num_responses: Number of requested responses.
+        :type num_responses: int
+        :param sample_index: Index of the request among the requests with the same query.
+        :type sample_index: int
+        :return: Hex digest identifying the request.
+        :rtype: str
+        """
+        key = json.dumps(
+            [model_id, sampling_parameters, num_responses, sample_index, query],
+            sort_keys=True,
+            default=str,
+        )
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a response and count the hit or miss.
+
+        :param key: The cache key.
+        :type key: str
+        :return: The cached response or None if there is no valid entry.
+        :rtype: Optional[Any]
+        """
+        response = self._get(key)
+        with self.stats_lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.response_cache_requests.inc(
+            cache=self.__class__.__name__, result="miss" if response is None else "hit"
+        )
+        return response
+
+    def stats(self) -> Dict[str, float]:
+        """
+        Return the hit and miss counters.
+
+        :return: Number of hits, misses and the hit rate.
+        :rtype: Dict[str, float]
+        """
+        with self.stats_lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+            }
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[Any]:
+        """
+        Abstract method to look up a response.
+
+        :param key: The cache key.
+        :type key: str
+        :return: The cached response or None if there is no valid entry.
+        :rtype: Optional[Any]
+        """
+        pass
+
+    @abstractmethod
+    def put(self, key: str, response: Any) -> None:
+        """
+        Abstract method to store a response.
+
+        :param key: The cache key.
+        :type key: str
+        :param response: The response of the language model, must be JSON serializable.
+        :type response: Any
+        """
+        pass
+
+    @abstractmethod
+    def clear(self) -> None:
+        """
+        Abstract method to remove all entries.
+        """
+        pass
+
+
+class MemoryResponseCache(ResponseCache):
+    """
+    Response cache that keeps the responses in memory for the lifetime of the process.
+    Evicts the least recently used entries if the maximum number of entries is reached.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None) -> None:
+        """
+        Initialize the in-memory cache.
+
+        :param max_entries: Maximum number of cached responses. Defaults to None (unbounded).
+        :type max_entries: Optional[int]
+        """
+        super().__init__()
+        self.max_entries: Optional[int] = max_entries
+        self.entries: OrderedDict = OrderedDict()
+        self.lock: threading.Lock = threading.Lock()
+
+    def _get(self, key: str) -> Optional[Any]:
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key: str, response: Any) -> None:
+        with self.lock:
+            self.entries[key] = response
+            self.entries.move_to_end(key)
+            if self.max_entries is not None:
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+
+class SQLiteResponseCache(ResponseCache):
+    """
+    Response cache that persists the responses in a SQLite database.
+    The database runs in WAL mode, so it can be shared by concurrent threads and processes.
+    Entries older than `max_age` seconds are ignored and removed, and the least recently used
+    entries are removed if the stored responses exceed `max_size` bytes. Both are removed every
+    `evict_interval` insertions, so the database can exceed `max_size` by as many responses in between.
+    Reads only write to the database to track the recently used entries for `max_size`, and at most
+    once per `access_interval` seconds and entry.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_size: Optional[int] = None,
+        max_age: Optional[float] = None,
+        timeout: float = 30.0,
+        evict_interval: int = 100,
+        access_interval: float = 60.0,
+    ) -> None:
+        """
+        Initialize the SQLite cache, creating the database if necessary.
+
+        :param path: Path to the database file.
+        :type path: str
+        :param max_size: Maximum size of the stored responses in bytes. Defaults to None (unbounded).
+        :type max_size: Optional[int]
+        :param max_age: Maximum age of an entry in seconds. Defaults to None (entries do not expire).
+        :type max_age: Optional[float]
+        :param timeout: Seconds to wait for a lock held by another connection. Defaults to 30.
+        :type timeout: float
+        :param evict_interval: Number of insertions after which the expired and least recently used
+                               entries are removed. Defaults to 100.
+        :type evict_interval: int
+        :param access_interval: Seconds after which the access time of an entry is updated again when it
+                                is read. Defaults to 60.
+        :type access_interval: float
+        :raises AssertionError: If `evict_interval` is not greater than zero.
+        """
+        assert evict_interval > 0, "The entries must be evicted after a positive number of insertions"
+        super().__init__()
+        self.path: str = path
+        self.max_size: Optional[int] = max_size
+        self.max_age: Optional[float] = max_age
+        self.timeout: float = timeout
+        self.evict_interval: int = evict_interval
+        self.access_interval: float = access_interval
+        self.puts_since_eviction: int = 0
+        self.eviction_lock: threading.Lock = threading.Lock()
+        # sqlite3 connections must not be shared between threads
+        self.local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        connection = self._connection()
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+                "created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+            )
+        self.evict()
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Return the database connection of the current thread, opening it if necessary.
+
+        :return: The connection.
+        :rtype: sqlite3.Connection
+        """
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=self.timeout)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    def _get(self, key: str) -> Optional[Any]:
+        connection = self._connection()
+        now = time.time()
+        row = connection.execute(
+            "SELECT response, created, accessed FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        response, created, accessed = row
+        if self.max_age is not None and now - created > self.max_age:
+            return None
+        # the access time only orders the eviction by size, updating it takes the write lock
+        if self.max_size is not None and now - accessed > self.access_interval:
+            with connection:
+                connection.execute(
+                    "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+                )
+        return json.loads(response)
+
+    def put(self, key: str, response: Any) -> None:
+        connection = self._connection()
+        now = time.time()
+        serialized = json.dumps(response)
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, serialized, len(serialized), now, now),
+            )
+        if self.max_size is None and self.max_age is None:
+            return
+        with self.eviction_lock:
+            self.puts_since_eviction += 1
+            if self.puts_since_eviction < self.evict_interval:
+                return
+            self.puts_since_eviction = 0
+        self.evict()
+
+    def evict(self) -> None:
+        """
+        Remove expired entries and the least recently used entries exceeding the size limit.
+        """
+        connection = self._connection()
+        with connection:
+            if self.max_age is not None:
+                connection.execute(
+                    "DELETE FROM responses WHERE created < ?",
+                    (time.time() - self.max_age,),
+                )
+            if self.max_size is not None:
+                connection.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM (SELECT key, SUM(size) OVER "
+                    "(ORDER BY accessed DESC, key) AS total FROM responses) "
+                    "WHERE total > ?)",
+                    (self.max_size,),
+                )
+
+    def clear(self) -> None:
+        connection = self._connection()
+        with connection:
+            connection.execute("DELETE FROM responses")
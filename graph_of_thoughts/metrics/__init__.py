@@ -0,0 +1,8 @@
+from .metrics import (
+    Counter,
+    Histogram,
+    MetricsRegistry,
+    registry,
+    operation_label,
+    current_operation,
+)
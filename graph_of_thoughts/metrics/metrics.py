@@ -0,0 +1,341 @@
+# author: Jayce Ning
+
+from __future__ import annotations
+import bisect
+import contextvars
+import json
+import math
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+# type of the operation that is executed in the current thread or task, used as label of the LM metrics
+_current_operation: contextvars.ContextVar[str] = contextvars.ContextVar("current_operation", default="none")
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+@contextmanager
+def operation_label(operation_type: str) -> Iterator[None]:
+    """
+    Label the LM metrics recorded inside the context with the type of an operation.
+
+    :param operation_type: The type of the operation, e.g. "generate".
+    :type operation_type: str
+    """
+    token = _current_operation.set(operation_type)
+    try:
+        yield
+    finally:
+        _current_operation.reset(token)
+
+
+def current_operation() -> str:
+    """
+    Return the type of the operation that is executed in the current thread or task.
+
+    :return: The type of the operation, "none" outside of operations.
+    :rtype: str
+    """
+    return _current_operation.get()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labelnames: Sequence[str], labels: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """
+    Base class of the metrics, which keep a value per combination of label values.
+    """
+
+    kind: str = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self.lock: threading.Lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        assert set(labels) == set(self.labelnames), f"{self.name} expects the labels {self.labelnames}"
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value, e.g. the number of requests or tokens.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        """
+        Increase the value of the given labels.
+
+        :param amount: The increment. Defaults to 1.0.
+        :type amount: float
+        :param labels: The label values.
+        """
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def get(self, **labels) -> float:
+        with self.lock:
+            return self.values.get(self._key(labels), 0.0)
+
+    def samples(self) -> List[Dict]:
+        with self.lock:
+            return [
+                {"labels": dict(zip(self.labelnames, key)), "value": value}
+                for key, value in sorted(self.values.items())
+            ]
+
+    def render(self) -> List[str]:
+        with self.lock:
+            return [
+                f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(self.values.items())
+            ]
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values in cumulative buckets, e.g. the latency of the requests.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        # per label values: the counts per bucket (the last one is +Inf), the sum and the number of observations
+        self.values: Dict[Tuple, List] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Add an observation.
+
+        :param value: The observed value.
+        :type value: float
+        :param labels: The label values.
+        """
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts[0][index] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def samples(self) -> List[Dict]:
+        with self.lock:
+            samples = []
+            for key, (counts, total, count) in sorted(self.values.items()):
+                cumulative = 0
+                buckets = {}
+                for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                    cumulative += bucket_count
+                    buckets[_format_value(bound)] = cumulative
+                samples.append(
+                    {
+                        "labels": dict(zip(self.labelnames, key)),
+                        "count": count,
+                        "sum": total,
+                        "mean": total / count if count > 0 else 0.0,
+                        "buckets": buckets,
+                    }
+                )
+            return samples
+
+    def render(self) -> List[str]:
+        lines = []
+        for sample in self.samples():
+            key = tuple(sample["labels"][name] for name in self.labelnames)
+            for bound, cumulative in sample["buckets"].items():
+                labels = _format_labels(self.labelnames, key, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(sample['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {sample['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics that can be rendered in the Prometheus text format, served over HTTP and
+    returned as a snapshot. The registry and its metrics are thread-safe.
+    """
+
+    def __init__(self) -> None:
+        self.metrics: Dict[str, Metric] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def _register(self, metric: Metric) -> Metric:
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                assert (
+                    type(existing) is type(metric) and existing.labelnames == metric.labelnames
+                ), f"The metric {metric.name} is already registered with another type or labels"
+                return existing
+            self.metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """
+        Return the counter with the given name, creating it if necessary.
+
+        :param name: Name of the counter.
+        :type name: str
+        :param documentation: Description of the counter.
+        :type documentation: str
+        :param labelnames: Names of the labels. Defaults to no labels.
+        :type labelnames: Sequence[str]
+        :return: The counter.
+        :rtype: Counter
+        """
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """
+        Return the histogram with the given name, creating it if necessary.
+
+        :param name: Name of the histogram.
+        :type name: str
+        :param documentation: Description of the histogram.
+        :type documentation: str
+        :param labelnames: Names of the labels. Defaults to no labels.
+        :type labelnames: Sequence[str]
+        :param buckets: Upper bounds of the buckets. Defaults to DEFAULT_BUCKETS (seconds).
+        :type buckets: Sequence[float]
+        :return: The histogram.
+        :rtype: Histogram
+        """
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        Render all metrics in the Prometheus text exposition format.
+
+        :return: The metrics.
+        :rtype: str
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """
+        Return the current values of all metrics.
+
+        :return: The type, description and samples of every metric keyed by its name.
+        :rtype: Dict[str, Dict]
+        """
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return {
+            metric.name: {"type": metric.kind, "help": metric.documentation, "samples": metric.samples()}
+            for metric in metrics
+        }
+
+    def serve(self, port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """
+        Serve the metrics on a background thread, in the Prometheus text format at /metrics and as JSON
+        snapshot at /metrics.json.
+
+        :param port: The port, 0 selects a free port.
+        :type port: int
+        :param host: The address to bind to. Defaults to "127.0.0.1".
+        :type host: str
+        :return: The running server, stop it with `shutdown()`.
+        :rtype: ThreadingHTTPServer
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                path = self.path.split("?")[0]
+                if path == "/metrics":
+                    body = registry.render().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif path == "/metrics.json":
+                    body = json.dumps(registry.snapshot()).encode("utf-8")
+                    content_type = "application/json"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        return server
+
+
+# registry of the framework, the language models, response caches and operations report to it
+registry = MetricsRegistry()
+
+LM_LABELS = ("backend", "model", "operation")
+
+lm_request_seconds = registry.histogram(
+    "got_lm_request_seconds", "Latency of the requests to the language model in seconds", LM_LABELS
+)
+lm_requests = registry.counter("got_lm_requests_total", "Requests sent to the language model", LM_LABELS)
+lm_errors = registry.counter("got_lm_errors_total", "Requests to the language model that failed", LM_LABELS)
+lm_retries = registry.counter(
+    "got_lm_retries_total", "Failed requests or samples that are requested again", LM_LABELS
+)
+lm_prompt_tokens = registry.counter("got_lm_prompt_tokens_total", "Prompt tokens used", LM_LABELS)
+lm_completion_tokens = registry.counter("got_lm_completion_tokens_total", "Completion tokens used", LM_LABELS)
+lm_cost = registry.counter("got_lm_cost_total", "Cost of the requests in dollars", LM_LABELS)
+response_cache_requests = registry.counter(
+    "got_response_cache_requests_total", "Lookups in the response caches by result (hit or miss)", ("cache", "result")
+)
+operation_seconds = registry.histogram(
+    "got_operation_seconds", "Execution time of the operations in seconds", ("operation",)
+)
@@ -14,3 +14,4 @@ from .operations import (
     DGenerateScore,
     DAggregate,
 )
+from .thought_state import ThoughtState, merge_states
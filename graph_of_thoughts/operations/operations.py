@@ -7,16 +7,25 @@
 # main author: Nils Blach
 
 from __future__ import annotations
+import asyncio
+import contextvars
 import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from enum import Enum
-from typing import List, Iterator, Dict, Callable, Union
+from typing import List, Iterator, Dict, Callable, Mapping, Optional, Tuple, Union
 from abc import ABC, abstractmethod
 import itertools
 
 from graph_of_thoughts.operations.thought import Thought
+from graph_of_thoughts.operations.thought_state import ThoughtState, merge_states
 from graph_of_thoughts.controller.abstract_language_model import AbstractLanguageModel
 from graph_of_thoughts.prompter import Prompter
 from graph_of_thoughts.parser import Parser
+from graph_of_thoughts.profiler import Profiler, trace_span
+from graph_of_thoughts.metrics import metrics
 
 
 class OperationType(Enum):
@@ -46,15 +55,27 @@ class Operation(ABC):
 
     operation_type: OperationType = None
 
-    def __init__(self) -> None:
+    def __init__(self, max_concurrent_queries: Optional[int] = None) -> None:
         """
         Initializes a new Operation instance with a unique id, and empty predecessors and successors.
+
+        :param max_concurrent_queries: Maximum number of requests to the LM that the operation
+                                       sends concurrently. Defaults to None, in which case the
+                                       synchronous execution sends them one after another and
+                                       the asynchronous execution does not limit them.
+        :type max_concurrent_queries: Optional[int]
+        :raises AssertionError: If `max_concurrent_queries` is not greater than zero.
         """
+        assert (
+            max_concurrent_queries is None or max_concurrent_queries > 0
+        ), "The operation must be allowed to send at least one query"
         self.logger: logging.Logger = logging.getLogger(self.__class__.__name__)
         self.id: int = next(Operation._ids)
         self.predecessors: List[Operation] = []
         self.successors: List[Operation] = []
         self.executed: bool = False
+        self.thoughts_released: bool = False
+        self.max_concurrent_queries: Optional[int] = max_concurrent_queries
 
     def can_be_executed(self) -> bool:
         """
@@ -101,7 +122,12 @@ class Operation(ABC):
         operation.predecessors.append(self)
 
     def execute(
-        self, lm: AbstractLanguageModel, prompter: Prompter, parser: Parser, **kwargs
+        self,
+        lm: AbstractLanguageModel,
+        prompter: Prompter,
+        parser: Parser,
+        profiler: Optional[Profiler] = None,
+        **kwargs,
     ) -> None:
         """
         Execute the operation, assuring that all predecessors have been executed.
@@ -112,6 +138,9 @@ class Operation(ABC):
         :type prompter: Prompter
         :param parser: The parser for parsing responses.
         :type parser: Parser
+        :param profiler: Records a span of the operation with child spans for the prompts, the requests to
+                         the LM, parsing and scoring. Defaults to None.
+        :type profiler: Optional[Profiler]
         :param kwargs: Additional parameters for execution.
         :raises AssertionError: If not all predecessors have been executed.
         """
@@ -119,10 +148,301 @@ class Operation(ABC):
         self.logger.info(
             "Executing operation %d of type %s", self.id, self.operation_type
         )
-        self._execute(lm, prompter, parser, **kwargs)
+        profiled = (
+            profiler.operation(self, lm, prompter, parser)
+            if profiler is not None
+            else nullcontext((lm, prompter, parser))
+        )
+        start = time.perf_counter()
+        with profiled as (lm, prompter, parser), metrics.operation_label(
+            self.operation_type.name
+        ):
+            self._execute(lm, prompter, parser, **kwargs)
+        metrics.operation_seconds.observe(
+            time.perf_counter() - start, operation=self.operation_type.name
+        )
+        self.logger.debug("Operation %d executed", self.id)
+        self.executed = True
+
+    async def aexecute(
+        self,
+        lm: AbstractLanguageModel,
+        prompter: Prompter,
+        parser: Parser,
+        profiler: Optional[Profiler] = None,
+        **kwargs,
+    ) -> None:
+        """
+        Asynchronously execute the operation, assuring that all predecessors have been executed.
+
+        :param lm: The language model to be used.
+        :type lm: AbstractLanguageModel
+        :param prompter: The prompter for crafting prompts.
+        :type prompter: Prompter
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param profiler: Records a span of the operation with child spans for the prompts, the requests to
+                         the LM, parsing and scoring. Defaults to None.
+        :type profiler: Optional[Profiler]
+        :param kwargs: Additional parameters for execution.
+        :raises AssertionError: If not all predecessors have been executed.
+        """
+        assert self.can_be_executed(), "Not all predecessors have been executed"
+        self.logger.info(
+            "Executing operation %d of type %s", self.id, self.operation_type
+        )
+        profiled = (
+            profiler.operation(self, lm, prompter, parser)
+            if profiler is not None
+            else nullcontext((lm, prompter, parser))
+        )
+        start = time.perf_counter()
+        with profiled as (lm, prompter, parser), metrics.operation_label(
+            self.operation_type.name
+        ):
+            await self._aexecute(lm, prompter, parser, **kwargs)
+        metrics.operation_seconds.observe(
+            time.perf_counter() - start, operation=self.operation_type.name
+        )
         self.logger.debug("Operation %d executed", self.id)
         self.executed = True
 
+    async def _aexecute(
+        self, lm: AbstractLanguageModel, prompter: Prompter, parser: Parser, **kwargs
+    ) -> None:
+        """
+        Asynchronous execution of the operation.
+        Operations that query the language model override this method and await their
+        queries, all other operations are executed synchronously.
+
+        :param lm: The language model to be used.
+        :type lm: AbstractLanguageModel
+        :param prompter: The prompter for crafting prompts.
+        :type prompter: Prompter
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param kwargs: Additional parameters for execution.
+        """
+        self._execute(lm, prompter, parser, **kwargs)
+
+    def _query_all(
+        self, lm: AbstractLanguageModel, queries: List[Tuple[str, int]]
+    ) -> List[List[str]]:
+        """
+        Query the language model with several prompts.
+        If `max_concurrent_queries` is set, the samples of all prompts are requested
+        concurrently on a pool of that many threads, otherwise one prompt after another.
+
+        :param lm: The language model to be used.
+        :type lm: AbstractLanguageModel
+        :param queries: Pairs of prompt and number of desired responses.
+        :type queries: List[Tuple[str, int]]
+        :return: The response texts for each prompt, in the order of the queries.
+        :rtype: List[List[str]]
+        """
+        if self.max_concurrent_queries is None or self.max_concurrent_queries == 1:
+            all_responses = []
+            for prompt, num_responses in queries:
+                responses = lm.get_response_texts(
+                    lm.query(prompt, num_responses=num_responses)
+                )
+                self.logger.debug("Responses from LM: %s", responses)
+                all_responses.append(responses)
+            return all_responses
+
+        requests, slots, failures_left = self._split_queries(queries)
+        # the requests run in the context of the operation, e.g. inside its profiling span
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(
+            max_workers=self.max_concurrent_queries,
+            thread_name_prefix=f"operation-{self.id}",
+        ) as pool:
+            while len(requests) > 0:
+                results = list(
+                    pool.map(
+                        lambda request: context.copy().run(
+                            self._query_request, lm, request[2], request[3]
+                        ),
+                        requests,
+                    )
+                )
+                requests = self._collect_responses(
+                    requests, results, slots, failures_left
+                )
+                if len(requests) > 0:
+                    time.sleep(random.randint(1, 3))
+        return self._join_slots(slots)
+
+    async def _aquery_all(
+        self, lm: AbstractLanguageModel, queries: List[Tuple[str, int]]
+    ) -> List[List[str]]:
+        """
+        Query the language model with several prompts concurrently.
+        The samples of all prompts are requested at the same time, at most
+        `max_concurrent_queries` of them if it is set.
+
+        :param lm: The language model to be used.
+        :type lm: AbstractLanguageModel
+        :param queries: Pairs of prompt and number of desired responses.
+        :type queries: List[Tuple[str, int]]
+        :return: The response texts for each prompt, in the order of the queries.
+        :rtype: List[List[str]]
+        """
+        semaphore = (
+            asyncio.Semaphore(self.max_concurrent_queries)
+            if self.max_concurrent_queries is not None
+            else None
+        )
+
+        async def query(prompt: str, num_responses: int) -> Union[List[str], None]:
+            if semaphore is None:
+                return await self._aquery_request(lm, prompt, num_responses)
+            async with semaphore:
+                return await self._aquery_request(lm, prompt, num_responses)
+
+        requests, slots, failures_left = self._split_queries(queries)
+        while len(requests) > 0:
+            results = await asyncio.gather(
+                *[query(request[2], request[3]) for request in requests]
+            )
+            requests = self._collect_responses(requests, results, slots, failures_left)
+            if len(requests) > 0:
+                await asyncio.sleep(random.randint(1, 3))
+        return self._join_slots(slots)
+
+    def _sample_waves(self, num_responses: int) -> List[int]:
+        """
+        Splits the responses of an early stopping sampling loop into waves that are
+        requested concurrently, one response per wave if `max_concurrent_queries` is not set.
+
+        :param num_responses: Maximum number of responses.
+        :type num_responses: int
+        :return: The number of responses of each wave.
+        :rtype: List[int]
+        """
+        wave_size = self.max_concurrent_queries or 1
+        return [
+            min(wave_size, num_responses - start)
+            for start in range(0, num_responses, wave_size)
+        ]
+
+    def _split_queries(
+        self, queries: List[Tuple[str, int]]
+    ) -> Tuple[List[Tuple[int, int, str, int]], List[List[List[str]]], List[int]]:
+        """
+        Splits the queries into independent requests for a single sample each.
+
+        :param queries: Pairs of prompt and number of desired responses.
+        :type queries: List[Tuple[str, int]]
+        :return: The requests as tuples of query index, slot index, prompt and number of
+                 responses, an empty slot for each request and the number of failed
+                 requests that are tolerated for each query.
+        :rtype: Tuple[List[Tuple[int, int, str, int]], List[List[List[str]]], List[int]]
+        """
+        requests = []
+        slots = []
+        for index, (prompt, num_responses) in enumerate(queries):
+            requests.extend((index, slot, prompt, 1) for slot in range(num_responses))
+            slots.append([[] for _ in range(num_responses)])
+        failures_left = [num_responses for _, num_responses in queries]
+        return requests, slots, failures_left
+
+    def _query_request(
+        self, lm: AbstractLanguageModel, prompt: str, num_responses: int
+    ) -> Union[List[str], None]:
+        """
+        Sends a single request to the language model.
+
+        :param lm: The language model to be used.
+        :type lm: AbstractLanguageModel
+        :param prompt: The prompt.
+        :type prompt: str
+        :param num_responses: Number of desired responses.
+        :type num_responses: int
+        :return: The response texts or None if the request failed.
+        :rtype: Union[List[str], None]
+        """
+        try:
+            return lm.get_response_texts(lm.query(prompt, num_responses=num_responses))
+        except Exception as e:
+            self.logger.warning(f"Error in operation {self.id}: {e}, trying again")
+            lm.record_retry()
+            return None
+
+    async def _aquery_request(
+        self, lm: AbstractLanguageModel, prompt: str, num_responses: int
+    ) -> Union[List[str], None]:
+        """
+        Asynchronously sends a single request to the language model.
+
+        :param lm: The language model to be used.
+        :type lm: AbstractLanguageModel
+        :param prompt: The prompt.
+        :type prompt: str
+        :param num_responses: Number of desired responses.
+        :type num_responses: int
+        :return: The response texts or None if the request failed.
+        :rtype: Union[List[str], None]
+        """
+        try:
+            return await lm.aget_response_texts(
+                await lm.aquery(prompt, num_responses=num_responses)
+            )
+        except Exception as e:
+            self.logger.warning(f"Error in operation {self.id}: {e}, trying again")
+            lm.record_retry()
+            return None
+
+    def _collect_responses(
+        self,
+        requests: List[Tuple[int, int, str, int]],
+        results: List[Union[List[str], None]],
+        slots: List[List[List[str]]],
+        failures_left: List[int],
+    ) -> List[Tuple[int, int, str, int]]:
+        """
+        Stores the responses of a round of requests in their slots.
+        Failed requests are repeated until as many requests as responses
+        of their query have failed, counting all failures of the round.
+
+        :param requests: The requests of the round.
+        :type requests: List[Tuple[int, int, str, int]]
+        :param results: The response texts of the requests, None for failed requests.
+        :type results: List[Union[List[str], None]]
+        :param slots: The responses of each request, grouped by query.
+        :type slots: List[List[List[str]]]
+        :param failures_left: The number of failed requests that are tolerated for each query.
+        :type failures_left: List[int]
+        :return: The requests to be repeated.
+        :rtype: List[Tuple[int, int, str, int]]
+        """
+        failed = []
+        for request, responses in zip(requests, results):
+            index, slot = request[0], request[1]
+            if responses is None:
+                failures_left[index] -= 1
+                failed.append(request)
+            else:
+                slots[index][slot] = responses
+        return [request for request in failed if failures_left[request[0]] > 0]
+
+    def _join_slots(self, slots: List[List[List[str]]]) -> List[List[str]]:
+        """
+        Joins the responses of the requests of each query in request order,
+        so that the result does not depend on the order in which the requests finished.
+
+        :param slots: The responses of each request, grouped by query.
+        :type slots: List[List[List[str]]]
+        :return: The response texts for each query.
+        :rtype: List[List[str]]
+        """
+        all_responses = []
+        for query_slots in slots:
+            responses = [response for slot in query_slots for response in slot]
+            self.logger.debug("Responses from LM: %s", responses)
+            all_responses.append(responses)
+        return all_responses
+
     @abstractmethod
     def _execute(
         self, lm: AbstractLanguageModel, prompter: Prompter, parser: Parser, **kwargs
@@ -152,6 +472,14 @@ class Operation(ABC):
         """
         pass
 
+    def release_thoughts(self) -> None:
+        """
+        Drop the references to the thoughts of the operation once all successors have consumed them.
+        Afterwards the operation has no thoughts.
+        """
+        self.thoughts = []
+        self.thoughts_released = True
+
 
 class Score(Operation):
     """
@@ -167,6 +495,7 @@ class Score(Operation):
         scoring_function: Callable[
             [Union[List[Dict], Dict]], Union[List[float], float]
         ] = None,
+        max_concurrent_queries: Optional[int] = None,
     ) -> None:
         """
         Initializes a new Score operation.
@@ -178,8 +507,11 @@ class Score(Operation):
         :param scoring_function: A function to score thoughts (if not using LM). Defaults to None.
         :type scoring_function: Takes a list of thought states or a single thought state and
                                 returns a list of scores or a single score.
+        :param max_concurrent_queries: Maximum number of requests to the LM that are sent concurrently.
+                                       Defaults to None (see `Operation`).
+        :type max_concurrent_queries: Optional[int]
         """
-        super().__init__()
+        super().__init__(max_concurrent_queries)
         self.num_samples: int = num_samples
         self.combined_scoring: bool = combined_scoring
         self.thoughts: List[Thought] = []
@@ -219,22 +551,74 @@ class Score(Operation):
             len(self.predecessors) > 0
         ), "Score operation needs at least one predecessor"
 
+        if self.scoring_function is not None:
+            self._score_with_function(previous_thoughts)
+        else:
+            prompts = self._get_prompts(prompter, previous_thoughts)
+            all_responses = self._query_all(
+                lm, [(prompt, self.num_samples) for prompt in prompts]
+            )
+            self._score_with_responses(parser, previous_thoughts, all_responses)
+
+        self.logger.info(
+            "Score operation %d scored %d thoughts",
+            self.id,
+            len(self.thoughts),
+        )
+
+    async def _aexecute(
+        self, lm: AbstractLanguageModel, prompter: Prompter, parser: Parser, **kwargs
+    ) -> None:
+        """
+        Asynchronously executes the scoring operation, the LM is prompted for all
+        thoughts concurrently.
+
+        :param lm: The language model to be used.
+        :type lm: AbstractLanguageModel
+        :param prompter: The prompter for crafting prompts.
+        :type prompter: Prompter
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param kwargs: Additional parameters for execution.
+        :raises AssertionError: If operation has no predecessors.
+        """
+        previous_thoughts: List[Thought] = self.get_previous_thoughts()
+
+        assert (
+            len(self.predecessors) > 0
+        ), "Score operation needs at least one predecessor"
+
+        if self.scoring_function is not None:
+            self._score_with_function(previous_thoughts)
+        else:
+            prompts = self._get_prompts(prompter, previous_thoughts)
+            all_responses = await self._aquery_all(
+                lm, [(prompt, self.num_samples) for prompt in prompts]
+            )
+            self._score_with_responses(parser, previous_thoughts, all_responses)
+
+        self.logger.info(
+            "Score operation %d scored %d thoughts",
+            self.id,
+            len(self.thoughts),
+        )
+
+    def _score_with_function(self, previous_thoughts: List[Thought]) -> None:
+        """
+        Scores the thoughts with the scoring function, together or individually.
+
+        :param previous_thoughts: The thoughts to be scored.
+        :type previous_thoughts: List[Thought]
+        """
         if self.combined_scoring:
             previous_thoughts_states = [thought.state for thought in previous_thoughts]
-            if self.scoring_function is not None:
-                self.logger.debug(
-                    "Using scoring function %s to score states", self.scoring_function
-                )
+            self.logger.debug(
+                "Using scoring function %s to score states", self.scoring_function
+            )
+            with trace_span(
+                "scoring_function", "score", thoughts_in=len(previous_thoughts_states)
+            ):
                 scores = self.scoring_function(previous_thoughts_states)
-            else:
-                prompt = prompter.score_prompt(previous_thoughts_states)
-                self.logger.debug("Prompt for LM: %s", prompt)
-
-                responses = lm.get_response_texts(
-                    lm.query(prompt, num_responses=self.num_samples)
-                )
-                self.logger.debug("Responses from LM: %s", responses)
-                scores = parser.parse_score_answer(previous_thoughts_states, responses)
             for thought, score in zip(previous_thoughts, scores):
                 new_thought = Thought.from_thought(thought)
                 new_thought.score = score
@@ -242,30 +626,71 @@ class Score(Operation):
         else:
             for thought in previous_thoughts:
                 new_thought = Thought.from_thought(thought)
-                if self.scoring_function is not None:
-                    self.logger.debug(
-                        "Using scoring function %s to score state",
-                        self.scoring_function,
-                    )
-                    score = self.scoring_function(thought.state)
-                else:
-                    prompt = prompter.score_prompt([thought.state])
-                    self.logger.debug("Prompt for LM: %s", prompt)
+                self.logger.debug(
+                    "Using scoring function %s to score state",
+                    self.scoring_function,
+                )
+                with trace_span("scoring_function", "score", thoughts_in=1):
+                    new_thought.score = self.scoring_function(thought.state)
+                self.thoughts.append(new_thought)
 
-                    responses = lm.get_response_texts(
-                        lm.query(prompt, num_responses=self.num_samples)
-                    )
-                    self.logger.debug("Responses from LM: %s", responses)
-                    score = parser.parse_score_answer([thought.state], responses)[0]
+    def _get_prompts(
+        self, prompter: Prompter, previous_thoughts: List[Thought]
+    ) -> List[str]:
+        """
+        Creates the score prompts, a single one for combined scoring, otherwise one per thought.
+
+        :param prompter: The prompter for crafting prompts.
+        :type prompter: Prompter
+        :param previous_thoughts: The thoughts to be scored.
+        :type previous_thoughts: List[Thought]
+        :return: The score prompts.
+        :rtype: List[str]
+        """
+        if self.combined_scoring:
+            prompts = [
+                prompter.score_prompt([thought.state for thought in previous_thoughts])
+            ]
+        else:
+            prompts = [
+                prompter.score_prompt([thought.state]) for thought in previous_thoughts
+            ]
+        for prompt in prompts:
+            self.logger.debug("Prompt for LM: %s", prompt)
+        return prompts
+
+    def _score_with_responses(
+        self,
+        parser: Parser,
+        previous_thoughts: List[Thought],
+        all_responses: List[List[str]],
+    ) -> None:
+        """
+        Scores the thoughts by parsing the responses of the LM to the score prompts.
 
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param previous_thoughts: The thoughts to be scored.
+        :type previous_thoughts: List[Thought]
+        :param all_responses: The responses of the LM to each score prompt.
+        :type all_responses: List[List[str]]
+        """
+        if self.combined_scoring:
+            previous_thoughts_states = [thought.state for thought in previous_thoughts]
+            scores = parser.parse_score_answer(
+                previous_thoughts_states, all_responses[0]
+            )
+            for thought, score in zip(previous_thoughts, scores):
+                new_thought = Thought.from_thought(thought)
                 new_thought.score = score
                 self.thoughts.append(new_thought)
-
-        self.logger.info(
-            "Score operation %d scored %d thoughts",
-            self.id,
-            len(self.thoughts),
-        )
+        else:
+            for thought, responses in zip(previous_thoughts, all_responses):
+                new_thought = Thought.from_thought(thought)
+                new_thought.score = parser.parse_score_answer(
+                    [thought.state], responses
+                )[0]
+                self.thoughts.append(new_thought)
 
 
 class ValidateAndImprove(Operation):
@@ -372,7 +797,9 @@ class ValidateAndImprove(Operation):
                 state_update = parser.parse_improve_answer(
                     current_thought.state, responses
                 )
-                current_thought = Thought({**current_thought.state, **state_update})
+                current_thought = Thought(
+                    merge_states(current_thought.state, state_update)
+                )
                 current_try += 1
             self.thoughts.append(thought_list)
 
@@ -389,46 +816,13 @@ class ValidateAndImprove(Operation):
             len(previous_thoughts),
         )
 
-
-class Generate(Operation):
-    """
-    Operation to generate thoughts.
-    """
-
-    operation_type: OperationType = OperationType.generate
-
-    def __init__(
-        self, num_branches_prompt: int = 1, num_branches_response: int = 1
-    ) -> None:
-        """
-        Initializes a new Generate operation.
-
-        :param num_branches_prompt: Number of responses that each prompt should generate (passed to prompter). Defaults to 1.
-        :type num_branches_prompt: int
-        :param num_branches_response: Number of responses the LM should generate for each prompt. Defaults to 1.
-        :type num_branches_response: int
-        """
-        super().__init__()
-        self.num_branches_prompt: int = num_branches_prompt
-        self.num_branches_response: int = num_branches_response
-        self.thoughts: List[Thought] = []
-
-    def get_thoughts(self) -> List[Thought]:
-        """
-        Returns the thoughts associated with the operation.
-
-        :return: List of generated thoughts.
-        :rtype: List[Thought]
-        """
-        return self.thoughts
-
-    def _execute(
+    async def _aexecute(
         self, lm: AbstractLanguageModel, prompter: Prompter, parser: Parser, **kwargs
     ) -> None:
         """
-        Executes the Generate operation by generating thoughts from the predecessors.
-        The thoughts are generated by prompting the LM with the predecessors' thought states.
-        If there are no predecessors, the kwargs are used as a base state.
+        Asynchronously executes the ValidateAndImprove operation.
+        The thoughts are validated and improved one after another, as each step depends
+        on the result of the previous one.
 
         :param lm: The language model to be used.
         :type lm: AbstractLanguageModel
@@ -437,62 +831,80 @@ class Generate(Operation):
         :param parser: The parser for parsing responses.
         :type parser: Parser
         :param kwargs: Additional parameters for execution.
+        :raises AssertionError: If operation has no predecessors.
         """
         previous_thoughts: List[Thought] = self.get_previous_thoughts()
 
-        if len(previous_thoughts) == 0 and len(self.predecessors) > 0:
-            return
-
-        if len(previous_thoughts) == 0:
-            # no predecessors, use kwargs as base state
-            previous_thoughts = [Thought(state=kwargs)]
+        assert (
+            len(self.predecessors) > 0
+        ), "ValidateAndImprove operation needs at least one predecessor"
 
         for thought in previous_thoughts:
-            base_state = thought.state
-            prompt = prompter.generate_prompt(self.num_branches_prompt, **base_state)
-            self.logger.debug("Prompt for LM: %s", prompt)
-            responses = lm.get_response_texts(
-                lm.query(prompt, num_responses=self.num_branches_response)
-            )
-            self.logger.debug("Responses from LM: %s", responses)
-            for new_state in parser.parse_generate_answer(base_state, responses):
-                new_state = {**base_state, **new_state}
-                self.thoughts.append(Thought(new_state))
-                self.logger.debug(
-                    "New thought %d created with state %s",
-                    self.thoughts[-1].id,
-                    self.thoughts[-1].state,
-                )
-        if (
-            len(self.thoughts)
-            > self.num_branches_prompt
-            * self.num_branches_response
-            * len(previous_thoughts)
-            and self.num_branches_prompt > 0
-        ):
-            self.logger.warning(
-                "Generate operation %d created more thoughts than expected",
-                self.id,
-            )
-        self.logger.info(
-            "Generate operation %d created %d new thoughts", self.id, len(self.thoughts)
-        )
+            thought_list = []
+            current_thought = Thought.from_thought(thought)
+            current_try = 0
+            while True:
+                if self.validate_function is not None:
+                    self.logger.debug(
+                        "Using validate function %s to score states",
+                        self.validate_function,
+                    )
+                    valid = self.validate_function(current_thought.state)
+                else:
+                    prompt = prompter.validation_prompt(**current_thought.state)
+                    self.logger.debug("Prompt for LM: %s", prompt)
+                    responses = (
+                        await self._aquery_all(lm, [(prompt, self.num_samples)])
+                    )[0]
+                    valid = parser.parse_validation_answer(
+                        current_thought.state, responses
+                    )
+                current_thought.valid = valid
+                thought_list.append(current_thought)
+                if (
+                    not self.improve
+                    or current_thought.valid
+                    or current_try >= self.num_tries
+                ):
+                    break
+                improve_prompt = prompter.improve_prompt(**current_thought.state)
+                self.logger.debug("Prompt for LM: %s", improve_prompt)
+                responses = (await self._aquery_all(lm, [(improve_prompt, 1)]))[0]
+                state_update = parser.parse_improve_answer(
+                    current_thought.state, responses
+                )
+                current_thought = Thought(
+                    merge_states(current_thought.state, state_update)
+                )
+                current_try += 1
+            self.thoughts.append(thought_list)
 
-# author: Jayce Ning
-class DGenerateScore(Operation):
+        self.logger.info(
+            "Validate and improve operation %d created %d valid thoughts from %d previous thoughts",
+            self.id,
+            len(
+                [
+                    thought_list[-1]
+                    for thought_list in self.thoughts
+                    if thought_list[-1].valid
+                ]
+            ),
+            len(previous_thoughts),
+        )
+
+
+class Generate(Operation):
     """
-    Operation to dynamic generate thoughts and score.
+    Operation to generate thoughts.
     """
 
-    operation_type: OperationType = OperationType.dynamic_generate
+    operation_type: OperationType = OperationType.generate
 
     def __init__(
-        self, num_branches_prompt: int = 1,
+        self,
+        num_branches_prompt: int = 1,
         num_branches_response: int = 1,
-        scoring_function: Callable[
-            [Union[List[Dict], Dict]], Union[List[float], float]
-        ] = None,
-        score_threshold: float = 1,
+        max_concurrent_queries: Optional[int] = None,
     ) -> None:
         """
         Initializes a new Generate operation.
@@ -501,15 +913,14 @@ class DGenerateScore(Operation):
         :type num_branches_prompt: int
         :param num_branches_response: Number of responses the LM should generate for each prompt. Defaults to 1.
         :type num_branches_response: int
+        :param max_concurrent_queries: Maximum number of requests to the LM that are sent concurrently.
+                                       Defaults to None (see `Operation`).
+        :type max_concurrent_queries: Optional[int]
         """
-        super().__init__()
+        super().__init__(max_concurrent_queries)
         self.num_branches_prompt: int = num_branches_prompt
         self.num_branches_response: int = num_branches_response
         self.thoughts: List[Thought] = []
-        self.scoring_function: Callable[
-            [Union[List[Dict], Dict]], Union[List[float], float]
-        ] = scoring_function
-        self.score_threshold = score_threshold
 
     def get_thoughts(self) -> List[Thought]:
         """
@@ -536,70 +947,128 @@ class DGenerateScore(Operation):
         :type parser: Parser
         :param kwargs: Additional parameters for execution.
         """
-        previous_thoughts: List[Thought] = self.get_previous_thoughts()
+        previous_thoughts: List[Thought] = self._get_base_thoughts(kwargs)
 
-        if len(previous_thoughts) == 0 and len(self.predecessors) > 0:
+        if len(previous_thoughts) == 0:
             return
 
+        prompts = self._get_prompts(prompter, previous_thoughts)
+        all_responses = self._query_all(
+            lm, [(prompt, self.num_branches_response) for prompt in prompts]
+        )
+        for thought, responses in zip(previous_thoughts, all_responses):
+            self._add_thoughts(self._parse_states(parser, thought.state, responses))
+        self._log_created_thoughts(previous_thoughts)
+
+    async def _aexecute(
+        self, lm: AbstractLanguageModel, prompter: Prompter, parser: Parser, **kwargs
+    ) -> None:
+        """
+        Asynchronously executes the Generate operation, the LM is prompted for all
+        predecessors' thoughts concurrently.
+
+        :param lm: The language model to be used.
+        :type lm: AbstractLanguageModel
+        :param prompter: The prompter for crafting prompts.
+        :type prompter: Prompter
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param kwargs: Additional parameters for execution.
+        """
+        previous_thoughts: List[Thought] = self._get_base_thoughts(kwargs)
+
         if len(previous_thoughts) == 0:
+            return
+
+        prompts = self._get_prompts(prompter, previous_thoughts)
+        all_responses = await self._aquery_all(
+            lm, [(prompt, self.num_branches_response) for prompt in prompts]
+        )
+        for thought, responses in zip(previous_thoughts, all_responses):
+            self._add_thoughts(self._parse_states(parser, thought.state, responses))
+        self._log_created_thoughts(previous_thoughts)
+
+    def _get_base_thoughts(self, kwargs: Dict) -> List[Thought]:
+        """
+        Returns the thoughts that new thoughts are generated from.
+        If there are no predecessors, the kwargs are used as a base state.
+
+        :param kwargs: Additional parameters for execution.
+        :type kwargs: Dict
+        :return: The base thoughts, empty if the predecessors have no thoughts.
+        :rtype: List[Thought]
+        """
+        previous_thoughts: List[Thought] = self.get_previous_thoughts()
+
+        if len(previous_thoughts) == 0 and len(self.predecessors) == 0:
             # no predecessors, use kwargs as base state
-            previous_thoughts = [Thought(state=kwargs)]
+            # the problem parameters are the context shared by all thoughts
+            previous_thoughts = [Thought(state=ThoughtState(kwargs))]
+        return previous_thoughts
+
+    def _get_prompts(
+        self, prompter: Prompter, previous_thoughts: List[Thought]
+    ) -> List[str]:
+        """
+        Creates a generate prompt for each base thought.
 
+        :param prompter: The prompter for crafting prompts.
+        :type prompter: Prompter
+        :param previous_thoughts: The base thoughts.
+        :type previous_thoughts: List[Thought]
+        :return: The generate prompts.
+        :rtype: List[str]
+        """
+        prompts = []
         for thought in previous_thoughts:
-            base_state = thought.state
-            prompt = prompter.generate_prompt(self.num_branches_prompt, **base_state)
+            prompt = prompter.generate_prompt(self.num_branches_prompt, **thought.state)
             self.logger.debug("Prompt for LM: %s", prompt)
-            if lm.model_id == "gpt-3.5-turbo":
-                responses = lm.get_response_texts(
-                    lm.query(prompt, num_responses=self.num_branches_response)
-                )
-                self.logger.debug("Responses from LM: %s", responses)
-                flag = 0
-                for new_state in parser.parse_generate_answer(base_state, responses):
-                    
-                    # 合并字典
-                    new_state = {**base_state, **new_state}
-                    self.thoughts.append(Thought(new_state))
-                    self.logger.debug(
-                        "New thought %d created with state %s",
-                        self.thoughts[-1].id,
-                        self.thoughts[-1].state,
-                    )
-                # s_list = []
-                # for t in self.thoughts:
-                #     score = self.scoring_function(t.state)
-                #     s_list.append(score)
-                # # 找到所有score小于threshold的索引
-                # filtered_indices = [i for i, s in enumerate(s_list) if s < self.score_threshold]
-
-                # # 如果所有的score都小于threshold，找到最大的score的索引
-                # if len(filtered_indices) == len(s_list):
-                #     max_index = s_list.index(max(s_list))
-                #     self.thoughts = self.thoughts[max_index]
-                # else:
-                #     self.thoughts = [self.thoughts[i] for i, s in enumerate(s_list) if s >= self.score_threshold]
-            else:
-                for i in range(self.num_branches_response):
-                    responses = lm.get_response_texts(
-                        lm.query(prompt, num_responses=1)
-                    )
-                    self.logger.debug("Responses from LM: %s", responses)
-                    flag = 0
-                    for new_state in parser.parse_generate_answer(base_state, responses):
-                        
-                        # 合并字典
-                        new_state = {**base_state, **new_state}
-                        self.thoughts.append(Thought(new_state))
-                        self.logger.debug(
-                            "New thought %d created with state %s",
-                            self.thoughts[-1].id,
-                            self.thoughts[-1].state,
-                        )
-                        score = self.scoring_function(self.thoughts[-1].state)
-                        if score > self.score_threshold:
-                            flag = 1
-                    if flag > 0:
-                        break
+            prompts.append(prompt)
+        return prompts
+
+    def _parse_states(
+        self, parser: Parser, base_state: Dict, responses: List[str]
+    ) -> List[Dict]:
+        """
+        Parses the responses of the LM into new thought states based on the base state.
+
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param base_state: The state of the thought the prompt was created from.
+        :type base_state: Dict
+        :param responses: The responses of the LM.
+        :type responses: List[str]
+        :return: The new thought states.
+        :rtype: List[Dict]
+        """
+        return [
+            merge_states(base_state, new_state)
+            for new_state in parser.parse_generate_answer(base_state, responses)
+        ]
+
+    def _add_thoughts(self, states: List[Dict]) -> None:
+        """
+        Creates new thoughts from the given states.
+
+        :param states: The states of the new thoughts.
+        :type states: List[Dict]
+        """
+        for new_state in states:
+            self.thoughts.append(Thought(new_state))
+            self.logger.debug(
+                "New thought %d created with state %s",
+                self.thoughts[-1].id,
+                self.thoughts[-1].state,
+            )
+
+    def _log_created_thoughts(self, previous_thoughts: List[Thought]) -> None:
+        """
+        Logs the number of created thoughts and warns if more were created than expected.
+
+        :param previous_thoughts: The base thoughts.
+        :type previous_thoughts: List[Thought]
+        """
+        name = "Generate" if self.operation_type == OperationType.generate else "DGenerate"
         if (
             len(self.thoughts)
             > self.num_branches_prompt
@@ -608,13 +1077,194 @@ class DGenerateScore(Operation):
             and self.num_branches_prompt > 0
         ):
             self.logger.warning(
-                "DGenerate operation %d created more thoughts than expected",
+                "%s operation %d created more thoughts than expected",
+                name,
                 self.id,
             )
         self.logger.info(
-            "DGenerate operation %d created %d new thoughts", self.id, len(self.thoughts)
+            "%s operation %d created %d new thoughts", name, self.id, len(self.thoughts)
         )
 
+# author: Jayce Ning
+class DGenerateScore(Generate):
+    """
+    Operation to dynamic generate thoughts and score.
+    """
+
+    operation_type: OperationType = OperationType.dynamic_generate
+
+    def __init__(
+        self, num_branches_prompt: int = 1,
+        num_branches_response: int = 1,
+        scoring_function: Callable[
+            [Union[List[Dict], Dict]], Union[List[float], float]
+        ] = None,
+        score_threshold: float = 1,
+        max_concurrent_queries: Optional[int] = None,
+    ) -> None:
+        """
+        Initializes a new Generate operation.
+
+        :param num_branches_prompt: Number of responses that each prompt should generate (passed to prompter). Defaults to 1.
+        :type num_branches_prompt: int
+        :param num_branches_response: Number of responses the LM should generate for each prompt. Defaults to 1.
+        :type num_branches_response: int
+        :param max_concurrent_queries: Maximum number of requests to the LM that are sent concurrently.
+                                       Defaults to None (see `Operation`).
+        :type max_concurrent_queries: Optional[int]
+        """
+        super().__init__(
+            num_branches_prompt, num_branches_response, max_concurrent_queries
+        )
+        self.scoring_function: Callable[
+            [Union[List[Dict], Dict]], Union[List[float], float]
+        ] = scoring_function
+        self.score_threshold = score_threshold
+
+    def _execute(
+        self, lm: AbstractLanguageModel, prompter: Prompter, parser: Parser, **kwargs
+    ) -> None:
+        """
+        Executes the Generate operation by generating thoughts from the predecessors.
+        The thoughts are generated by prompting the LM with the predecessors' thought states.
+        If there are no predecessors, the kwargs are used as a base state.
+
+        :param lm: The language model to be used.
+        :type lm: AbstractLanguageModel
+        :param prompter: The prompter for crafting prompts.
+        :type prompter: Prompter
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param kwargs: Additional parameters for execution.
+        """
+        previous_thoughts: List[Thought] = self._get_base_thoughts(kwargs)
+
+        if len(previous_thoughts) == 0:
+            return
+
+        prompts = self._get_prompts(prompter, previous_thoughts)
+        if lm.model_id == "gpt-3.5-turbo":
+            all_responses = self._query_all(
+                lm, [(prompt, self.num_branches_response) for prompt in prompts]
+            )
+            all_states = [
+                self._parse_states(parser, thought.state, responses)
+                for thought, responses in zip(previous_thoughts, all_responses)
+            ]
+        else:
+            all_states = [[] for _ in previous_thoughts]
+            active = list(range(len(previous_thoughts)))
+            for wave in self._sample_waves(self.num_branches_response):
+                all_responses = self._query_all(
+                    lm, [(prompts[index], wave) for index in active]
+                )
+                active = self._extend_until_threshold(
+                    parser, previous_thoughts, active, all_responses, all_states
+                )
+                if len(active) == 0:
+                    break
+        for states in all_states:
+            self._add_thoughts(states)
+        self._log_created_thoughts(previous_thoughts)
+
+    async def _aexecute(
+        self, lm: AbstractLanguageModel, prompter: Prompter, parser: Parser, **kwargs
+    ) -> None:
+        """
+        Asynchronously executes the DGenerateScore operation, the predecessors' thoughts
+        are sampled concurrently.
+
+        :param lm: The language model to be used.
+        :type lm: AbstractLanguageModel
+        :param prompter: The prompter for crafting prompts.
+        :type prompter: Prompter
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param kwargs: Additional parameters for execution.
+        """
+        previous_thoughts: List[Thought] = self._get_base_thoughts(kwargs)
+
+        if len(previous_thoughts) == 0:
+            return
+
+        prompts = self._get_prompts(prompter, previous_thoughts)
+        if lm.model_id == "gpt-3.5-turbo":
+            all_responses = await self._aquery_all(
+                lm, [(prompt, self.num_branches_response) for prompt in prompts]
+            )
+            all_states = [
+                self._parse_states(parser, thought.state, responses)
+                for thought, responses in zip(previous_thoughts, all_responses)
+            ]
+        else:
+            all_states = [[] for _ in previous_thoughts]
+            active = list(range(len(previous_thoughts)))
+            for wave in self._sample_waves(self.num_branches_response):
+                all_responses = await self._aquery_all(
+                    lm, [(prompts[index], wave) for index in active]
+                )
+                active = self._extend_until_threshold(
+                    parser, previous_thoughts, active, all_responses, all_states
+                )
+                if len(active) == 0:
+                    break
+        for states in all_states:
+            self._add_thoughts(states)
+        self._log_created_thoughts(previous_thoughts)
+
+    def _exceeds_threshold(self, states: List[Dict]) -> bool:
+        """
+        Scores the new states and checks if any of them exceeds the score threshold.
+
+        :param states: The new thought states.
+        :type states: List[Dict]
+        :return: True if a state scores higher than the threshold, False otherwise.
+        :rtype: bool
+        """
+        with trace_span("scoring_function", "score", thoughts_in=len(states)):
+            scores = [self.scoring_function(state) for state in states]
+        return any(score > self.score_threshold for score in scores)
+
+    def _extend_until_threshold(
+        self,
+        parser: Parser,
+        previous_thoughts: List[Thought],
+        active: List[int],
+        all_responses: List[List[str]],
+        all_states: List[List[Dict]],
+    ) -> List[int]:
+        """
+        Parses the responses of a sampling wave one after another and stops sampling
+        a thought as soon as one of its new states scores higher than the threshold.
+        Responses after that one are discarded, so the result is the same as when
+        sampling one response at a time.
+
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param previous_thoughts: The base thoughts.
+        :type previous_thoughts: List[Thought]
+        :param active: Indices of the base thoughts that were sampled in this wave.
+        :type active: List[int]
+        :param all_responses: The responses of the wave for each active base thought.
+        :type all_responses: List[List[str]]
+        :param all_states: The new states of each base thought, extended in place.
+        :type all_states: List[List[Dict]]
+        :return: Indices of the base thoughts that still need to be sampled.
+        :rtype: List[int]
+        """
+        still_active = []
+        for index, responses in zip(active, all_responses):
+            for response in responses:
+                states = self._parse_states(
+                    parser, previous_thoughts[index].state, [response]
+                )
+                all_states[index].extend(states)
+                if self._exceeds_threshold(states):
+                    break
+            else:
+                still_active.append(index)
+        return still_active
+
 
 class Improve(Operation):
     """
@@ -623,11 +1273,15 @@ class Improve(Operation):
 
     operation_type: OperationType = OperationType.improve
 
-    def __init__(self) -> None:
+    def __init__(self, max_concurrent_queries: Optional[int] = None) -> None:
         """
         Initializes a new Improve operation.
+
+        :param max_concurrent_queries: Maximum number of requests to the LM that are sent concurrently.
+                                       Defaults to None (see `Operation`).
+        :type max_concurrent_queries: Optional[int]
         """
-        super().__init__()
+        super().__init__(max_concurrent_queries)
         self.thoughts: List[Thought] = []
 
     def get_thoughts(self) -> List[Thought]:
@@ -659,13 +1313,73 @@ class Improve(Operation):
 
         assert len(self.predecessors) > 0, "Needs at least one predecessor"
 
+        prompts = self._get_prompts(prompter, previous_thoughts)
+        all_responses = self._query_all(lm, [(prompt, 1) for prompt in prompts])
+        self._add_thoughts(parser, previous_thoughts, all_responses)
+
+    async def _aexecute(
+        self, lm: AbstractLanguageModel, prompter: Prompter, parser: Parser, **kwargs
+    ) -> None:
+        """
+        Asynchronously executes the Improve operation, the LM is prompted for all
+        predecessors' thoughts concurrently.
+
+        :param lm: The language model to be used.
+        :type lm: AbstractLanguageModel
+        :param prompter: The prompter for crafting prompts.
+        :type prompter: Prompter
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param kwargs: Additional parameters for execution.
+        :raises AssertionError: If operation has no predecessors.
+        """
+        previous_thoughts: List[Thought] = self.get_previous_thoughts()
+
+        assert len(self.predecessors) > 0, "Needs at least one predecessor"
+
+        prompts = self._get_prompts(prompter, previous_thoughts)
+        all_responses = await self._aquery_all(lm, [(prompt, 1) for prompt in prompts])
+        self._add_thoughts(parser, previous_thoughts, all_responses)
+
+    def _get_prompts(
+        self, prompter: Prompter, previous_thoughts: List[Thought]
+    ) -> List[str]:
+        """
+        Creates an improve prompt for each thought.
+
+        :param prompter: The prompter for crafting prompts.
+        :type prompter: Prompter
+        :param previous_thoughts: The thoughts to be improved.
+        :type previous_thoughts: List[Thought]
+        :return: The improve prompts.
+        :rtype: List[str]
+        """
+        prompts = []
         for thought in previous_thoughts:
             improve_prompt = prompter.improve_prompt(**thought.state)
             self.logger.debug("Prompt for LM: %s", improve_prompt)
-            responses = lm.get_response_texts(lm.query(improve_prompt, num_responses=1))
-            self.logger.debug("Responses from LM: %s", responses)
+            prompts.append(improve_prompt)
+        return prompts
+
+    def _add_thoughts(
+        self,
+        parser: Parser,
+        previous_thoughts: List[Thought],
+        all_responses: List[List[str]],
+    ) -> None:
+        """
+        Creates the improved thoughts from the responses of the LM.
+
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param previous_thoughts: The thoughts to be improved.
+        :type previous_thoughts: List[Thought]
+        :param all_responses: The responses of the LM to each improve prompt.
+        :type all_responses: List[List[str]]
+        """
+        for thought, responses in zip(previous_thoughts, all_responses):
             state_update = parser.parse_improve_answer(thought.state, responses)
-            self.thoughts.append(Thought({**thought.state, **state_update}))
+            self.thoughts.append(Thought(merge_states(thought.state, state_update)))
 
         self.logger.info(
             "Improve operation %d improved %d thoughts", self.id, len(self.thoughts)
@@ -679,14 +1393,19 @@ class Aggregate(Operation):
 
     operation_type: OperationType = OperationType.aggregate
 
-    def __init__(self, num_responses: int = 1) -> None:
+    def __init__(
+        self, num_responses: int = 1, max_concurrent_queries: Optional[int] = None
+    ) -> None:
         """
         Initializes a new Aggregate operation.
 
         :param num_responses: Number of responses to use for aggregation. Defaults to 1.
         :type num_responses: int
+        :param max_concurrent_queries: Maximum number of requests to the LM that are sent concurrently.
+                                       Defaults to None (see `Operation`).
+        :type max_concurrent_queries: Optional[int]
         """
-        super().__init__()
+        super().__init__(max_concurrent_queries)
         self.thoughts: List[Thought] = []
         self.num_responses: int = num_responses
 
@@ -724,32 +1443,116 @@ class Aggregate(Operation):
         if len(previous_thoughts) == 0:
             return
 
-        # applied in order of score
+        base_state = self._get_base_state(previous_thoughts)
+        previous_thought_states = [thought.state for thought in previous_thoughts]
+        prompt = self._get_prompt(prompter, previous_thought_states)
+        responses = self._query_all(lm, [(prompt, self.num_responses)])[0]
+        self._add_thoughts(
+            self._parse_states(parser, base_state, previous_thought_states, responses)
+        )
+
+    async def _aexecute(
+        self, lm: AbstractLanguageModel, prompter: Prompter, parser: Parser, **kwargs
+    ) -> None:
+        """
+        Asynchronously executes the Aggregate operation.
+
+        :param lm: The language model to be used.
+        :type lm: AbstractLanguageModel
+        :param prompter: The prompter for crafting prompts.
+        :type prompter: Prompter
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param kwargs: Additional parameters for execution.
+        :raises AssertionError: If operation has no predecessors.
+        """
+        assert (
+            len(self.predecessors) >= 1
+        ), "Aggregate operation must have at least one predecessor"
+
+        previous_thoughts: List[Thought] = self.get_previous_thoughts()
+
+        if len(previous_thoughts) == 0:
+            return
+
+        base_state = self._get_base_state(previous_thoughts)
+        previous_thought_states = [thought.state for thought in previous_thoughts]
+        prompt = self._get_prompt(prompter, previous_thought_states)
+        responses = (await self._aquery_all(lm, [(prompt, self.num_responses)]))[0]
+        self._add_thoughts(
+            self._parse_states(parser, base_state, previous_thought_states, responses)
+        )
+
+    def _get_base_state(self, previous_thoughts: List[Thought]) -> Dict:
+        """
+        Merges the states of the predecessors' thoughts, applied in order of score.
+
+        :param previous_thoughts: The thoughts to be aggregated.
+        :type previous_thoughts: List[Thought]
+        :return: The merged state.
+        :rtype: Dict
+        """
         base_state: Dict = {}
         for thought in sorted(previous_thoughts, key=lambda thought: thought.score):
-            base_state = {**base_state, **thought.state}
+            base_state = merge_states(base_state, thought.state)
+        return base_state
 
-        previous_thought_states = [thought.state for thought in previous_thoughts]
+    def _get_prompt(self, prompter: Prompter, previous_thought_states: List[Dict]) -> str:
+        """
+        Creates the aggregation prompt.
 
+        :param prompter: The prompter for crafting prompts.
+        :type prompter: Prompter
+        :param previous_thought_states: The states of the thoughts to be aggregated.
+        :type previous_thought_states: List[Dict]
+        :return: The aggregation prompt.
+        :rtype: str
+        """
         prompt = prompter.aggregation_prompt(previous_thought_states)
 
         self.logger.debug("Prompt for LM: %s", prompt)
 
-        responses = lm.get_response_texts(
-            lm.query(prompt, num_responses=self.num_responses)
-        )
+        return prompt
 
-        self.logger.debug("Responses from LM: %s", responses)
+    def _parse_states(
+        self,
+        parser: Parser,
+        base_state: Dict,
+        previous_thought_states: List[Dict],
+        responses: List[str],
+    ) -> List[Dict]:
+        """
+        Parses the responses of the LM into the states of the aggregated thoughts.
 
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param base_state: The merged state of the predecessors' thoughts.
+        :type base_state: Dict
+        :param previous_thought_states: The states of the thoughts that were aggregated.
+        :type previous_thought_states: List[Dict]
+        :param responses: The responses of the LM.
+        :type responses: List[str]
+        :return: The new thought states.
+        :rtype: List[Dict]
+        """
         parsed = parser.parse_aggregation_answer(previous_thought_states, responses)
 
-        if isinstance(parsed, dict):
+        if isinstance(parsed, Mapping):
             parsed = [parsed]
-        for new_state in parsed:
-            self.thoughts.append(Thought({**base_state, **new_state}))
+        return [merge_states(base_state, new_state) for new_state in parsed]
+
+    def _add_thoughts(self, states: List[Dict]) -> None:
+        """
+        Creates new thoughts from the given states.
+
+        :param states: The states of the new thoughts.
+        :type states: List[Dict]
+        """
+        for new_state in states:
+            self.thoughts.append(Thought(new_state))
 
 # author: Jayce Ning
-class DAggregate(Operation):
+class DAggregate(Aggregate):
     """
     Operation to dynamic aggregate thoughts.
     """
@@ -763,6 +1566,7 @@ class DAggregate(Operation):
         ] = None,
         score_threshold: float = 1,
         aggregate_threshold: float = 1,
+        max_concurrent_queries: Optional[int] = None,
     ) -> None:
         """
         Initializes a new Aggregate operation.
@@ -771,25 +1575,17 @@ class DAggregate(Operation):
         :type num_responses: int
         :score_threshold: generate threshold
         :aggregate_threshold: thoughts used for aggregate threshold
+        :param max_concurrent_queries: Maximum number of requests to the LM that are sent concurrently.
+                                       Defaults to None (see `Operation`).
+        :type max_concurrent_queries: Optional[int]
         """
-        super().__init__()
-        self.thoughts: List[Thought] = []
-        self.num_responses: int = num_responses
+        super().__init__(num_responses, max_concurrent_queries)
         self.scoring_function: Callable[
             [Union[List[Dict], Dict]], Union[List[float], float]
         ] = scoring_function
         self.score_threshold = score_threshold
         self.aggregate_threshold = aggregate_threshold
 
-    def get_thoughts(self) -> List[Thought]:
-        """
-        Returns the thoughts associated with the operation after aggregation.
-
-        :return: List of aggregated thoughts.
-        :rtype: List[Thought]
-        """
-        return self.thoughts
-
     def _execute(
         self, lm: AbstractLanguageModel, prompter: Prompter, parser: Parser, **kwargs
     ) -> None:
@@ -815,51 +1611,126 @@ class DAggregate(Operation):
         if len(previous_thoughts) == 0:
             return
 
-        # applied in order of score
-        base_state: Dict = {}
-        for thought in sorted(previous_thoughts, key=lambda thought: thought.score):
-            base_state = {**base_state, **thought.state}
+        base_state = self._get_base_state(previous_thoughts)
 
         # dynamic control
         previous_thought_states = [thought.state for thought in previous_thoughts if thought.score>self.aggregate_threshold]
         if len(previous_thought_states) <= 1:
             return
-            
-        prompt = prompter.aggregation_prompt(previous_thought_states)
 
-        self.logger.debug("Prompt for LM: %s", prompt)
+        prompt = self._get_prompt(prompter, previous_thought_states)
 
         if lm.model_id == "gpt-3.5-turbo":
-            responses = lm.get_response_texts(
-                lm.query(prompt, num_responses=self.num_responses)
+            responses = self._query_all(lm, [(prompt, self.num_responses)])[0]
+            self._add_thoughts(
+                self._parse_states(parser, base_state, previous_thought_states, responses)
             )
+        else:
+            new_states = []
+            for wave in self._sample_waves(self.num_responses):
+                responses = self._query_all(lm, [(prompt, wave)])[0]
+                if self._extend_until_threshold(
+                    parser, base_state, previous_thought_states, responses, new_states
+                ):
+                    break
+            self._add_thoughts(new_states)
 
-            self.logger.debug("Responses from LM: %s", responses)
+    async def _aexecute(
+        self, lm: AbstractLanguageModel, prompter: Prompter, parser: Parser, **kwargs
+    ) -> None:
+        """
+        Asynchronously executes the DAggregate operation.
 
-            parsed = parser.parse_aggregation_answer(previous_thought_states, responses)
+        :param lm: The language model to be used.
+        :type lm: AbstractLanguageModel
+        :param prompter: The prompter for crafting prompts.
+        :type prompter: Prompter
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param kwargs: Additional parameters for execution.
+        :raises AssertionError: If operation has no predecessors.
+        """
+        assert (
+            len(self.predecessors) >= 1
+        ), "Aggregate operation must have at least one predecessor"
 
-            if isinstance(parsed, dict):
-                parsed = [parsed]
-            for new_state in parsed:
-                self.thoughts.append(Thought({**base_state, **new_state}))
-        else:
-            for i in range(self.num_responses):
-                responses = lm.get_response_texts(
-                    lm.query(prompt, num_responses=1)
-                )
+        previous_thoughts: List[Thought] = self.get_previous_thoughts()
 
-                self.logger.debug("Responses from LM: %s", responses)
+        if len(previous_thoughts) == 0:
+            return
 
-                parsed = parser.parse_aggregation_answer(previous_thought_states, responses)
+        base_state = self._get_base_state(previous_thoughts)
 
-                if isinstance(parsed, dict):
-                    parsed = [parsed]
-                for new_state in parsed:
-                    self.thoughts.append(Thought({**base_state, **new_state}))
+        # dynamic control
+        previous_thought_states = [thought.state for thought in previous_thoughts if thought.score>self.aggregate_threshold]
+        if len(previous_thought_states) <= 1:
+            return
+
+        prompt = self._get_prompt(prompter, previous_thought_states)
 
-                score = self.scoring_function(self.thoughts[-1].state)
-                if score > self.score_threshold:
+        if lm.model_id == "gpt-3.5-turbo":
+            responses = (await self._aquery_all(lm, [(prompt, self.num_responses)]))[0]
+            self._add_thoughts(
+                self._parse_states(parser, base_state, previous_thought_states, responses)
+            )
+        else:
+            new_states = []
+            for wave in self._sample_waves(self.num_responses):
+                responses = (await self._aquery_all(lm, [(prompt, wave)]))[0]
+                if self._extend_until_threshold(
+                    parser, base_state, previous_thought_states, responses, new_states
+                ):
                     break
+            self._add_thoughts(new_states)
+
+    def _extend_until_threshold(
+        self,
+        parser: Parser,
+        base_state: Dict,
+        previous_thought_states: List[Dict],
+        responses: List[str],
+        new_states: List[Dict],
+    ) -> bool:
+        """
+        Parses the responses of a sampling wave one after another until the most recent
+        aggregated state scores higher than the threshold. Responses after that one are
+        discarded, so the result is the same as when sampling one response at a time.
+
+        :param parser: The parser for parsing responses.
+        :type parser: Parser
+        :param base_state: The merged state of the predecessors' thoughts.
+        :type base_state: Dict
+        :param previous_thought_states: The states of the thoughts that were aggregated.
+        :type previous_thought_states: List[Dict]
+        :param responses: The responses of the wave.
+        :type responses: List[str]
+        :param new_states: The aggregated states created so far, extended in place.
+        :type new_states: List[Dict]
+        :return: True if the threshold was exceeded, False otherwise.
+        :rtype: bool
+        """
+        for response in responses:
+            new_states.extend(
+                self._parse_states(
+                    parser, base_state, previous_thought_states, [response]
+                )
+            )
+            if self._exceeds_threshold(new_states):
+                return True
+        return False
+
+    def _exceeds_threshold(self, states: List[Dict]) -> bool:
+        """
+        Scores the most recent aggregated state and checks if it exceeds the score threshold.
+
+        :param states: The aggregated states created so far.
+        :type states: List[Dict]
+        :return: True if the most recent state scores higher than the threshold, False otherwise.
+        :rtype: bool
+        """
+        with trace_span("scoring_function", "score", thoughts_in=1):
+            score = self.scoring_function(states[-1])
+        return score > self.score_threshold
 
 
 class KeepBestN(Operation):
@@ -1136,7 +2007,7 @@ class Selector(Operation):
         previous_thoughts: List[Thought] = self.get_previous_thoughts()
 
         if len(previous_thoughts) == 0:
-            previous_thoughts = [Thought(kwargs)]
+            previous_thoughts = [Thought(ThoughtState(kwargs))]
 
         self.thoughts = [
             Thought.from_thought(thought)
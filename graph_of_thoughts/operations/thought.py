@@ -12,13 +12,26 @@ from typing import Iterator, Dict, Optional
 import itertools
 
 
+# bits of the flags of a thought
+_VALID = 1
+_SOLVED = 2
+_SCORED = 4
+_VALIDATED = 8
+_COMPARED_TO_GROUND_TRUTH = 16
+
+
 class Thought:
     """
     Represents an LLM thought with its state, constructed by the parser, and various flags.
+    Thoughts are copied at every step of a graph, so they are slotted and keep their flags in one bitfield.
     """
 
+    __slots__ = ("id", "state", "_score", "_flags")
+
     _ids: Iterator[int] = itertools.count(0)
 
+    logger: logging.Logger = logging.getLogger("Thought")
+
     def __init__(self, state: Optional[Dict] = None) -> None:
         """
         Initializes a new Thought instance with a state and various default flags.
@@ -26,15 +39,10 @@ class Thought:
         :param state: The state of the thought. Defaults to None.
         :type state: Optional[Dict]
         """
-        self.logger: logging.Logger = logging.getLogger(self.__class__.__name__)
         self.id: int = next(Thought._ids)
         self.state: Dict = state
         self._score: float = 0.0
-        self._valid: bool = False
-        self._solved: bool = False
-        self.scored: bool = False
-        self.validated: bool = False
-        self.compared_to_ground_truth: bool = False
+        self._flags: int = 0
 
     @staticmethod
     def from_thought(thought: Thought) -> Thought:
@@ -45,14 +53,19 @@ class Thought:
         :return: A new Thought instance with properties copied from the input thought.
         """
         new_thought = Thought(thought.state)
-        new_thought.score = thought.score
-        new_thought.valid = thought.valid
-        new_thought.solved = thought.solved
-        new_thought.scored = thought.scored
-        new_thought.validated = thought.validated
-        new_thought.compared_to_ground_truth = thought.compared_to_ground_truth
+        new_thought._score = thought._score
+        new_thought._flags = thought._flags
         return new_thought
 
+    def _get_flag(self, flag: int) -> bool:
+        return bool(self._flags & flag)
+
+    def _set_flag(self, flag: int, value: bool) -> None:
+        if value:
+            self._flags |= flag
+        else:
+            self._flags &= ~flag
+
     @property
     def valid(self) -> bool:
         """
@@ -61,7 +74,7 @@ class Thought:
         :return: The validity of the thought.
         :rtype: bool
         """
-        return self._valid
+        return self._get_flag(_VALID)
 
     @valid.setter
     def valid(self, valid: bool) -> None:
@@ -71,8 +84,8 @@ class Thought:
         :param valid: The validity of the thought.
         :type valid: bool
         """
-        self.validated = True
-        self._valid = valid
+        self._flags |= _VALIDATED
+        self._set_flag(_VALID, valid)
 
     @property
     def score(self) -> float:
@@ -92,7 +105,7 @@ class Thought:
         :param new_score: The score of the thought.
         :type new_score: float
         """
-        self.scored = True
+        self._flags |= _SCORED
         self._score = new_score
 
     @property
@@ -103,7 +116,7 @@ class Thought:
         :return: The solved flag of the thought.
         :rtype: bool
         """
-        return self._solved
+        return self._get_flag(_SOLVED)
 
     @solved.setter
     def solved(self, solved: bool) -> None:
@@ -113,5 +126,47 @@ class Thought:
         :param solved: Whether the thought contains a solution to the problem.
         :type solved: bool
         """
-        self.compared_to_ground_truth = True
-        self._solved = solved
+        self._flags |= _COMPARED_TO_GROUND_TRUTH
+        self._set_flag(_SOLVED, solved)
+
+    @property
+    def scored(self) -> bool:
+        """
+        Returns whether the thought has been scored.
+
+        :return: The scored flag of the thought.
+        :rtype: bool
+        """
+        return self._get_flag(_SCORED)
+
+    @scored.setter
+    def scored(self, scored: bool) -> None:
+        self._set_flag(_SCORED, scored)
+
+    @property
+    def validated(self) -> bool:
+        """
+        Returns whether the thought has been validated.
+
+        :return: The validated flag of the thought.
+        :rtype: bool
+        """
+        return self._get_flag(_VALIDATED)
+
+    @validated.setter
+    def validated(self, validated: bool) -> None:
+        self._set_flag(_VALIDATED, validated)
+
+    @property
+    def compared_to_ground_truth(self) -> bool:
+        """
+        Returns whether the thought has been compared to the ground truth.
+
+        :return: The compared_to_ground_truth flag of the thought.
+        :rtype: bool
+        """
+        return self._get_flag(_COMPARED_TO_GROUND_TRUTH)
+
+    @compared_to_ground_truth.setter
+    def compared_to_ground_truth(self, compared_to_ground_truth: bool) -> None:
+        self._set_flag(_COMPARED_TO_GROUND_TRUTH, compared_to_ground_truth)
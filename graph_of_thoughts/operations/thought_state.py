@@ -0,0 +1,139 @@
+# author: Jayce Ning
+
+from __future__ import annotations
+from collections.abc import Mapping, MutableMapping
+from typing import Any, Dict, Iterator, Optional
+
+# marks a key of the context that was deleted in the overlay
+_DELETED = object()
+
+
+class ThoughtState(MutableMapping):
+    """
+    State of a thought that behaves like a dict, but keeps the context of the problem (e.g. the article, its
+    sections and references) in a mapping that is shared by all thoughts of the problem, and only the keys
+    that a thought sets itself (e.g. current and rouge) in a small overlay.
+    Copying and deriving states therefore costs the size of the overlay instead of the whole problem.
+    The context is never modified through a state: keys that are set or deleted are recorded in the overlay.
+    """
+
+    __slots__ = ("context", "overlay")
+
+    def __init__(self, context: Optional[Mapping] = None, overlay: Optional[Dict] = None) -> None:
+        """
+        Initialize a state.
+
+        :param context: The shared context, it is not copied. Defaults to None (empty context).
+        :type context: Optional[Mapping]
+        :param overlay: The keys of the thought, they take precedence over the context. Defaults to None.
+        :type overlay: Optional[Dict]
+        """
+        self.context: Mapping = context if context is not None else {}
+        self.overlay: Dict[str, Any] = overlay if overlay is not None else {}
+
+    def __getitem__(self, key: str) -> Any:
+        value = self.overlay.get(key, _DELETED)
+        if value is not _DELETED:
+            return value
+        if key in self.overlay:
+            raise KeyError(key)
+        return self.context[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.overlay[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+        if key in self.context:
+            self.overlay[key] = _DELETED
+        else:
+            del self.overlay[key]
+
+    def __contains__(self, key: object) -> bool:
+        value = self.overlay.get(key, None)
+        if value is not None or key in self.overlay:
+            return value is not _DELETED
+        return key in self.context
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.context:
+            if self.overlay.get(key, None) is not _DELETED:
+                yield key
+        for key, value in self.overlay.items():
+            if value is not _DELETED and key not in self.context:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.to_dict()!r})"
+
+    def copy(self) -> ThoughtState:
+        """
+        Return a copy that shares the context.
+
+        :return: The copy.
+        :rtype: ThoughtState
+        """
+        return ThoughtState(self.context, self.overlay.copy())
+
+    def to_dict(self) -> Dict:
+        """
+        Return the state as plain dict, e.g. to serialize it.
+
+        :return: The keys of the context and the overlay.
+        :rtype: Dict
+        """
+        return dict(self.items())
+
+    def derive(self, update: Mapping) -> ThoughtState:
+        """
+        Return a new state with the keys of `update` set, like `{**self, **update}`.
+        Values of `update` that are the values of the shared context are not copied into the overlay.
+
+        :param update: The keys to set.
+        :type update: Mapping
+        :return: The new state, sharing the context.
+        :rtype: ThoughtState
+        """
+        if isinstance(update, ThoughtState) and update.context is self.context:
+            # the update contains the keys of the context unless it deleted them, keys deleted by the update
+            # keep the values of this state, as with {**self, **update}
+            overlay = {
+                key: value
+                for key, value in self.overlay.items()
+                if key not in self.context or update.overlay.get(key, None) is _DELETED
+            }
+            overlay.update((key, value) for key, value in update.overlay.items() if value is not _DELETED)
+            return ThoughtState(self.context, overlay)
+        overlay = self.overlay.copy()
+        for key, value in update.items():
+            if key not in overlay and self.context.get(key, _DELETED) is value:
+                continue
+            overlay[key] = value
+        return ThoughtState(self.context, overlay)
+
+
+def merge_states(base: Mapping, update: Mapping) -> Mapping:
+    """
+    Merge two thought states like `{**base, **update}`, sharing the context if one of them is a ThoughtState.
+
+    :param base: The base state.
+    :type base: Mapping
+    :param update: The state whose keys take precedence.
+    :type update: Mapping
+    :return: The merged state.
+    :rtype: Mapping
+    """
+    if isinstance(base, ThoughtState):
+        return base.derive(update)
+    if isinstance(update, ThoughtState):
+        overlay = {key: value for key, value in base.items() if key not in update}
+        for key, value in update.overlay.items():
+            # a key deleted by the update keeps the value of the base, if it has one
+            if value is not _DELETED or key not in overlay:
+                overlay[key] = value
+        return ThoughtState(update.context, overlay)
+    return {**base, **update}
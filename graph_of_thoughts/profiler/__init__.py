@@ -0,0 +1 @@
+from .profiler import Profiler, Span, trace_span
@@ -0,0 +1,341 @@
+# author: Jayce Ning
+
+from __future__ import annotations
+import asyncio
+import contextvars
+import csv
+import itertools
+import json
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# innermost open span of the current thread or task and the profiler recording it
+_current_span: contextvars.ContextVar[Optional[Tuple[Profiler, Span]]] = contextvars.ContextVar(
+    "current_span", default=None
+)
+
+# span arguments that are summed up in the summary
+SUMMED_ARGS = ("prompt_tokens", "completion_tokens", "thoughts_in", "thoughts_out")
+
+
+class Span:
+    """
+    A timed section of the execution, e.g. an operation, a prompt, a request to the LM, parsing or scoring.
+    """
+
+    __slots__ = ("id", "parent", "name", "category", "start", "end", "lane", "args")
+
+    def __init__(
+        self, id: int, parent: Optional[Span], name: str, category: str, lane: Tuple[int, int], args: Dict
+    ) -> None:
+        self.id: int = id
+        self.parent: Optional[Span] = parent
+        self.name: str = name
+        self.category: str = category
+        self.start: int = time.perf_counter_ns()
+        self.end: Optional[int] = None
+        # thread and asyncio task in which the span was opened
+        self.lane: Tuple[int, int] = lane
+        self.args: Dict[str, Any] = args
+
+    @property
+    def duration(self) -> float:
+        """
+        Duration of the span in seconds, up to now if it is still open.
+        """
+        end = self.end if self.end is not None else time.perf_counter_ns()
+        return (end - self.start) / 1e9
+
+
+def _lane() -> Tuple[int, int]:
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    return threading.get_ident(), id(task) if task is not None else 0
+
+
+@contextmanager
+def trace_span(name: str, category: str, **args) -> Iterator[Optional[Span]]:
+    """
+    Record a child span of the innermost open span, e.g. inside a prompter or a scoring function.
+    Nothing is recorded if no profiler is active in the current thread or task.
+
+    :param name: Name of the span.
+    :type name: str
+    :param category: Category of the span.
+    :type category: str
+    :param args: Arguments of the span, e.g. token counts.
+    :return: The span, None if no profiler is active.
+    :rtype: Iterator[Optional[Span]]
+    """
+    current = _current_span.get()
+    if current is None:
+        yield None
+        return
+    with current[0].span(name, category, **args) as span:
+        yield span
+
+
+class Profiler:
+    """
+    Records nested spans of the execution of Graphs of Operations: a span per operation and child spans for
+    the construction of the prompts, every request to the LM, parsing and scoring. The spans carry the token
+    counts of the requests and the number of thoughts of the operations.
+    The spans can be exported as Chrome trace JSON (chrome://tracing, ui.perfetto.dev) and summarised per
+    name as CSV. The profiler is thread-safe and can be shared by concurrent runs.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initialize an empty profiler.
+        """
+        self.spans: List[Span] = []
+        self.lock: threading.Lock = threading.Lock()
+        self.origin: int = time.perf_counter_ns()
+        self._ids: Iterator[int] = itertools.count(0)
+        self._language_models: weakref.WeakSet = weakref.WeakSet()
+
+    @contextmanager
+    def span(self, name: str, category: str, parent: Optional[Span] = None, **args) -> Iterator[Span]:
+        """
+        Record a span for the duration of the context. Spans opened inside the context in the same thread or
+        task, or in tasks created inside it, are its children.
+
+        :param name: Name of the span.
+        :type name: str
+        :param category: Category of the span, e.g. "operation", "prompt", "lm", "parse" or "score".
+        :type category: str
+        :param parent: The parent span. Defaults to None, in which case the innermost open span is used.
+        :type parent: Optional[Span]
+        :param args: Arguments of the span, e.g. token counts.
+        :return: The span, its arguments can be updated inside the context.
+        :rtype: Iterator[Span]
+        """
+        if parent is None:
+            current = _current_span.get()
+            if current is not None and current[0] is self:
+                parent = current[1]
+        with self.lock:
+            span = Span(next(self._ids), parent, name, category, _lane(), args)
+            self.spans.append(span)
+        token = _current_span.set((self, span))
+        try:
+            yield span
+        finally:
+            _current_span.reset(token)
+            span.end = time.perf_counter_ns()
+
+    @contextmanager
+    def operation(self, operation, lm, prompter, parser) -> Iterator[Tuple[Any, Any, Any]]:
+        """
+        Record the span of an operation. The language model, prompter and parser are replaced by proxies
+        that record child spans for the requests, the prompts and the parsing.
+
+        :param operation: The operation.
+        :type operation: Operation
+        :param lm: The language model.
+        :type lm: AbstractLanguageModel
+        :param prompter: The prompter.
+        :type prompter: Prompter
+        :param parser: The parser.
+        :type parser: Parser
+        :return: The proxies of the language model, prompter and parser.
+        :rtype: Iterator[Tuple[Any, Any, Any]]
+        """
+        self._attach(lm)
+        with self.span(
+            operation.__class__.__name__,
+            "operation",
+            operation_id=operation.id,
+            thoughts_in=len(operation.get_previous_thoughts()),
+            prompt_tokens=0,
+            completion_tokens=0,
+        ) as span:
+            yield (
+                _ProfiledLanguageModel(self, lm),
+                _ProfiledCalls(self, prompter, "prompt", lambda name: name.endswith("_prompt")),
+                _ProfiledCalls(self, parser, "parse", lambda name: name.startswith("parse_")),
+            )
+            span.args["thoughts_out"] = len(operation.get_thoughts())
+
+    def _attach(self, lm) -> None:
+        # the usage callback attributes the tokens of a request to the open spans
+        with self.lock:
+            if lm in self._language_models:
+                return
+            self._language_models.add(lm)
+        lm.usage_callbacks.append(self._add_usage)
+
+    def _add_usage(self, prompt_tokens: int, completion_tokens: int, cost: float) -> None:
+        current = _current_span.get()
+        if current is None or current[0] is not self:
+            return
+        span = current[1]
+        with self.lock:
+            while span is not None:
+                span.args["prompt_tokens"] = span.args.get("prompt_tokens", 0) + prompt_tokens
+                span.args["completion_tokens"] = span.args.get("completion_tokens", 0) + completion_tokens
+                span = span.parent
+
+    def clear(self) -> None:
+        """
+        Remove the recorded spans.
+        """
+        with self.lock:
+            self.spans = []
+
+    def _closed_spans(self) -> List[Span]:
+        with self.lock:
+            return [span for span in self.spans if span.end is not None]
+
+    def chrome_trace(self) -> Dict:
+        """
+        Create the trace of the closed spans in the Chrome trace event format. Every thread and asyncio task
+        is shown as a track of its own.
+
+        :return: The trace.
+        :rtype: Dict
+        """
+        pid = os.getpid()
+        lanes: Dict[Tuple[int, int], int] = {}
+        events = []
+        for span in self._closed_spans():
+            if span.lane not in lanes:
+                lanes[span.lane] = len(lanes)
+                events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": pid,
+                        "tid": lanes[span.lane],
+                        "args": {"name": f"thread {span.lane[0]}" + (" task" if span.lane[1] else "")},
+                    }
+                )
+            events.append(
+                {
+                    "name": span.name,
+                    "cat": span.category,
+                    "ph": "X",
+                    "ts": (span.start - self.origin) / 1000,
+                    "dur": (span.end - span.start) / 1000,
+                    "pid": pid,
+                    "tid": lanes[span.lane],
+                    "args": {
+                        "id": span.id,
+                        "parent": span.parent.id if span.parent is not None else None,
+                        **span.args,
+                    },
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def to_chrome_trace(self, path: str) -> None:
+        """
+        Write the trace of the closed spans to a JSON file.
+
+        :param path: Path to the JSON file.
+        :type path: str
+        """
+        with open(path, "w") as json_file:
+            json.dump(self.chrome_trace(), json_file, default=str)
+
+    def summary(self) -> List[Dict]:
+        """
+        Summarise the closed spans per category and name.
+
+        :return: The number of spans, the total, mean and maximum duration in seconds and the summed token
+                 and thought counts, sorted by the total duration.
+        :rtype: List[Dict]
+        """
+        rows: Dict[Tuple[str, str], Dict] = {}
+        for span in self._closed_spans():
+            row = rows.setdefault(
+                (span.category, span.name),
+                {
+                    "category": span.category,
+                    "name": span.name,
+                    "count": 0,
+                    "total_s": 0.0,
+                    "max_s": 0.0,
+                    **{arg: 0 for arg in SUMMED_ARGS},
+                },
+            )
+            row["count"] += 1
+            row["total_s"] += span.duration
+            row["max_s"] = max(row["max_s"], span.duration)
+            for arg in SUMMED_ARGS:
+                row[arg] += span.args.get(arg, 0)
+        for row in rows.values():
+            row["mean_s"] = row["total_s"] / row["count"]
+        return sorted(rows.values(), key=lambda row: row["total_s"], reverse=True)
+
+    def to_csv(self, path: str) -> None:
+        """
+        Write the summary of the closed spans to a CSV file.
+
+        :param path: Path to the CSV file.
+        :type path: str
+        """
+        fields = ["category", "name", "count", "total_s", "mean_s", "max_s", *SUMMED_ARGS]
+        with open(path, "w", newline="") as csv_file:
+            writer = csv.DictWriter(csv_file, fieldnames=fields)
+            writer.writeheader()
+            writer.writerows(self.summary())
+
+
+class _ProfiledLanguageModel:
+    """
+    Proxy of a language model that records a span for every request.
+    """
+
+    def __init__(self, profiler: Profiler, lm) -> None:
+        self._profiler = profiler
+        self._lm = lm
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._lm, name)
+
+    def query(self, query: str, num_responses: int = 1) -> Any:
+        with self._profiler.span(
+            "query", "lm", prompt_chars=len(query), num_responses=num_responses, prompt_tokens=0, completion_tokens=0
+        ):
+            return self._lm.query(query, num_responses)
+
+    async def aquery(self, query: str, num_responses: int = 1) -> Any:
+        with self._profiler.span(
+            "query", "lm", prompt_chars=len(query), num_responses=num_responses, prompt_tokens=0, completion_tokens=0
+        ):
+            return await self._lm.aquery(query, num_responses)
+
+
+class _ProfiledCalls:
+    """
+    Proxy that records a span for every call of the selected methods of the wrapped object.
+    """
+
+    def __init__(self, profiler: Profiler, target, category: str, selected: Callable[[str], bool]) -> None:
+        self._profiler = profiler
+        self._target = target
+        self._category = category
+        self._selected = selected
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._target, name)
+        if not callable(attribute) or not self._selected(name):
+            return attribute
+
+        def profiled(*args, **kwargs):
+            with self._profiler.span(name, self._category) as span:
+                result = attribute(*args, **kwargs)
+                if isinstance(result, str):
+                    span.args["chars"] = len(result)
+                elif isinstance(result, list):
+                    span.args["results"] = len(result)
+                return result
+
+        return profiled
@@ -0,0 +1,176 @@
+# author: Jayce Ning
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+import pytest
+import tiktoken
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph_of_thoughts import controller, operations
+import generate_abstract
+from utils import scoring_context
+from utils.tokenizer import token_cache
+
+PROBLEM = {
+    "origin_title": "Graph of thoughts for abstract generation",
+    "origin_abstract": "Graph of thoughts improves the abstracts generated by large language models.",
+    "origin_introduction": "Large language models generate abstracts of scientific articles. " * 20,
+    "origin_info": {
+        "Methods": "The thoughts are generated, scored, aggregated and improved in a graph. " * 20,
+        "Results": "The generated abstracts reach higher rouge scores than chains of thought. " * 20,
+    },
+    "reference_info": {"Chain of thought": "Chains of thought let models reason step by step. " * 10},
+    "reference_ids": None,
+    "current": "",
+}
+
+
+@pytest.fixture(autouse=True)
+def byte_encoding(monkeypatch):
+    # the prompts are tokenized without downloading the encoding of gpt-3.5-turbo
+    encoding = tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([byte]): byte for byte in range(256)},
+        special_tokens={},
+    )
+    monkeypatch.setattr(tiktoken, "encoding_for_model", lambda model_name: encoding)
+    token_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def prompt_counters(monkeypatch):
+    # run() sets up the counters of every prompt length
+    monkeypatch.setitem(generate_abstract.generate_prompt_nums, "8192", 0)
+    monkeypatch.setitem(generate_abstract.cut_abstract_nums, "8192", 0)
+
+
+def build_graph(method: str, max_concurrent_queries=None):
+    if method == "got":
+        return generate_abstract.got(5, max_concurrent_queries)
+    return generate_abstract.dgot(5, None, max_concurrent_queries)
+
+
+def run_graph(
+    method: str, path, lm=None, max_concurrent_queries=None, controller_class=controller.Controller, **kwargs
+):
+    executor = controller_class(
+        lm if lm is not None else controller.MockLanguageModel(),
+        build_graph(method, max_concurrent_queries),
+        generate_abstract.GenAbstractPrompter(max_input_prompt_tokens=8192),
+        generate_abstract.GenAbstractParser(),
+        dict(PROBLEM, method=method),
+        scoring_context_factory=scoring_context,
+        **kwargs,
+    )
+    executor.run()
+    executor.output_graph(str(path))
+    executor.close()
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+@pytest.mark.parametrize("method", ["got", "dgot"])
+def test_spilled_output_graph_is_complete(method, tmp_path):
+    expected = run_graph(method, tmp_path / "default.json")
+    spill_dir = tmp_path / "spill"
+    spill_dir.mkdir()
+    output = run_graph(method, tmp_path / "spilled.json", release_thoughts=True, spill_dir=str(spill_dir))
+    assert output == expected
+    # the temporary spill file is removed by close
+    assert os.listdir(spill_dir) == []
+
+
+@pytest.mark.parametrize("method", ["got", "dgot"])
+def test_released_operations_without_spill_dir(method, tmp_path):
+    expected = run_graph(method, tmp_path / "default.json")
+    output = run_graph(method, tmp_path / "released.json", release_thoughts=True)
+    assert len(output) == len(expected)
+    released = [operation for operation in output[:-1] if operation.get("released")]
+    assert len(released) > 0
+    for operation, expected_operation in zip(output[:-1], expected[:-1]):
+        assert operation["operation"] == expected_operation["operation"]
+        if operation.get("released"):
+            assert operation["thoughts"] == []
+        else:
+            assert operation == expected_operation
+    # the leaves are never released
+    assert output[-2] == expected[-2]
+
+
+@pytest.mark.parametrize("controller_class", [controller.Controller, controller.AsyncController])
+@pytest.mark.parametrize("method", ["got", "dgot"])
+def test_parallel_run_equals_sequential_run(method, controller_class, tmp_path):
+    expected = run_graph(method, tmp_path / "sequential.json")
+    # requests finish in a random order
+    lm = controller.MockLanguageModel(latency="uniform", mean_latency=0.002, latency_spread=1.0)
+    output = run_graph(
+        method,
+        tmp_path / "parallel.json",
+        lm=lm,
+        max_concurrent_queries=4,
+        controller_class=controller_class,
+        max_parallel_operations=3,
+    )
+    # only the usage differs, the samples of a prompt are requested one by one and in waves
+    assert output[:-1] == expected[:-1]
+
+
+class FlakyLanguageModel(controller.MockLanguageModel):
+    """
+    Mock model whose requests with a prompt fail a given number of times, -1 for always.
+    """
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = dict(failures)
+        self.attempts = {}
+
+    def _attempt(self, query):
+        with self.stats_lock:
+            self.attempts[query] = self.attempts.get(query, 0) + 1
+            if self.failures.get(query, 0) != 0:
+                self.failures[query] -= 1
+                raise RuntimeError(f"request with {query} failed")
+
+    def query(self, query, num_responses=1):
+        self._attempt(query)
+        return super().query(query, num_responses)
+
+    async def aquery(self, query, num_responses=1):
+        self._attempt(query)
+        return await super().aquery(query, num_responses)
+
+
+@pytest.fixture
+def retry_waits(monkeypatch):
+    # the operations wait one to three seconds before repeating failed requests
+    waits = []
+
+    async def async_sleep(delay):
+        waits.append(delay)
+
+    monkeypatch.setattr(time, "sleep", waits.append)
+    monkeypatch.setattr(asyncio, "sleep", async_sleep)
+    return waits
+
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_failure_budget(retry_waits, use_async):
+    lm = FlakyLanguageModel({"flaky": 2, "broken": -1})
+    operation = operations.Generate(1, 1, max_concurrent_queries=2)
+    queries = [("fine", 2), ("flaky", 3), ("broken", 3)]
+    if use_async:
+        responses = asyncio.run(operation._aquery_all(lm, queries))
+    else:
+        responses = operation._query_all(lm, queries)
+    assert [len(query_responses) for query_responses in responses] == [2, 3, 0]
+    # the failed requests of "flaky" are repeated, "broken" is dropped after as many failed requests as responses
+    assert lm.attempts == {"fine": 2, "flaky": 5, "broken": 3}
+    # one wait before the second round of requests
+    assert len(retry_waits) == 1
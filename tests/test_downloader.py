@@ -0,0 +1,155 @@
+# author: Jayce Ning
+
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import downloader as downloader_module
+from utils.downloader import MAX_GET_IDS, Downloader
+from utils.manifest import Manifest
+
+
+def pubmed_article(pmid: str) -> str:
+    return (
+        f"<PubmedArticle><MedlineCitation><PMID Version=\"1\">{pmid}</PMID>"
+        f"<Article><ArticleTitle>Article {pmid}</ArticleTitle></Article></MedlineCitation></PubmedArticle>"
+    )
+
+
+class EfetchHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, params):
+        server = self.server
+        ids = params.get("id", [""])[0].split(",")
+        with server.lock:
+            server.requests.append((self.command, ids))
+            status = server.statuses.pop(0) if server.statuses else 200
+        if status != 200:
+            self.send_response(status)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        # records missing in batch responses are only returned when requested individually
+        articles = [
+            pubmed_article(pmid)
+            for pmid in ids
+            if pmid in server.records and (len(ids) == 1 or pmid not in server.missing_in_batches)
+        ]
+        body = ('<?xml version="1.0" ?>\n<PubmedArticleSet>\n' + "\n".join(articles) + "\n</PubmedArticleSet>\n").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._reply(parse_qs(urlparse(self.path).query))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self._reply(parse_qs(self.rfile.read(length).decode()))
+
+
+@pytest.fixture
+def efetch_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EfetchHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.statuses = []
+    server.records = set()
+    server.missing_in_batches = set()
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    # record the backoff delays instead of waiting, without jitter
+    delays = []
+    monkeypatch.setattr(downloader_module.time, "sleep", delays.append)
+    monkeypatch.setattr(downloader_module.random, "uniform", lambda low, high: high)
+    return delays
+
+
+def make_downloader(server, **kwargs) -> Downloader:
+    downloader = Downloader(
+        base_url=f"http://127.0.0.1:{server.server_address[1]}/efetch.fcgi",
+        requests_per_second=1000.0,
+        backoff_base=0.5,
+        timeout=5.0,
+        **kwargs,
+    )
+    downloader.bucket.acquire = lambda: None
+    return downloader
+
+
+@pytest.mark.parametrize("status", [500, 503, 429])
+def test_retry_with_backoff(efetch_server, sleeps, status):
+    efetch_server.records = {"1"}
+    efetch_server.statuses = [status, status, status]
+    downloader = make_downloader(efetch_server, max_retries=5)
+    content = downloader.fetch("pubmed", ["1"])
+    assert "<PMID Version=\"1\">1</PMID>" in content
+    assert len(efetch_server.requests) == 4
+    assert sleeps == [0.5, 1.0, 2.0]
+    assert downloader.num_requests == 4
+
+
+@pytest.mark.parametrize("status", [400, 404])
+def test_no_retry_on_client_error(efetch_server, sleeps, status):
+    efetch_server.statuses = [status]
+    downloader = make_downloader(efetch_server, max_retries=5)
+    with pytest.raises(requests.HTTPError):
+        downloader.fetch("pubmed", ["1"])
+    assert len(efetch_server.requests) == 1
+    assert sleeps == []
+
+
+def test_max_retries_cap(efetch_server, sleeps):
+    efetch_server.statuses = [500] * 10
+    downloader = make_downloader(efetch_server, max_retries=3, backoff_max=0.75)
+    with pytest.raises(requests.HTTPError):
+        downloader.fetch("pubmed", ["1"])
+    assert len(efetch_server.requests) == 4
+    assert sleeps == [0.5, 0.75, 0.75]
+
+
+def test_post_above_max_get_ids(efetch_server, sleeps):
+    ids = [str(i) for i in range(1, MAX_GET_IDS + 2)]
+    efetch_server.records = set(ids)
+    downloader = make_downloader(efetch_server)
+    assert len(downloader_module.split_pubmed_records(downloader.fetch("pubmed", ids[:MAX_GET_IDS]))) == MAX_GET_IDS
+    assert len(downloader_module.split_pubmed_records(downloader.fetch("pubmed", ids))) == MAX_GET_IDS + 1
+    assert [(method, len(request_ids)) for method, request_ids in efetch_server.requests] == [
+        ("GET", MAX_GET_IDS),
+        ("POST", MAX_GET_IDS + 1),
+    ]
+
+
+def test_batch_missing_record(efetch_server, sleeps, tmp_path):
+    efetch_server.records = {"1", "2", "3"}
+    efetch_server.missing_in_batches = {"2"}
+    manifest = Manifest(str(tmp_path / "manifest.jsonl"))
+    downloader = make_downloader(efetch_server)
+    results = downloader.download_batch(["1", "2", "3", "4"], str(tmp_path), manifest)
+    assert results == {"1": True, "2": True, "3": True, "4": False}
+    # the missing records are requested once more individually
+    assert efetch_server.requests == [("GET", ["1", "2", "3", "4"]), ("GET", ["2"]), ("GET", ["4"])]
+    for pmid in ("1", "2", "3"):
+        assert manifest.is_complete("pubmed", pmid)
+        with open(tmp_path / f"{pmid}.html", encoding="utf-8") as file:
+            assert list(downloader_module.split_pubmed_records(file.read())) == [pmid]
+    assert not os.path.exists(tmp_path / "4.html")
+    assert Manifest(str(tmp_path / "manifest.jsonl")).get("pubmed", "4")["status"] == "failed"
@@ -0,0 +1,17 @@
+# author: Jayce Ning
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.manifest import Manifest
+
+
+def test_resume_after_incomplete_last_line(tmp_path):
+    path = tmp_path / "manifest.jsonl"
+    path.write_text('{"db": "pmc", "id": "1", "status": "failed"}\n{"db": "pmc", "id": "2", "sta')
+    manifest = Manifest(str(path))
+    manifest.record_failed("pmc", "3", "error")
+    manifest.record_failed("pmc", "4", "error")
+    assert sorted(record_id for _, record_id in Manifest(str(path)).entries) == ["1", "3", "4"]
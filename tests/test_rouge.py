@@ -0,0 +1,93 @@
+# author: Jayce Ning
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.rouge import evaluate_rouge, evaluate_rouge_batch, stem
+
+# (gold, candidate, ((R, P, F) of ROUGE-1, ROUGE-2, ROUGE-L)), the expected values were produced once by
+# ROUGE-1.5.5 through utils/cal_rouge.py process([candidate], [gold], 0) with the default options of
+# utils/pyrouge.py ("-c 95 -m -r 1000 -n 2 -a")
+CASES = [
+    (
+        'the cat sat on the mat',
+        'the cat was sitting on the mat',
+        ((0.83333, 0.71429, 0.76923), (0.6, 0.5, 0.54545), (0.83333, 0.71429, 0.76923)),
+    ),
+    (
+        'Long-term follow-up of non-small-cell lung cancer patients.',
+        'Patients with non small cell lung cancer need long term follow up.',
+        ((0.90909, 0.83333, 0.86956), (0.7, 0.63636, 0.66666), (0.45455, 0.41667, 0.43479)),
+    ),
+    (
+        'Mice were treated for 12 weeks.<q>Tumour growth was reduced in treated mice.<q>No toxicity was observed.',
+        'Tumour growth was reduced after 12 weeks of treatment.<q>The treated mice showed no toxicity.',
+        ((0.58824, 0.66667, 0.625), (0.375, 0.42857, 0.4), (0.58824, 0.66667, 0.625)),
+    ),
+    (
+        'Meta-analyses of the inclusion criteria in mice and geese.',
+        'A meta-analysis of the criterion for inclusion in a mouse and a goose.',
+        ((0.7, 0.5, 0.58333), (0.11111, 0.07692, 0.09091), (0.6, 0.42857, 0.5)),
+    ),
+    (
+        'The analyses were better than expected.<q>Children and women were excluded.',
+        'The analysis was good, but children were excluded.<q>Women were included in later analyses.',
+        ((0.63636, 0.5, 0.56), (0.2, 0.15385, 0.17392), (0.63636, 0.5, 0.56)),
+    ),
+    (
+        'Relational generalization of the hopefulness scores improved sensitivity.',
+        'Generalizations of relational hopeful scoring improve the sensitivity.',
+        ((1.0, 1.0, 1.0), (0.42857, 0.42857, 0.42857), (0.75, 0.75, 0.75)),
+    ),
+    (
+        'BRCA1/2 mutations (n=45) were found in 3.5% of cases.',
+        'Mutations of BRCA1 and BRCA2 were found in 45 cases (3.5%).',
+        ((0.83333, 0.83333, 0.83333), (0.27273, 0.27273, 0.27273), (0.5, 0.5, 0.5)),
+    ),
+    (
+        'The the the cell cells were counted twice.<q>Cells were counted again.',
+        'Cells were counted.<q>The cells were counted twice and the cells were counted again.',
+        ((0.91667, 0.78571, 0.84615), (0.63636, 0.53846, 0.58333), (0.75, 0.64286, 0.69231)),
+    ),
+    (
+        "Women's analyses: 95% CI, 1.2-3.4; p < 0.05.",
+        'The analyses of women (95% CI 1.2 to 3.4, p<0.05).',
+        ((0.9, 0.75, 0.81818), (0.55556, 0.45455, 0.5), (0.8, 0.66667, 0.72727)),
+    ),
+    (
+        'no overlap here at all',
+        'completely different summary text',
+        ((0.0, 0.0, 0.0), (0.0, 0.0, 0.0), (0.0, 0.0, 0.0)),
+    ),
+]
+
+
+def _triples(scores):
+    return tuple(
+        tuple(scores["rouge_%s_%s" % (n, measure)] for measure in ("recall", "precision", "f_score"))
+        for n in ("1", "2", "l")
+    )
+
+
+@pytest.mark.parametrize("gold, candidate, expected", CASES)
+def test_matches_rouge_155(gold, candidate, expected):
+    assert _triples(evaluate_rouge(candidate, gold)) == expected
+
+
+def test_batch_matches_single():
+    golds = [gold for gold, _, _ in CASES]
+    for _, candidate, _ in CASES:
+        assert evaluate_rouge_batch(candidate, golds) == [evaluate_rouge(candidate, gold) for gold in golds]
+
+
+@pytest.mark.parametrize(
+    "token, expected",
+    [("analyses", "analysis"), ("criteria", "criterion"), ("mice", "mouse"), ("geese", "goose"), ("children", "child"),
+     ("cells", "cell"), ("generalization", "gener"), ("is", "is")],
+)
+def test_stem_uses_exceptions_before_porter(token, expected):
+    assert stem(token) == expected
@@ -0,0 +1,48 @@
+# author: Jayce Ning
+
+import os
+import sys
+
+import pytest
+import tiktoken
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.tokenizer import token_cache, truncate_to_tokens
+
+
+@pytest.fixture
+def byte_encoding() -> tiktoken.Encoding:
+    # every byte is a token of its own, so multi-byte characters are split across tokens
+    token_cache.clear()
+    return tiktoken.Encoding(
+        name="bytes",
+        pat_str=r"\S+|\s+",
+        mergeable_ranks={bytes([byte]): byte for byte in range(256)},
+        special_tokens={},
+    )
+
+
+@pytest.mark.parametrize("max_tokens", [12, 13])
+def test_truncate_inside_multi_byte_character(byte_encoding, max_tokens):
+    text, cut = truncate_to_tokens("In patients ≥ 65 years", max_tokens, byte_encoding)
+    assert text == "In patients "
+    assert cut == len(text)
+
+
+def test_truncate_fits_and_keeps_whole_characters(byte_encoding):
+    text = "μ ± 中文 ≥ 65"
+    for max_tokens in range(len(text.encode("utf-8")) + 1):
+        truncated, cut = truncate_to_tokens(text, max_tokens, byte_encoding)
+        assert text.startswith(truncated)
+        assert len(byte_encoding.encode(truncated)) <= max_tokens
+        if cut is not None:
+            # the next character does not fit anymore
+            assert len(text[: cut + 1].encode("utf-8")) > max_tokens
+
+
+def test_truncate_does_not_memoise(byte_encoding):
+    # prompts are truncated only once, their tokens are not kept
+    truncate_to_tokens("a one-off prompt " * 10, 20, byte_encoding)
+    truncate_to_tokens("a short prompt", 20, byte_encoding)
+    assert len(token_cache.entries) == 0
@@ -1,3 +1,4 @@
-from .read_data import read_pmc, read_pm
-from .utils import rouge1_f_test_introduction, rouge1_f_gold_summary
+from .read_data import read_pmc, read_pm, extract_pmc, extract_pm
+from .utils import rouge1_f_test_introduction, rouge1_f_gold_summary, cal_rouge_f, scoring_context
+from .rouge import evaluate_rouge
 from .draw_figure import process_data_for_all_tasks, draw_line_box_bar_figure, draw_double_line_box_bar_figure, cal_gumbel, cal_and_draw_transformation_score, draw_main_result_figure, draw_node_num_r_i_figure
\ No newline at end of file
@@ -0,0 +1,403 @@
+# author: Jayce Ning
+
+import json
+import mmap
+import os
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+
+class CitationGraph:
+    """
+    Index over a PubMedCite citation graph (the `induc_graph` / `trans_graph` JSON files).
+    The references of all articles are stored as one array of reference codes with the offsets of every
+    article (CSR layout), so that the availability of the references is checked with vectorised operations
+    instead of list lookups.
+    """
+
+    def __init__(
+        self, pmc_ids: List[str], references: List[List[str]], pmids: Optional[List] = None
+    ) -> None:
+        """
+        Initialize the index.
+
+        :param pmc_ids: The PMC ids of the articles.
+        :type pmc_ids: List[str]
+        :param references: The PMIDs of the references of every article.
+        :type references: List[List[str]]
+        :param pmids: The PMIDs of the articles. Defaults to None.
+        :type pmids: Optional[List]
+        """
+        assert len(pmc_ids) == len(references), "Every article needs a reference list"
+        self.pmc_ids: List[str] = list(pmc_ids)
+        self.references: List[List[str]] = [list(reference_list) for reference_list in references]
+        self.pmids: Optional[List] = list(pmids) if pmids is not None else None
+
+        # vocabulary of the referenced PMIDs
+        self.reference_ids: List[str] = []
+        self.reference_codes: Dict[str, int] = {}
+        codes = []
+        for reference_list in self.references:
+            for pm_id in reference_list:
+                code = self.reference_codes.get(pm_id)
+                if code is None:
+                    code = len(self.reference_ids)
+                    self.reference_codes[pm_id] = code
+                    self.reference_ids.append(pm_id)
+                codes.append(code)
+        lengths = np.fromiter((len(reference_list) for reference_list in self.references), dtype=np.int64,
+                              count=len(self.references))
+        self.offsets: np.ndarray = np.zeros(len(self.references) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=self.offsets[1:])
+        self.codes: np.ndarray = np.asarray(codes, dtype=np.int64)
+        # article of every reference edge
+        self.edge_articles: np.ndarray = np.repeat(np.arange(len(self.references), dtype=np.int64), lengths)
+
+        # inverted index: reference -> citing articles, also in CSR layout
+        order = np.argsort(self.codes, kind="stable")
+        self.citing_articles: np.ndarray = self.edge_articles[order]
+        self.citing_offsets: np.ndarray = np.zeros(len(self.reference_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.codes, minlength=len(self.reference_ids)), out=self.citing_offsets[1:])
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "CitationGraph":
+        """
+        Build the index from a loaded graph. Both the PubMedCite layout (dictionaries keyed by the position
+        as string) and the layout of the generated `available_*_graph.json` files (lists) are supported.
+
+        :param data: The graph with the keys PMCid, references and optionally pmid.
+        :type data: Dict
+        :return: The index.
+        :rtype: CitationGraph
+        """
+
+        def as_list(values: Union[Dict, List]) -> List:
+            if isinstance(values, dict):
+                return [values[key] for key in sorted(values, key=int)]
+            return list(values)
+
+        pmids = as_list(data["pmid"]) if "pmid" in data else None
+        return cls(as_list(data["PMCid"]), as_list(data["references"]), pmids)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[int, str, List[str]]]) -> "CitationGraph":
+        """
+        Build the index from the rows of a GraphReader, the articles are numbered in the order of the rows.
+
+        :param rows: (index, PMC id, references) of the articles.
+        :type rows: Iterable[Tuple[int, str, List[str]]]
+        :return: The index.
+        :rtype: CitationGraph
+        """
+        pmc_ids = []
+        references = []
+        for _, pmc_id, reference_list in rows:
+            pmc_ids.append(pmc_id)
+            references.append(reference_list)
+        return cls(pmc_ids, references)
+
+    @classmethod
+    def from_json(cls, path: str) -> "CitationGraph":
+        """
+        Load the index from a graph JSON file.
+
+        :param path: Path to the JSON file.
+        :type path: str
+        :return: The index.
+        :rtype: CitationGraph
+        """
+        with open(path, "r") as json_file:
+            return cls.from_dict(json.load(json_file))
+
+    def __len__(self) -> int:
+        return len(self.pmc_ids)
+
+    def citing(self, pm_id: str) -> List[int]:
+        """
+        Return the articles that cite a reference.
+
+        :param pm_id: The PMID of the reference.
+        :type pm_id: str
+        :return: The positions of the citing articles.
+        :rtype: List[int]
+        """
+        code = self.reference_codes.get(pm_id)
+        if code is None:
+            return []
+        return self.citing_articles[self.citing_offsets[code] : self.citing_offsets[code + 1]].tolist()
+
+    def reference_mask(self, available_references: Iterable[str]) -> np.ndarray:
+        """
+        Mark the available references in the vocabulary.
+
+        :param available_references: The PMIDs of the available references.
+        :type available_references: Iterable[str]
+        :return: Boolean array over the reference codes.
+        :rtype: np.ndarray
+        """
+        mask = np.zeros(len(self.reference_ids), dtype=bool)
+        codes = [self.reference_codes[pm_id] for pm_id in set(available_references) if pm_id in self.reference_codes]
+        mask[codes] = True
+        return mask
+
+    def complete_articles(self, available_references: Iterable[str]) -> np.ndarray:
+        """
+        Mark the articles whose references are all available, articles without references included.
+
+        :param available_references: The PMIDs of the available references.
+        :type available_references: Iterable[str]
+        :return: Boolean array over the articles.
+        :rtype: np.ndarray
+        """
+        missing = ~self.reference_mask(available_references)[self.codes]
+        num_missing = np.bincount(self.edge_articles[missing], minlength=len(self.pmc_ids))
+        return num_missing == 0
+
+    def select_available(
+        self, available_articles: Iterable[int], available_references: Iterable[str], num: Optional[int] = None
+    ) -> List[int]:
+        """
+        Select the first `num` available articles whose references are all available.
+
+        :param available_articles: The positions of the available articles.
+        :type available_articles: Iterable[int]
+        :param available_references: The PMIDs of the available references.
+        :type available_references: Iterable[str]
+        :param num: Maximum number of selected articles. Defaults to None (all).
+        :type num: Optional[int]
+        :return: The positions of the selected articles in ascending order.
+        :rtype: List[int]
+        """
+        mask = np.zeros(len(self.pmc_ids), dtype=bool)
+        mask[np.fromiter(available_articles, dtype=np.int64)] = True
+        mask &= self.complete_articles(available_references)
+        return np.flatnonzero(mask)[:num].tolist()
+
+
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+class _Scanner:
+    """
+    Incremental scanner over the bytes of a JSON file. The bytes are decoded as latin-1 chunk by chunk,
+    so that the character offsets are the byte offsets in the file; the values are only decoded to find
+    their end.
+    """
+
+    def __init__(self, data: Union[mmap.mmap, bytes], chunk_size: int) -> None:
+        self.data = data
+        self.size: int = len(data)
+        self.chunk_size: int = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer: str = ""
+        # file offset of the first character of the buffer
+        self.base: int = 0
+        self.index: int = 0
+
+    def _refill(self) -> bool:
+        end = self.base + len(self.buffer)
+        if end >= self.size:
+            return False
+        self.buffer = self.buffer[self.index :] + self.data[end : end + self.chunk_size].decode("latin-1")
+        self.base += self.index
+        self.index = 0
+        return True
+
+    def peek(self) -> str:
+        """
+        Skip whitespace and return the next character, "" at the end of the file.
+        """
+        while True:
+            self.index = _WHITESPACE.match(self.buffer, self.index).end()
+            if self.index < len(self.buffer):
+                return self.buffer[self.index]
+            if not self._refill():
+                return ""
+
+    def expect(self, character: str) -> None:
+        if self.peek() != character:
+            raise ValueError(f"Expected {character!r} at byte {self.base + self.index}")
+        self.index += 1
+
+    def skip(self, character: str) -> bool:
+        if self.peek() == character:
+            self.index += 1
+            return True
+        return False
+
+    def value(self) -> Tuple[object, int, int]:
+        """
+        Decode the next value.
+
+        :return: The value, its byte offset and its length in bytes.
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.index)
+            except json.JSONDecodeError:
+                # the value continues in the next chunk
+                if self._refill():
+                    continue
+                raise
+            if end >= len(self.buffer) and self._refill():
+                # a number may continue in the next chunk
+                continue
+            start = self.base + self.index
+            self.index = end
+            return value, start, self.base + end - start
+
+
+class GraphReader:
+    """
+    Streaming reader of PubMedCite graph files. The file is scanned once to build an index with the byte
+    offset and length of every entry of the top-level columns (PMCid, pmid, references), stored in arrays;
+    the entries are decoded from the memory-mapped file only when they are read.
+    Both the PubMedCite layout (dictionaries keyed by the position as string) and the layout of the generated
+    `available_*_graph.json` files (lists) are supported.
+    """
+
+    def __init__(self, path: str, index_path: Optional[str] = None, chunk_size: int = 1 << 20) -> None:
+        """
+        Open a graph file and build or load its index.
+
+        :param path: Path to the graph file.
+        :type path: str
+        :param index_path: Path to a .npz file in which the index is kept for the next run. It is rebuilt if
+            the graph file changed. Defaults to None (the index is built in memory).
+        :type index_path: Optional[str]
+        :param chunk_size: Number of bytes decoded at once while scanning. Defaults to 1 MB.
+        :type chunk_size: int
+        """
+        self.path: str = path
+        self.file = open(path, "rb")
+        stat = os.stat(path)
+        self.data: Union[mmap.mmap, bytes] = (
+            mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+        )
+        self.columns: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        signature = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        if index_path is not None and os.path.exists(index_path):
+            with np.load(index_path) as index:
+                if np.array_equal(index["signature"], signature):
+                    for key in index.files:
+                        if key.endswith(".offsets"):
+                            column = key[: -len(".offsets")]
+                            self.columns[column] = (index[key], index[column + ".lengths"])
+        if not self.columns:
+            self._build_index(chunk_size)
+            if index_path is not None:
+                arrays = {"signature": signature}
+                for column, (offsets, lengths) in self.columns.items():
+                    arrays[column + ".offsets"] = offsets
+                    arrays[column + ".lengths"] = lengths
+                with open(index_path + ".part", "wb") as index_file:
+                    np.savez(index_file, **arrays)
+                os.replace(index_path + ".part", index_path)
+        assert "PMCid" in self.columns and "references" in self.columns, f"{path} is not a graph file"
+
+    def _build_index(self, chunk_size: int) -> None:
+        scanner = _Scanner(self.data, chunk_size)
+        scanner.expect("{")
+        while not scanner.skip("}"):
+            column, _, _ = scanner.value()
+            scanner.expect(":")
+            keyed = scanner.peek() == "{"
+            if not keyed and scanner.peek() != "[":
+                scanner.value()
+            else:
+                closing = "}" if keyed else "]"
+                scanner.index += 1
+                positions, offsets, lengths = [], [], []
+                while not scanner.skip(closing):
+                    if keyed:
+                        key, _, _ = scanner.value()
+                        scanner.expect(":")
+                        positions.append(int(key))
+                    else:
+                        positions.append(len(positions))
+                    _, offset, length = scanner.value()
+                    offsets.append(offset)
+                    lengths.append(length)
+                    scanner.skip(",")
+                num = max(positions) + 1 if positions else 0
+                column_offsets = np.full(num, -1, dtype=np.int64)
+                column_lengths = np.zeros(num, dtype=np.int64)
+                column_offsets[positions] = offsets
+                column_lengths[positions] = lengths
+                self.columns[column] = (column_offsets, column_lengths)
+            scanner.skip(",")
+
+    def __len__(self) -> int:
+        return len(self.columns["PMCid"][0])
+
+    def get(self, column: str, index: int):
+        """
+        Decode an entry of a column.
+
+        :param column: The column, e.g. PMCid or references.
+        :type column: str
+        :param index: The position of the article.
+        :type index: int
+        :return: The entry.
+        """
+        offsets, lengths = self.columns[column]
+        offset = int(offsets[index])
+        if offset < 0:
+            raise KeyError(f"{column} has no entry {index}")
+        return json.loads(self.data[offset : offset + int(lengths[index])])
+
+    def row(self, index: int) -> Tuple[int, str, List[str]]:
+        """
+        Read an article.
+
+        :param index: The position of the article.
+        :type index: int
+        :return: The position, the PMC id and the references of the article.
+        :rtype: Tuple[int, str, List[str]]
+        """
+        return index, self.get("PMCid", index), self.get("references", index)
+
+    def rows(self, begin: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, str, List[str]]]:
+        """
+        Lazily read the articles in a range of positions.
+
+        :param begin: The first position. Defaults to 0.
+        :type begin: int
+        :param end: The position after the last one. Defaults to None (end of the file).
+        :type end: Optional[int]
+        :return: Iterator over (position, PMC id, references).
+        :rtype: Iterator[Tuple[int, str, List[str]]]
+        """
+        end = len(self) if end is None else min(end, len(self))
+        for index in range(begin, end):
+            yield self.row(index)
+
+    def select(self, indices: Sequence[int]) -> Tuple[List[str], List[List[str]]]:
+        """
+        Read the articles at the given positions.
+
+        :param indices: The positions.
+        :type indices: Sequence[int]
+        :return: The PMC ids and the references of the articles.
+        :rtype: Tuple[List[str], List[List[str]]]
+        """
+        rows = [self.row(index) for index in indices]
+        return [row[1] for row in rows], [row[2] for row in rows]
+
+    def close(self) -> None:
+        """
+        Close the mapping and the file.
+        """
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = b""
+        self.file.close()
+
+    def __enter__(self) -> "GraphReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -0,0 +1,181 @@
+# author: Jayce Ning
+
+import json
+import mmap
+import os
+import struct
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# every record is prefixed by its length as unsigned 32 bit little-endian integer
+LENGTH = struct.Struct("<I")
+
+
+def index_path_for(data_path: str) -> str:
+    """
+    Return the path of the offset index of a packed corpus.
+
+    :param data_path: Path to the data file.
+    :type data_path: str
+    :return: Path to the index file.
+    :rtype: str
+    """
+    return os.path.splitext(data_path)[0] + ".index.json"
+
+
+class PackedCorpusWriter:
+    """
+    Writes the processed articles and their references into one data file of length-prefixed JSON records
+    and an index from the PMC ids and PMIDs to the record offsets.
+    A reference that is cited by several articles is stored once and referenced by its PMID.
+    The files are written under temporary names and renamed when the writer is closed.
+    """
+
+    def __init__(self, data_path: str) -> None:
+        """
+        Initialize the writer.
+
+        :param data_path: Path to the data file, the index is stored next to it.
+        :type data_path: str
+        """
+        self.data_path: str = data_path
+        self.index_path: str = index_path_for(data_path)
+        os.makedirs(os.path.dirname(os.path.abspath(data_path)), exist_ok=True)
+        self.file = open(data_path + ".part", "wb")
+        self.offset: int = 0
+        self.articles: Dict[str, int] = {}
+        self.references: Dict[str, int] = {}
+
+    def _write(self, record: Dict) -> int:
+        payload = json.dumps(record, ensure_ascii=False).encode("utf-8")
+        offset = self.offset
+        self.file.write(LENGTH.pack(len(payload)))
+        self.file.write(payload)
+        self.offset += LENGTH.size + len(payload)
+        return offset
+
+    def add_reference(self, pm_id: str, title_text: str, abstract_text: str) -> None:
+        """
+        Add a reference, references that were added before are skipped.
+
+        :param pm_id: The PMID of the reference.
+        :type pm_id: str
+        :param title_text: The title of the reference.
+        :type title_text: str
+        :param abstract_text: The abstract of the reference.
+        :type abstract_text: str
+        """
+        if pm_id not in self.references:
+            self.references[pm_id] = self._write({"title_text": title_text, "abstract_text": abstract_text})
+
+    def add_article(self, pmc_id: str, article: Dict, references: List[str]) -> None:
+        """
+        Add an article.
+
+        :param pmc_id: The PMC id of the article.
+        :type pmc_id: str
+        :param article: The article with the keys article_title_text, abstract_text, introduction_text and sec_dict.
+        :type article: Dict
+        :param references: The PMIDs of the references of the article, they have to be added as well.
+        :type references: List[str]
+        """
+        assert all(pm_id in self.references for pm_id in references), "References have to be added first"
+        self.articles[pmc_id] = self._write({**article, "references": list(references)})
+
+    def close(self) -> None:
+        """
+        Finish the data file and write the index.
+        """
+        if self.file.closed:
+            return
+        self.file.close()
+        with open(self.index_path + ".part", "w") as json_file:
+            json.dump({"articles": self.articles, "references": self.references}, json_file)
+        os.replace(self.data_path + ".part", self.data_path)
+        os.replace(self.index_path + ".part", self.index_path)
+
+    def __enter__(self) -> "PackedCorpusWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class PackedCorpus:
+    """
+    Read-only view of a packed corpus. The data file is memory-mapped, so loading an article is a seek into
+    the mapping and processes reading the same corpus share the page cache. Records are decoded only when
+    they are accessed.
+    """
+
+    def __init__(self, data_path: str) -> None:
+        """
+        Open a packed corpus.
+
+        :param data_path: Path to the data file.
+        :type data_path: str
+        """
+        with open(index_path_for(data_path), "r") as json_file:
+            index = json.load(json_file)
+        self.articles: Dict[str, int] = index["articles"]
+        self.references: Dict[str, int] = index["references"]
+        self.file = open(data_path, "rb")
+        self.data: Optional[mmap.mmap] = (
+            mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(data_path) else None
+        )
+
+    def _read(self, offset: int) -> Dict:
+        (length,) = LENGTH.unpack_from(self.data, offset)
+        start = offset + LENGTH.size
+        return json.loads(self.data[start : start + length])
+
+    def __contains__(self, pmc_id: str) -> bool:
+        return pmc_id in self.articles
+
+    def __len__(self) -> int:
+        return len(self.articles)
+
+    def ids(self) -> Iterable[str]:
+        return self.articles.keys()
+
+    def reference(self, pm_id: str) -> Dict:
+        """
+        Load a reference.
+
+        :param pm_id: The PMID of the reference.
+        :type pm_id: str
+        :return: The reference with the keys title_text and abstract_text.
+        :rtype: Dict
+        """
+        return self._read(self.references[pm_id])
+
+    def article(self, pmc_id: str) -> Tuple[Dict, Dict]:
+        """
+        Load an article and its references, in the format of the per-article JSON files.
+
+        :param pmc_id: The PMC id of the article.
+        :type pmc_id: str
+        :return: The article with the keys article_title_text, abstract_text, introduction_text and sec_dict,
+            and the abstracts of the references keyed by their titles.
+        :rtype: Tuple[Dict, Dict]
+        """
+        article = self._read(self.articles[pmc_id])
+        reference_title_abstract_dict = {}
+        for pm_id in article.pop("references"):
+            reference = self.reference(pm_id)
+            reference_title_abstract_dict[reference["title_text"]] = reference["abstract_text"]
+        return article, reference_title_abstract_dict
+
+    def close(self) -> None:
+        """
+        Close the mapping and the data file.
+        """
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        self.file.close()
+
+    def __enter__(self) -> "PackedCorpus":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
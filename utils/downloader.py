@@ -0,0 +1,423 @@
+# author: Jayce Ning
+
+import logging
+import os
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+from .manifest import Manifest
+
+EFETCH_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi"
+# NCBI asks to POST requests with more than 200 ids
+MAX_GET_IDS = 200
+
+_pubmed_record = re.compile(
+    r"<(PubmedArticle|PubmedBookArticle)>.*?</\1>", re.DOTALL
+)
+_pmid = re.compile(r"<PMID[^>]*>\s*(\d+)\s*</PMID>")
+
+
+def split_pubmed_records(content: str) -> Dict[str, str]:
+    """
+    Function to split an efetch response of the pubmed database into its records.
+
+    :param content: The PubmedArticleSet returned by efetch.
+    :type content: str
+    :return: Each record as a standalone PubmedArticleSet document, keyed by its PMID.
+    :rtype: Dict[str, str]
+    """
+    records = {}
+    for match in _pubmed_record.finditer(content):
+        record = match.group(0)
+        # the first PMID is the one of the citation, later ones belong to comments and corrections
+        pmid = _pmid.search(record)
+        if pmid is not None:
+            records[pmid.group(1)] = (
+                '<?xml version="1.0" ?>\n<PubmedArticleSet>\n' + record + "\n</PubmedArticleSet>\n"
+            )
+    return records
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that limits the rate of requests.
+    NCBI E-utilities allow 3 requests per second without and 10 requests per second with an API key.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1.0) -> None:
+        """
+        Initialize the token bucket, it starts full.
+
+        :param rate: Number of tokens added per second.
+        :type rate: float
+        :param capacity: Maximum number of tokens, i.e. the size of a burst. Defaults to 1, so that no
+                         window of one second contains more than `rate` requests.
+        :type capacity: float
+        """
+        assert rate > 0, "The rate of the token bucket must be greater than zero"
+        self.rate: float = rate
+        self.capacity: float = capacity
+        self.tokens: float = self.capacity
+        self.updated: float = time.monotonic()
+        self.lock: threading.Lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Take a token, waiting until one is available.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Downloader:
+    """
+    Downloads records from the NCBI E-utilities efetch endpoint.
+    All requests share one pooled HTTP session and a token bucket, records are fetched concurrently
+    and failed requests are retried with exponential backoff up to a maximum number of attempts.
+    """
+
+    def __init__(
+        self,
+        base_url: str = EFETCH_URL,
+        requests_per_second: float = 3.0,
+        max_workers: int = 4,
+        max_retries: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 60.0,
+        timeout: float = 60.0,
+        api_key: Optional[str] = None,
+    ) -> None:
+        """
+        Initialize the downloader.
+
+        :param base_url: URL of the efetch endpoint. Defaults to the NCBI E-utilities.
+        :type base_url: str
+        :param requests_per_second: Maximum number of requests per second. Defaults to 3.
+        :type requests_per_second: float
+        :param max_workers: Number of concurrent requests. Defaults to 4.
+        :type max_workers: int
+        :param max_retries: Number of retries of a failed request. Defaults to 5.
+        :type max_retries: int
+        :param backoff_base: Delay before the first retry in seconds, doubled for every further retry. Defaults to 1.
+        :type backoff_base: float
+        :param backoff_max: Maximum delay between two attempts in seconds. Defaults to 60.
+        :type backoff_max: float
+        :param timeout: Timeout of a request in seconds. Defaults to 60.
+        :type timeout: float
+        :param api_key: NCBI API key, which allows higher request rates. Defaults to None.
+        :type api_key: Optional[str]
+        """
+        assert max_workers > 0, "The downloader needs at least one worker"
+        assert max_retries >= 0, "The number of retries must not be negative"
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.base_url: str = base_url
+        self.max_workers: int = max_workers
+        self.max_retries: int = max_retries
+        self.backoff_base: float = backoff_base
+        self.backoff_max: float = backoff_max
+        self.timeout: float = timeout
+        self.api_key: Optional[str] = api_key
+        self.bucket: TokenBucket = TokenBucket(requests_per_second)
+        self.session: requests.Session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.stats_lock: threading.Lock = threading.Lock()
+        self.num_requests: int = 0
+        self.num_bytes: int = 0
+
+    def fetch(self, db: str, ids: List[str]) -> str:
+        """
+        Fetch the records of the ids from a database, retrying failed requests.
+
+        :param db: The database, e.g. "pmc" or "pubmed".
+        :type db: str
+        :param ids: The ids of the records.
+        :type ids: List[str]
+        :return: The response text.
+        :rtype: str
+        :raises requests.RequestException: If the request still fails after the last retry.
+        """
+        params = {"db": db, "id": ",".join(ids)}
+        if self.api_key is not None:
+            params["api_key"] = self.api_key
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                if len(ids) > MAX_GET_IDS:
+                    response = self.session.post(
+                        self.base_url, data=params, timeout=self.timeout
+                    )
+                else:
+                    response = self.session.get(
+                        self.base_url, params=params, timeout=self.timeout
+                    )
+                response.raise_for_status()
+                content = response.text
+                with self.stats_lock:
+                    self.num_requests += 1
+                    self.num_bytes += len(response.content)
+                return content
+            except requests.RequestException as e:
+                with self.stats_lock:
+                    self.num_requests += 1
+                # client errors other than rate limiting do not go away by retrying
+                status = e.response.status_code if e.response is not None else None
+                retryable = status is None or status == 429 or status >= 500
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * 2**attempt)
+                # jitter, so concurrent retries do not hit the server at the same time
+                delay *= random.uniform(0.5, 1.0)
+                self.logger.warning(
+                    f"Error while fetching {db} {self._describe(ids)}: {e}, retrying in {delay:.1f}s"
+                )
+                time.sleep(delay)
+                attempt += 1
+
+    @staticmethod
+    def save(
+        db: str,
+        record_id: str,
+        content: str,
+        save_path: str,
+        manifest: Optional[Manifest] = None,
+    ) -> None:
+        """
+        Save a record as "<save_path>/<record_id>.html" and record it in the manifest.
+        The file is replaced atomically, so an interrupted run never leaves a truncated record behind.
+
+        :param db: The database of the record.
+        :type db: str
+        :param record_id: The id of the record.
+        :type record_id: str
+        :param content: The content of the record.
+        :type content: str
+        :param save_path: The directory of the downloaded records.
+        :type save_path: str
+        :param manifest: The manifest of the download. Defaults to None.
+        :type manifest: Optional[Manifest]
+        """
+        path = os.path.join(save_path, f"{record_id}.html")
+        data = content.encode("utf-8")
+        with open(path + ".part", "wb") as file:
+            file.write(data)
+        os.replace(path + ".part", path)
+        if manifest is not None:
+            manifest.record_done(db, record_id, path, data)
+
+    def download_one(
+        self, db: str, record_id: str, save_path: str, manifest: Optional[Manifest] = None
+    ) -> bool:
+        """
+        Download a record and save it as "<save_path>/<record_id>.html".
+
+        :param db: The database, e.g. "pmc" or "pubmed".
+        :type db: str
+        :param record_id: The id of the record.
+        :type record_id: str
+        :param save_path: The directory of the downloaded records.
+        :type save_path: str
+        :param manifest: The manifest of the download. Defaults to None.
+        :type manifest: Optional[Manifest]
+        :return: Whether the record was downloaded.
+        :rtype: bool
+        """
+        try:
+            content = self.fetch(db, [record_id])
+        except requests.RequestException as e:
+            self.logger.error(f"Error occurred while downloading article {record_id}: {e}")
+            if manifest is not None:
+                manifest.record_failed(db, record_id, str(e))
+            return False
+        self.save(db, record_id, content, save_path, manifest)
+        return True
+
+    def download_batch(
+        self, ids: List[str], save_path: str, manifest: Optional[Manifest] = None
+    ) -> Dict[str, bool]:
+        """
+        Download pubmed records with one request and save each as "<save_path>/<pmid>.html".
+        Records missing in the response are requested once more individually.
+
+        :param ids: The PMIDs of the records.
+        :type ids: List[str]
+        :param save_path: The directory of the downloaded records.
+        :type save_path: str
+        :param manifest: The manifest of the download. Defaults to None.
+        :type manifest: Optional[Manifest]
+        :return: Whether each record was downloaded.
+        :rtype: Dict[str, bool]
+        """
+        try:
+            records = split_pubmed_records(self.fetch("pubmed", ids))
+        except requests.RequestException as e:
+            self.logger.error(f"Error occurred while downloading articles {self._describe(ids)}: {e}")
+            if manifest is not None:
+                for record_id in ids:
+                    manifest.record_failed("pubmed", record_id, str(e))
+            return {record_id: False for record_id in ids}
+        missing = [record_id for record_id in ids if record_id not in records]
+        for record_id in missing:
+            self.logger.warning(f"Article {record_id} missing in the batch response, requesting it individually")
+            try:
+                records.update(split_pubmed_records(self.fetch("pubmed", [record_id])))
+            except requests.RequestException as e:
+                self.logger.error(f"Error occurred while downloading article {record_id}: {e}")
+        results = {}
+        for record_id in ids:
+            results[record_id] = record_id in records
+            if results[record_id]:
+                self.save("pubmed", record_id, records[record_id], save_path, manifest)
+            else:
+                self.logger.error(f"Article {record_id} is not available")
+                if manifest is not None:
+                    manifest.record_failed("pubmed", record_id, "missing in the response")
+        return results
+
+    def download(
+        self,
+        db: str,
+        ids: Iterable[str],
+        save_path: str,
+        desc: str = "Downloading articles",
+        batch_size: int = 1,
+        manifest: Optional[Manifest] = None,
+    ) -> Dict[str, bool]:
+        """
+        Download records concurrently, show the progress and log the throughput.
+        With a batch size greater than one, each request fetches a batch of pubmed records.
+        With a manifest, records that were completely downloaded before are skipped.
+
+        :param db: The database, e.g. "pmc" or "pubmed".
+        :type db: str
+        :param ids: The ids of the records.
+        :type ids: Iterable[str]
+        :param save_path: The directory of the downloaded records, it is created if necessary.
+        :type save_path: str
+        :param desc: Description of the progress bar. Defaults to "Downloading articles".
+        :type desc: str
+        :param batch_size: Number of records per request. Defaults to 1.
+        :type batch_size: int
+        :param manifest: The manifest recording the downloaded records. Defaults to None.
+        :type manifest: Optional[Manifest]
+        :return: Whether each record was downloaded.
+        :rtype: Dict[str, bool]
+        :raises AssertionError: If records of other databases than pubmed are requested in batches.
+        """
+        assert batch_size > 0, "The batch size must be greater than zero"
+        assert (
+            batch_size == 1 or db == "pubmed"
+        ), "Only pubmed records can be downloaded in batches"
+        os.makedirs(save_path, exist_ok=True)
+        ids = list(dict.fromkeys(ids))
+        results = {}
+        skipped = {}
+        if manifest is not None:
+            for record_id in ids:
+                if manifest.is_complete(db, record_id):
+                    skipped[record_id] = True
+            if len(skipped) > 0:
+                self.logger.info(f"Skipping {len(skipped)} records downloaded before")
+            ids = [record_id for record_id in ids if record_id not in skipped]
+        start_time = time.time()
+        start_requests, start_bytes = self.num_requests, self.num_bytes
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            if batch_size == 1:
+                futures = {
+                    pool.submit(
+                        self.download_one, db, record_id, save_path, manifest
+                    ): [record_id]
+                    for record_id in ids
+                }
+            else:
+                futures = {
+                    pool.submit(self.download_batch, batch, save_path, manifest): batch
+                    for batch in (
+                        ids[i : i + batch_size] for i in range(0, len(ids), batch_size)
+                    )
+                }
+            with tqdm(total=len(ids), desc=desc) as progress:
+                for future in as_completed(futures):
+                    batch = futures[future]
+                    if batch_size == 1:
+                        results[batch[0]] = future.result()
+                    else:
+                        results.update(future.result())
+                    progress.update(len(batch))
+                    elapsed = max(time.time() - start_time, 1e-9)
+                    progress.set_postfix(
+                        records_per_s=f"{progress.n / elapsed:.2f}",
+                        kb_per_s=f"{(self.num_bytes - start_bytes) / 1024 / elapsed:.1f}",
+                    )
+        self.log_throughput(
+            results, time.time() - start_time, start_requests, start_bytes
+        )
+        return {**skipped, **results}
+
+    @staticmethod
+    def _describe(ids: List[str]) -> str:
+        """
+        Describe the requested ids in log messages.
+
+        :param ids: The ids of the records.
+        :type ids: List[str]
+        :return: The ids, or the first id and their number for large batches.
+        :rtype: str
+        """
+        if len(ids) <= 3:
+            return ",".join(ids)
+        return f"{ids[0]},... ({len(ids)} ids)"
+
+    def log_throughput(
+        self,
+        results: Dict[str, bool],
+        elapsed: float,
+        start_requests: int,
+        start_bytes: int,
+    ) -> None:
+        """
+        Log the number of downloaded records, requests and bytes and the throughput of a download.
+
+        :param results: Whether each record was downloaded.
+        :type results: Dict[str, bool]
+        :param elapsed: Duration of the download in seconds.
+        :type elapsed: float
+        :param start_requests: Number of requests before the download.
+        :type start_requests: int
+        :param start_bytes: Number of downloaded bytes before the download.
+        :type start_bytes: int
+        """
+        elapsed = max(elapsed, 1e-9)
+        downloaded = sum(results.values())
+        num_bytes = self.num_bytes - start_bytes
+        self.logger.info(
+            f"Downloaded {downloaded}/{len(results)} records with {self.num_requests - start_requests} requests "
+            f"and {num_bytes} bytes in {elapsed:.1f}s "
+            f"({downloaded / elapsed:.2f} records/s, {num_bytes / 1024 / elapsed:.1f} KB/s)"
+        )
+
+    def close(self) -> None:
+        """
+        Close the HTTP session.
+        """
+        self.session.close()
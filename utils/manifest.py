@@ -0,0 +1,182 @@
+# author: Jayce Ning
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+
+class Manifest:
+    """
+    Append-only JSONL manifest of downloaded records, so that an interrupted download can be resumed.
+    Every line records the status, byte size, SHA-256 hash and fetch time of a record;
+    the last line of a record overrides the earlier ones.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Initialize the manifest and load the existing entries.
+
+        :param path: Path to the JSONL file, it is created if necessary.
+        :type path: str
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.path: str = path
+        self.lock: threading.Lock = threading.Lock()
+        self.entries: Dict[Tuple[str, str], Dict] = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if os.path.exists(path):
+            with open(path, "rb+") as file:
+                content = file.read()
+                if len(content) > 0 and not content.endswith(b"\n"):
+                    # the last line of an interrupted run is incomplete, it is cut off so that the next
+                    # entry is not appended to it
+                    content = content[: content.rfind(b"\n") + 1]
+                    file.truncate(len(content))
+                    self.logger.warning(f"Removed the incomplete last line of {path}")
+            for line in content.decode("utf-8").splitlines():
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.entries[(entry["db"], entry["id"])] = entry
+
+    @staticmethod
+    def hash_bytes(content: bytes) -> str:
+        """
+        Hash the content of a record.
+
+        :param content: The content.
+        :type content: bytes
+        :return: The SHA-256 hex digest.
+        :rtype: str
+        """
+        return hashlib.sha256(content).hexdigest()
+
+    def get(self, db: str, record_id: str) -> Optional[Dict]:
+        """
+        Return the entry of a record.
+
+        :param db: The database of the record.
+        :type db: str
+        :param record_id: The id of the record.
+        :type record_id: str
+        :return: The entry or None if the record is not in the manifest.
+        :rtype: Optional[Dict]
+        """
+        with self.lock:
+            return self.entries.get((db, record_id))
+
+    def is_complete(self, db: str, record_id: str) -> bool:
+        """
+        Check if a record was downloaded and its file still has the recorded size.
+
+        :param db: The database of the record.
+        :type db: str
+        :param record_id: The id of the record.
+        :type record_id: str
+        :return: Whether the record does not need to be downloaded again.
+        :rtype: bool
+        """
+        entry = self.get(db, record_id)
+        if entry is None or entry["status"] != "done":
+            return False
+        try:
+            return os.path.getsize(entry["path"]) == entry["size"]
+        except OSError:
+            return False
+
+    def _append(self, entry: Dict) -> None:
+        """
+        Store an entry and append it to the file.
+
+        :param entry: The entry.
+        :type entry: Dict
+        """
+        with self.lock:
+            self.entries[(entry["db"], entry["id"])] = entry
+            with open(self.path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def record_done(self, db: str, record_id: str, path: str, content: bytes) -> None:
+        """
+        Record a downloaded record.
+
+        :param db: The database of the record.
+        :type db: str
+        :param record_id: The id of the record.
+        :type record_id: str
+        :param path: Path to the saved record.
+        :type path: str
+        :param content: The saved content.
+        :type content: bytes
+        """
+        self._append(
+            {
+                "db": db,
+                "id": record_id,
+                "status": "done",
+                "path": path,
+                "size": len(content),
+                "sha256": self.hash_bytes(content),
+                "fetched_at": time.time(),
+            }
+        )
+
+    def record_failed(self, db: str, record_id: str, error: str) -> None:
+        """
+        Record a record whose download failed.
+
+        :param db: The database of the record.
+        :type db: str
+        :param record_id: The id of the record.
+        :type record_id: str
+        :param error: Description of the error.
+        :type error: str
+        """
+        self._append(
+            {
+                "db": db,
+                "id": record_id,
+                "status": "failed",
+                "error": error,
+                "fetched_at": time.time(),
+            }
+        )
+
+    def verify(self, db: Optional[str] = None, ids: Optional[Iterable[str]] = None) -> List[str]:
+        """
+        Re-hash the files of the completed records and mark the missing, truncated or modified ones as failed.
+
+        :param db: Only verify records of this database. Defaults to None (all databases).
+        :type db: Optional[str]
+        :param ids: Only verify these ids. Defaults to None (all records).
+        :type ids: Optional[Iterable[str]]
+        :return: The ids of the records that have to be downloaded again.
+        :rtype: List[str]
+        """
+        ids = set(ids) if ids is not None else None
+        with self.lock:
+            entries = [
+                entry
+                for entry in self.entries.values()
+                if entry["status"] == "done"
+                and (db is None or entry["db"] == db)
+                and (ids is None or entry["id"] in ids)
+            ]
+        invalid = []
+        for entry in entries:
+            try:
+                with open(entry["path"], "rb") as file:
+                    content = file.read()
+            except OSError:
+                content = None
+            if content is None or len(content) != entry["size"] or self.hash_bytes(content) != entry["sha256"]:
+                self.logger.warning(f"Record {entry['db']} {entry['id']} failed verification")
+                self.record_failed(entry["db"], entry["id"], "verification failed")
+                invalid.append(entry["id"])
+        self.logger.info(f"Verified {len(entries)} records, {len(invalid)} invalid")
+        return invalid
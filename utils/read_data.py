@@ -1,105 +1,259 @@
+import io
+import xml.etree.ElementTree as ET
+from typing import Dict, List
+
 from bs4 import BeautifulSoup
 
-def read_pmc(path):
-    article_title_text = ''
-    abstract_text = ''
-    # 打开并读取HTML文件
-    with open(path, 'r', encoding='utf-8') as file:
-        html_content = file.read()
+# titles of the sections that are extracted from the articles
+SECTION_TITLES = [
+    'Results', 'Discussion', 'Materials and Methods', 'Materials and methods', 'Methods',
+    'Background', 'Statistical analysis', 'Conclusions', 'DISCUSSION', 'RESULTS', 'RESULTS',
+    'RESULTS', 'Conclusion', 'Statistical Analysis', 'Results and Discussion',
+    'Results and discussion', 'Methodology/Principal Findings', 'Statistics',
+    'Statistical analysis', 'Conclusions/Significance', 'RESULTS AND DISCUSSION',
+    'Statistical analyses', 'METHODS', 'Materials', 'Statistics', 'Results:', 'Data analysis',
+    'Results/Discussion', 'Background', 'Methods Summary', 'Statistical Analyses', 'Methods:',
+    'Concluding Remarks', 'CONCLUSIONS', 'Conclusion:', 'CONCLUSION', 'Data Analysis', 'Summary',
+    'Findings', 'Material and Methods', 'Statistical analyses.', 'Patients and methods',
+    'Material and methods', 'Principal Findings', 'Constructs', 'Conclusion/Significance',
+    'Author contributions', 'METHODS SUMMARY', 'Study Design', 'Background.',
+    'Patients and Methods', 'Objective', 'Author Contributions', '3. Results', '3. Results',
+    'Statistical Methods', 'RESEARCH DESIGN AND METHODS', 'Outcomes', 'Implementation', 'Purpose',
+    'Significance', 'Experimental design', '2. Materials and Methods', 'OBJECTIVE', 'Materials.',
+    'Methodology', '2 METHODS', 'Methodology and Principal Findings', 'Data analysis.', 'Analysis',
+    '3 RESULTS', 'Method', 'discussion', 'Concluding Remarks.',
+]
+INTRODUCTION_TITLES = ['Introduction', 'INTRODUCTION', '1. Introduction', '1 INTRODUCTION', 'introduction']
 
-    # 使用Beautiful Soup解析HTML内容
-    soup = BeautifulSoup(html_content, "html.parser")
+def _local_name(tag: str) -> str:
+    """
+    Return the lowercased tag name without namespace, as the tags are named by BeautifulSoup.
+    """
+    return tag.rsplit("}", 1)[-1].lower()
 
-    # 查找<title-group>标签
-    title_group_tag = soup.find("title-group")
 
-    # 如果找到了<title-group>标签
+def _text(element: ET.Element) -> str:
+    """
+    Return the text of an element including its descendants, like the `.text` of BeautifulSoup.
+    """
+    return "".join(element.itertext())
+
+
+def _pmc_record(title, abstract, has_abstract, sections) -> Dict:
+    """
+    Build the record of a PMC article from the extracted parts.
+
+    :param title: The article title, None if it was not found.
+    :param abstract: The abstract, None if it was not found.
+    :param has_abstract: Whether the article has an <abstract> tag.
+    :param sections: (title, text) of every <sec> in document order.
+    :return: The record.
+    :rtype: Dict
+    """
+    sec_dict = {}
+    introduction_text = ''
+    has_introduction = False
+    for sec_title, sec_text in sections:
+        if sec_title in SECTION_TITLES:
+            sec_dict[sec_title] = sec_text
+        if sec_title in INTRODUCTION_TITLES:
+            introduction_text = sec_text
+            has_introduction = True
+    return {
+        'article_title_text': title or '',
+        'abstract_text': abstract or '',
+        'introduction_text': introduction_text,
+        'sec_dict': sec_dict,
+        'has_title': title is not None,
+        'has_abstract': has_abstract,
+        'has_introduction': has_introduction,
+        # 有引言章节和摘要标签的文章才可用
+        'available': has_introduction and has_abstract,
+    }
+
+
+def _extract_pmc_soup(content: bytes) -> Dict:
+    """
+    Extract a PMC article with BeautifulSoup, used for documents that are not well-formed XML.
+    """
+    soup = BeautifulSoup(content.decode('utf-8'), "html.parser")
+    title = None
+    title_group_tag = soup.find("title-group")
     if title_group_tag:
-        # 查找<article-title>标签
         article_title_tag = title_group_tag.find("article-title")
-        
-        # 如果找到了<article-title>标签
         if article_title_tag:
-            # 提取<article-title>标签中的文本内容
-            article_title_text = article_title_tag.text
-            # print("Article Title:", article_title_text)
-        else:
-            print("No <article-title> tag found inside <title-group>.")
-    else:
-        print("No <title-group> tag found in the HTML content.")
-
-    # 查找<abstract>标签
+            title = article_title_tag.text
     abstract_tag = soup.find("abstract")
+    sections = []
+    for tag in soup.find_all("sec"):
+        title_tag = tag.find("title")
+        if title_tag:
+            sections.append((title_tag.text, tag.text))
+    return _pmc_record(title, abstract_tag.text if abstract_tag else None, abstract_tag is not None, sections)
 
-    # 提取<abstract>标签中的文本内容
-    if abstract_tag:
-        abstract_text = abstract_tag.text
-        # print("Abstract:", abstract_text)
-    else:
-        print("Abstract tag not found in the HTML content.")
 
-    sec_tag = soup.find_all("sec")
+def _extract_pmc_xml(content: bytes) -> Dict:
+    """
+    Extract a PMC article in a single pass with an incremental XML parser.
+    Only the title group, the abstract and the sections are kept in memory, all other elements are
+    released as soon as they are parsed.
+    """
+    title = None
+    abstract = None
+    has_abstract = False
+    title_group = None
+    in_title_group = False
+    # [sec, first descendant <title>, text] of every <sec> in document order
+    sections: List[List] = []
+    open_sections: List[List] = []
+    keep = 0
+    for event, element in ET.iterparse(io.BytesIO(content), events=("start", "end")):
+        tag = _local_name(element.tag)
+        if event == "start":
+            if tag == "sec":
+                section = [element, None, None]
+                sections.append(section)
+                open_sections.append(section)
+                keep += 1
+            elif tag == "title":
+                for section in open_sections:
+                    if section[1] is None:
+                        section[1] = element
+            elif tag == "abstract" and not has_abstract:
+                has_abstract = True
+                abstract = element
+                keep += 1
+            elif tag == "title-group" and title_group is None:
+                title_group = element
+                in_title_group = True
+                keep += 1
+            elif tag == "article-title" and title is None and in_title_group:
+                title = element
+            continue
 
-    sec_dict = {}
-    introduction_text = ''
-    # 如果找到了<sec>标签
-    if sec_tag:
-        #print(len(sec_tag))
-        # 查找<title>标签
-        for tag in sec_tag:
-            title_tag = tag.find("title")
-            if title_tag:
-                if title_tag.text in ['Results', 'Discussion', 'Materials and Methods', 'Materials and methods', 'Methods', 
-                                'Background', 'Statistical analysis', 'Conclusions', 'DISCUSSION', 'RESULTS',
-                                'RESULTS', 'RESULTS', 'Conclusion', 'Statistical Analysis', 'Results and Discussion',
-                                'Results and discussion', 'Methodology/Principal Findings', 'Statistics', 
-                                'Statistical analysis', 'Conclusions/Significance', 'RESULTS AND DISCUSSION', 
-                                'Statistical analyses', 'METHODS', 'Materials', 'Statistics', 'Results:', 
-                                'Data analysis', 'Results/Discussion', 'Background', 'Methods Summary',
-                                'Statistical Analyses', 'Methods:', 'Concluding Remarks', 'CONCLUSIONS',
-                                'Conclusion:', 'CONCLUSION', 'Data Analysis', 'Summary', 'Findings',
-                                'Material and Methods', 'Statistical analyses.', 'Patients and methods',
-                                'Material and methods', 'Principal Findings', 'Constructs', 'Conclusion/Significance',
-                                'Author contributions', 'METHODS SUMMARY', 'Study Design', 'Background.',
-                                'Patients and Methods', 'Objective', 'Author Contributions', '3. Results',
-                                '3. Results', 'Statistical Methods', 'RESEARCH DESIGN AND METHODS',
-                                'Outcomes', 'Implementation', 'Purpose', 'Significance', 'Experimental design',
-                                '2. Materials and Methods', 'OBJECTIVE', 'Materials.', 'Methodology',
-                                '2 METHODS', 'Methodology and Principal Findings', 'Data analysis.',
-                                 'Analysis', '3 RESULTS', 'Method', 'discussion', 'Concluding Remarks.']:
-                    sec_dict[title_tag.text] = tag.text
-                if title_tag.text in ['Introduction', 'INTRODUCTION', '1. Introduction', '1 INTRODUCTION', 'introduction']:
-                    introduction_text = tag.text
-    else:
-        print("No <sec> tag with sec-type='intro' found in the HTML content.")
-    
-    return article_title_text, abstract_text, introduction_text, sec_dict
+        if element is abstract:
+            abstract = _text(element)
+            keep -= 1
+        elif element is title_group:
+            in_title_group = False
+            if title is not None:
+                title = _text(title)
+            keep -= 1
+        elif tag == "sec":
+            section = open_sections.pop()
+            section[2] = _text(element) if section[1] is not None else None
+            section[1] = _text(section[1]) if section[1] is not None else None
+            keep -= 1
+        if not keep:
+            element.clear()
+    if isinstance(abstract, ET.Element):
+        abstract = _text(abstract)
+    return _pmc_record(title, abstract, has_abstract,
+                       [(section[1], section[2]) for section in sections if section[1] is not None])
 
-def read_pm(path):
-    # 打开并读取HTML文件
-    with open(path, 'r', encoding='utf-8') as file:
-        html_content = file.read()
 
-    # 使用Beautiful Soup解析HTML内容
-    soup = BeautifulSoup(html_content, "html.parser")
+def extract_pmc(path: str) -> Dict:
+    """
+    Parse a downloaded PMC article once and extract everything the corpus preparation needs.
+
+    :param path: Path to the article.
+    :type path: str
+    :return: The record with the keys article_title_text, abstract_text, introduction_text, sec_dict,
+        has_title, has_abstract, has_introduction and available.
+    :rtype: Dict
+    """
+    with open(path, 'rb') as file:
+        content = file.read()
+    try:
+        return _extract_pmc_xml(content)
+    except ET.ParseError:
+        # 例如包含未定义的实体，改用BeautifulSoup解析
+        return _extract_pmc_soup(content)
+
 
-    # 查找<title>标签
-    title_tags = soup.find_all("articletitle")
+def _pm_record(title, abstract) -> Dict:
+    """
+    Build the record of a PubMed reference from its title and abstract, None if they were not found.
+    """
+    return {
+        'title_text': title or '',
+        'abstract_text': abstract or '',
+        'has_title': title is not None,
+        'has_abstract': abstract is not None,
+        # 有标题和摘要标签的参考文献才可用
+        'available': title is not None and abstract is not None,
+    }
 
-    # 提取<title>标签中的文本内容
-    title_text = ''
-    for title_tag in title_tags:
-        title_text = title_tag.text
 
-    # 查找<abstract>标签
+def _extract_pm_soup(content: bytes) -> Dict:
+    """
+    Extract a PubMed record with BeautifulSoup, used for documents that are not well-formed XML.
+    """
+    soup = BeautifulSoup(content.decode('utf-8'), "html.parser")
+    title = None
+    for title_tag in soup.find_all("articletitle"):
+        title = title_tag.text
     abstract_tag = soup.find("abstract")
+    return _pm_record(title, abstract_tag.text if abstract_tag else None)
+
+
+def _extract_pm_xml(content: bytes) -> Dict:
+    """
+    Extract a PubMed record in a single pass with an incremental XML parser.
+    """
+    title = None
+    abstract = None
+    abstract_element = None
+    depth = 0
+    for event, element in ET.iterparse(io.BytesIO(content), events=("start", "end")):
+        tag = _local_name(element.tag)
+        if event == "start":
+            if tag == "abstract" and abstract_element is None:
+                abstract_element = element
+            if tag in ("abstract", "articletitle"):
+                depth += 1
+            continue
+        if tag == "articletitle":
+            # 与read_pm一致，使用最后一个标题
+            title = _text(element)
+            depth -= 1
+        elif element is abstract_element:
+            abstract = _text(element)
+            depth -= 1
+        elif tag == "abstract":
+            depth -= 1
+        if not depth:
+            element.clear()
+    return _pm_record(title, abstract)
+
 
-    # 提取<abstract>标签中的文本内容
-    abstract_text = ''
-    if abstract_tag:
-        abstract_text = abstract_tag.text
-        # print("Abstract:", abstract_text)
-    else:
+def extract_pm(path: str) -> Dict:
+    """
+    Parse a downloaded PubMed reference once and extract its title and abstract.
+
+    :param path: Path to the reference.
+    :type path: str
+    :return: The record with the keys title_text, abstract_text, has_title, has_abstract and available.
+    :rtype: Dict
+    """
+    with open(path, 'rb') as file:
+        content = file.read()
+    try:
+        return _extract_pm_xml(content)
+    except ET.ParseError:
+        return _extract_pm_soup(content)
+
+
+def read_pmc(path):
+    record = extract_pmc(path)
+    if not record['has_title']:
+        print("No <article-title> tag found inside <title-group>.")
+    if not record['has_abstract']:
         print("Abstract tag not found in the HTML content.")
+    return record['article_title_text'], record['abstract_text'], record['introduction_text'], record['sec_dict']
 
-    return title_text, abstract_text
\ No newline at end of file
+def read_pm(path):
+    record = extract_pm(path)
+    if not record['has_abstract']:
+        print("Abstract tag not found in the HTML content.")
+    return record['title_text'], record['abstract_text']
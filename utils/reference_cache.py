@@ -0,0 +1,212 @@
+# author: Jayce Ning
+
+import json
+import logging
+import os
+import re
+import threading
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+from .tokenizer import get_encoding_for_model
+
+
+class ReferenceEntry:
+    """
+    A reference of the corpus with its prompt block, the tokens of the block and optionally a one-sentence
+    summary that replaces the abstract in the prompts.
+    """
+
+    def __init__(self, pm_id: str, title: str, abstract: str) -> None:
+        self.pm_id: str = pm_id
+        self.title: str = title
+        self.abstract: str = abstract
+        self.block: str = "<title>" + title + "</title>" + "<abstract>" + abstract + "</abstract>"
+        self.tokens: Optional[array] = None
+        self.summary: Optional[str] = None
+        self.summary_block: Optional[str] = None
+        self.summary_tokens: Optional[array] = None
+        self.lock: threading.Lock = threading.Lock()
+
+    def set_summary(self, summary: str) -> None:
+        self.summary = summary
+        self.summary_block = "<title>" + self.title + "</title>" + "<abstract>" + summary + "</abstract>"
+        self.summary_tokens = None
+
+
+class ReferenceCache:
+    """
+    Corpus-level cache of the references keyed by their PMID. Many articles of PubMedCite cite the same
+    references, their prompt blocks are built and tokenised once and shared by all citing articles.
+    The references can be compressed once to a one-sentence summary by the LM, the summaries can be saved
+    and loaded to reuse them in later runs.
+    """
+
+    summary_prompt = """Summarize the following abstract of a scientific article in one sentence. Output the sentence between the tags <Summary> and </Summary>.
+<title>{title}</title>
+<abstract>{abstract}</abstract>
+"""
+
+    def __init__(self, model_name: str = "gpt-3.5-turbo") -> None:
+        """
+        Initialize the cache.
+
+        :param model_name: Name of the model whose tokenizer counts the tokens. Defaults to "gpt-3.5-turbo".
+        :type model_name: str
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.model_name: str = model_name
+        self.entries: Dict[str, ReferenceEntry] = {}
+        self.saved_summaries: Dict[str, str] = {}
+        self.lock: threading.Lock = threading.Lock()
+
+    def add(self, pm_id: str, title: str, abstract: str) -> ReferenceEntry:
+        """
+        Add a reference, a reference that is already in the cache is kept.
+
+        :param pm_id: The PMID of the reference.
+        :type pm_id: str
+        :param title: The title of the reference.
+        :type title: str
+        :param abstract: The abstract of the reference.
+        :type abstract: str
+        :return: The entry of the reference.
+        :rtype: ReferenceEntry
+        """
+        with self.lock:
+            entry = self.entries.get(pm_id)
+            if entry is None:
+                entry = ReferenceEntry(pm_id, title, abstract)
+                if pm_id in self.saved_summaries:
+                    entry.set_summary(self.saved_summaries[pm_id])
+                self.entries[pm_id] = entry
+            return entry
+
+    def add_article(self, pm_ids: Sequence[str], reference_info: Dict[str, str]) -> Optional[List[str]]:
+        """
+        Add the references of an article, given as the abstracts keyed by the titles.
+
+        :param pm_ids: The PMIDs of the references in the order of `reference_info`.
+        :type pm_ids: Sequence[str]
+        :param reference_info: The abstracts of the references keyed by their titles.
+        :type reference_info: Dict[str, str]
+        :return: The PMIDs, None if they do not match the references (e.g. references with the same title).
+        :rtype: Optional[List[str]]
+        """
+        if len(pm_ids) != len(reference_info):
+            return None
+        for pm_id, (title, abstract) in zip(pm_ids, reference_info.items()):
+            self.add(pm_id, title, abstract)
+        return list(pm_ids)
+
+    def _tokens(self, entry: ReferenceEntry, use_summary: bool) -> array:
+        encoding = get_encoding_for_model(self.model_name)
+        with entry.lock:
+            if use_summary and entry.summary is not None:
+                if entry.summary_tokens is None:
+                    entry.summary_tokens = array("I", encoding.encode(entry.summary_block))
+                return entry.summary_tokens
+            if entry.tokens is None:
+                entry.tokens = array("I", encoding.encode(entry.block))
+            return entry.tokens
+
+    def block(self, pm_ids: Sequence[str], use_summaries: bool = False) -> str:
+        """
+        Return the <reference> block of the prompts for a list of references.
+
+        :param pm_ids: The PMIDs of the references.
+        :type pm_ids: Sequence[str]
+        :param use_summaries: Whether the summaries replace the abstracts. Defaults to False.
+        :type use_summaries: bool
+        :return: The block, empty if there are no references.
+        :rtype: str
+        """
+        if len(pm_ids) == 0:
+            return ""
+        blocks = []
+        for pm_id in pm_ids:
+            entry = self.entries[pm_id]
+            if use_summaries and entry.summary is not None:
+                blocks.append(entry.summary_block)
+            else:
+                blocks.append(entry.block)
+        return "<reference>" + "".join(blocks) + "</reference>"
+
+    def num_tokens(self, pm_ids: Sequence[str], use_summaries: bool = False) -> int:
+        """
+        Return the number of tokens of the references, each reference is tokenised only once.
+
+        :param pm_ids: The PMIDs of the references.
+        :type pm_ids: Sequence[str]
+        :param use_summaries: Whether the summaries replace the abstracts. Defaults to False.
+        :type use_summaries: bool
+        :return: The number of tokens of the blocks of the references.
+        :rtype: int
+        """
+        return sum(len(self._tokens(self.entries[pm_id], use_summaries)) for pm_id in pm_ids)
+
+    def summarize(self, lm, pm_ids: Sequence[str]) -> int:
+        """
+        Let the LM summarize the references that have no summary yet.
+
+        :param lm: The language model.
+        :type lm: AbstractLanguageModel
+        :param pm_ids: The PMIDs of the references.
+        :type pm_ids: Sequence[str]
+        :return: Number of references that were summarized.
+        :rtype: int
+        """
+        num_summarized = 0
+        for pm_id in pm_ids:
+            entry = self.entries[pm_id]
+            # the lock ensures that concurrent articles citing the same reference summarize it only once
+            with entry.lock:
+                if entry.summary is not None:
+                    continue
+                try:
+                    response = lm.get_response_texts(
+                        lm.query(self.summary_prompt.format(title=entry.title, abstract=entry.abstract), num_responses=1)
+                    )[0]
+                except Exception as e:
+                    self.logger.error(f"Could not summarize reference {pm_id}: {e}")
+                    continue
+                match = re.search(r"<Summary>(.*?)(</Summary>|$)", response, re.DOTALL)
+                summary = (match.group(1) if match else response).strip()
+                if summary == "":
+                    continue
+                entry.set_summary(summary)
+                num_summarized += 1
+        return num_summarized
+
+    def save(self, path: str) -> None:
+        """
+        Save the summaries to a JSON file.
+
+        :param path: Path to the JSON file.
+        :type path: str
+        """
+        with self.lock:
+            summaries = {
+                pm_id: entry.summary for pm_id, entry in self.entries.items() if entry.summary is not None
+            }
+        if os.path.exists(path):
+            with open(path, "r") as json_file:
+                summaries = {**json.load(json_file), **summaries}
+        with open(path + ".part", "w") as json_file:
+            json.dump(summaries, json_file, ensure_ascii=False)
+        os.replace(path + ".part", path)
+
+    def load(self, path: str) -> None:
+        """
+        Load summaries saved by `save`. They are applied to references that are added later as well.
+
+        :param path: Path to the JSON file.
+        :type path: str
+        """
+        with open(path, "r") as json_file:
+            saved_summaries = json.load(json_file)
+        with self.lock:
+            self.saved_summaries.update(saved_summaries)
+            for pm_id, entry in self.entries.items():
+                if pm_id in self.saved_summaries:
+                    entry.set_summary(self.saved_summaries[pm_id])
@@ -0,0 +1,501 @@
+# author: Jayce Ning
+#
+# In-process reimplementation of the ROUGE-1.5.5 scores used in this project
+# (options "-c 95 -m -r 1000 -n 2 -a" of utils/pyrouge.py), without temporary
+# files, subprocesses or the Perl toolkit.
+
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+
+class PorterStemmer:
+    """
+    The Porter stemming algorithm, as implemented by the reference versions
+    (including the "bli" and "logi" departures) that ROUGE-1.5.5 uses with option -m.
+    """
+
+    _step2_suffixes = [
+        ("ational", "ate"), ("tional", "tion"), ("enci", "ence"), ("anci", "ance"),
+        ("izer", "ize"), ("bli", "ble"), ("alli", "al"), ("entli", "ent"),
+        ("eli", "e"), ("ousli", "ous"), ("ization", "ize"), ("ation", "ate"),
+        ("ator", "ate"), ("alism", "al"), ("iveness", "ive"), ("fulness", "ful"),
+        ("ousness", "ous"), ("aliti", "al"), ("iviti", "ive"), ("biliti", "ble"),
+        ("logi", "log"),
+    ]
+    _step3_suffixes = [
+        ("icate", "ic"), ("ative", ""), ("alize", "al"), ("iciti", "ic"),
+        ("ical", "ic"), ("ful", ""), ("ness", ""),
+    ]
+    _step4_suffixes = [
+        "al", "ance", "ence", "er", "ic", "able", "ible", "ant", "ement", "ment",
+        "ent", "ion", "ou", "ism", "ate", "iti", "ous", "ive", "ize",
+    ]
+
+    @staticmethod
+    def _is_consonant(word: str, i: int) -> bool:
+        char = word[i]
+        if char in "aeiou":
+            return False
+        if char == "y":
+            return i == 0 or not PorterStemmer._is_consonant(word, i - 1)
+        return True
+
+    @staticmethod
+    def _measure(stem: str) -> int:
+        """
+        Number of vowel-consonant sequences [C](VC)^m[V] of the stem.
+        """
+        m = 0
+        previous_vowel = False
+        for i in range(len(stem)):
+            vowel = not PorterStemmer._is_consonant(stem, i)
+            if previous_vowel and not vowel:
+                m += 1
+            previous_vowel = vowel
+        return m
+
+    @staticmethod
+    def _has_vowel(stem: str) -> bool:
+        return any(not PorterStemmer._is_consonant(stem, i) for i in range(len(stem)))
+
+    @staticmethod
+    def _ends_double_consonant(word: str) -> bool:
+        return (
+            len(word) >= 2
+            and word[-1] == word[-2]
+            and PorterStemmer._is_consonant(word, len(word) - 1)
+        )
+
+    @staticmethod
+    def _ends_cvc(word: str) -> bool:
+        return (
+            len(word) >= 3
+            and PorterStemmer._is_consonant(word, len(word) - 3)
+            and not PorterStemmer._is_consonant(word, len(word) - 2)
+            and PorterStemmer._is_consonant(word, len(word) - 1)
+            and word[-1] not in "wxy"
+        )
+
+    def _replace(self, word: str, suffixes: List[Tuple[str, str]], min_measure: int) -> str:
+        for suffix, replacement in suffixes:
+            if word.endswith(suffix):
+                stem = word[: len(word) - len(suffix)]
+                if self._measure(stem) > min_measure:
+                    return stem + replacement
+                return word
+        return word
+
+    def stem(self, word: str) -> str:
+        """
+        Stem a lowercase word.
+
+        :param word: The word to be stemmed.
+        :type word: str
+        :return: The stem of the word.
+        :rtype: str
+        """
+        if len(word) <= 2:
+            return word
+
+        # step 1a
+        if word.endswith("sses"):
+            word = word[:-2]
+        elif word.endswith("ies"):
+            word = word[:-2]
+        elif word.endswith("ss"):
+            pass
+        elif word.endswith("s"):
+            word = word[:-1]
+
+        # step 1b
+        if word.endswith("eed"):
+            if self._measure(word[:-3]) > 0:
+                word = word[:-1]
+        else:
+            for suffix in ("ed", "ing"):
+                if word.endswith(suffix) and self._has_vowel(word[: -len(suffix)]):
+                    word = word[: -len(suffix)]
+                    if word.endswith(("at", "bl", "iz")):
+                        word += "e"
+                    elif self._ends_double_consonant(word) and word[-1] not in "lsz":
+                        word = word[:-1]
+                    elif self._measure(word) == 1 and self._ends_cvc(word):
+                        word += "e"
+                    break
+
+        # step 1c
+        if word.endswith("y") and self._has_vowel(word[:-1]):
+            word = word[:-1] + "i"
+
+        # step 2 and 3
+        word = self._replace(word, self._step2_suffixes, 0)
+        word = self._replace(word, self._step3_suffixes, 0)
+
+        # step 4
+        for suffix in self._step4_suffixes:
+            if word.endswith(suffix):
+                stem = word[: len(word) - len(suffix)]
+                if self._measure(stem) > 1 and (
+                    suffix != "ion" or stem.endswith(("s", "t"))
+                ):
+                    word = stem
+                break
+
+        # step 5a
+        if word.endswith("e"):
+            stem = word[:-1]
+            measure = self._measure(stem)
+            if measure > 1 or (measure == 1 and not self._ends_cvc(stem)):
+                word = stem
+
+        # step 5b
+        if (
+            word.endswith("ll")
+            and self._measure(word) > 1
+        ):
+            word = word[:-1]
+
+        return word
+
+
+_stemmer = PorterStemmer()
+
+
+def load_exceptions(path: str) -> Dict[str, str]:
+    """
+    Load the inflection exceptions that ROUGE-1.5.5 looks up before the Porter stemmer.
+    Every line holds an inflected form and its base form. utils/wordnet_exceptions.txt holds the entries
+    of data/WordNet-2.0-Exceptions/{adj,adv,noun,verb}.exc of the ROUGE-1.5.5 toolkit, read in this order
+    like buildExeptionDB.pl (a later entry for the same form wins), restricted to the alphanumeric forms
+    longer than three characters, which are the only tokens that reach the lookup.
+
+    :param path: Path to the exception file.
+    :type path: str
+    :return: The base form of every inflected form.
+    :rtype: Dict[str, str]
+    """
+    exceptions = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2:
+                exceptions[parts[0]] = parts[1]
+    return exceptions
+
+
+_exceptions = load_exceptions(os.path.join(os.path.dirname(os.path.abspath(__file__)), "wordnet_exceptions.txt"))
+
+
+@lru_cache(maxsize=1 << 16)
+def stem(word: str) -> str:
+    """
+    Stem a token like ROUGE-1.5.5 with option -m: only tokens longer than three characters are stemmed,
+    irregular forms (e.g. "mice", "analyses") are mapped to their WordNet base form and all other tokens
+    are reduced with the Porter stemmer.
+
+    :param word: The lowercase token.
+    :type word: str
+    :return: The stemmed token.
+    :rtype: str
+    """
+    if len(word) > 3:
+        if word in _exceptions:
+            return _exceptions[word]
+        return _stemmer.stem(word)
+    return word
+
+
+_non_alphanumeric = re.compile(r"[^a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Tokenize a text like ROUGE-1.5.5: lowercase, split at non-alphanumeric characters and stem.
+
+    :param text: The text to be tokenized.
+    :type text: str
+    :return: The stemmed tokens.
+    :rtype: List[str]
+    """
+    return [stem(token) for token in _non_alphanumeric.sub(" ", text.lower()).split()]
+
+
+def split_sentences(text: str) -> List[List[str]]:
+    """
+    Split a summary into tokenized sentences the way pyrouge passes it to ROUGE-1.5.5.
+    Sentences are separated by "<q>" and ROUGE reads the text of each sentence only up to the next "<".
+
+    :param text: The summary.
+    :type text: str
+    :return: The tokens of each sentence.
+    :rtype: List[List[str]]
+    """
+    return [tokenize(sentence.split("<", 1)[0]) for sentence in text.strip().split("<q>")]
+
+
+def ngrams(tokens: List[str], n: int) -> Counter:
+    """
+    Count the n-grams of a token sequence.
+
+    :param tokens: The tokens.
+    :type tokens: List[str]
+    :param n: Length of the n-grams.
+    :type n: int
+    :return: Counts of the n-grams.
+    :rtype: Counter
+    """
+    return Counter(zip(*[tokens[i:] for i in range(n)]))
+
+
+def match_masks(a: List[str]) -> Dict[str, int]:
+    """
+    Bit masks of the positions of every token in `a`, used by `lcs_length`.
+
+    :param a: Token sequence.
+    :type a: List[str]
+    :return: For every token, a bit mask of its positions in `a`.
+    :rtype: Dict[str, int]
+    """
+    masks: Dict[str, int] = {}
+    for i, token in enumerate(a):
+        masks[token] = masks.get(token, 0) | (1 << i)
+    return masks
+
+
+def lcs_length(a: List[str], b: List[str], masks: Dict[str, int] = None) -> int:
+    """
+    Length of the longest common subsequence, computed with a bit-parallel algorithm
+    (Hyyrö) that processes one token of `b` per step for all positions of `a` at once.
+
+    :param a: First token sequence.
+    :type a: List[str]
+    :param b: Second token sequence.
+    :type b: List[str]
+    :param masks: Precomputed `match_masks(a)`, if `a` is compared to several sequences. Defaults to None.
+    :type masks: Dict[str, int]
+    :return: The length of the longest common subsequence.
+    :rtype: int
+    """
+    if len(a) == 0 or len(b) == 0:
+        return 0
+    if masks is None:
+        masks = match_masks(a)
+    mask = (1 << len(a)) - 1
+    row = mask
+    for token in b:
+        matches = masks.get(token, 0)
+        if matches == 0:
+            continue
+        u = row & matches
+        row = ((row + u) | (row - u)) & mask
+    return len(a) - bin(row).count("1")
+
+
+def lcs_positions(a: List[str], b: List[str]) -> List[int]:
+    """
+    Positions in `a` of a longest common subsequence of `a` and `b`, chosen like ROUGE-1.5.5.
+
+    :param a: First token sequence.
+    :type a: List[str]
+    :param b: Second token sequence.
+    :type b: List[str]
+    :return: The positions in `a` of the longest common subsequence.
+    :rtype: List[int]
+    """
+    lengths = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            if a[i - 1] == b[j - 1]:
+                lengths[i][j] = lengths[i - 1][j - 1] + 1
+            elif lengths[i - 1][j] >= lengths[i][j - 1]:
+                lengths[i][j] = lengths[i - 1][j]
+            else:
+                lengths[i][j] = lengths[i][j - 1]
+    positions = []
+    i, j = len(a), len(b)
+    while i > 0 and j > 0:
+        if a[i - 1] == b[j - 1]:
+            positions.append(i - 1)
+            i -= 1
+            j -= 1
+        elif lengths[i - 1][j] >= lengths[i][j - 1]:
+            i -= 1
+        else:
+            j -= 1
+    positions.reverse()
+    return positions
+
+
+def union_lcs_hits(
+    model_sentences: List[List[str]], peer_sentences: List[List[str]]
+) -> int:
+    """
+    Number of summary-level LCS hits (union LCS of every model sentence with all peer sentences),
+    where every token is counted at most as often as it occurs in both summaries.
+
+    :param model_sentences: Tokenized sentences of the model (reference) summary.
+    :type model_sentences: List[List[str]]
+    :param peer_sentences: Tokenized sentences of the peer (system) summary.
+    :type peer_sentences: List[List[str]]
+    :return: The number of LCS hits.
+    :rtype: int
+    """
+    if len(model_sentences) == 1 and len(peer_sentences) == 1:
+        return lcs_length(model_sentences[0], peer_sentences[0])
+    model_counts = Counter(token for sentence in model_sentences for token in sentence)
+    peer_counts = Counter(token for sentence in peer_sentences for token in sentence)
+    hits = 0
+    for model_sentence in model_sentences:
+        union = set()
+        for peer_sentence in peer_sentences:
+            union.update(lcs_positions(model_sentence, peer_sentence))
+        for position in sorted(union):
+            token = model_sentence[position]
+            if model_counts[token] > 0 and peer_counts[token] > 0:
+                hits += 1
+                model_counts[token] -= 1
+                peer_counts[token] -= 1
+    return hits
+
+
+def _scores(hits: int, model_total: int, peer_total: int) -> Tuple[float, float, float]:
+    """
+    Recall, precision and F-measure (alpha 0.5) rounded to the five digits ROUGE-1.5.5 reports.
+    Like ROUGE-1.5.5, the F-measure is computed from the rounded recall and precision.
+    """
+    recall = round(hits / model_total, 5) if model_total > 0 else 0.0
+    precision = round(hits / peer_total, 5) if peer_total > 0 else 0.0
+    if 0.5 * precision + 0.5 * recall > 0:
+        f_score = (precision * recall) / (0.5 * precision + 0.5 * recall)
+    else:
+        f_score = 0.0
+    return recall, precision, round(f_score, 5)
+
+
+class ReferenceIndex:
+    """
+    Pre-processed summary that is compared to many other summaries.
+    Holds the tokenized and stemmed sentences, the n-gram counts and the LCS bit masks of the summary,
+    so they are derived only once. The indexed summary takes the peer position of `evaluate_rouge`,
+    like the gold summaries passed to `test_rouge` in utils/cal_rouge.py.
+    """
+
+    def __init__(self, text: str) -> None:
+        """
+        Tokenize the summary and count its n-grams.
+
+        :param text: The summary.
+        :type text: str
+        """
+        self.sentences: List[List[str]] = split_sentences(text)
+        self.tokens: List[str] = [token for sentence in self.sentences for token in sentence]
+        self.vocabularies: Dict[int, Dict[Tuple[str, ...], int]] = {}
+        self.counts: Dict[int, np.ndarray] = {}
+        for n in (1, 2):
+            ngram_counts = ngrams(self.tokens, n)
+            self.vocabularies[n] = {ngram: i for i, ngram in enumerate(ngram_counts)}
+            self.counts[n] = np.array(list(ngram_counts.values()), dtype=np.int64)
+        self.masks: Dict[str, int] = (
+            match_masks(self.sentences[0]) if len(self.sentences) == 1 else None
+        )
+
+    def score(self, model: str) -> Dict[str, float]:
+        """
+        Compute ROUGE-1, ROUGE-2 and ROUGE-L of the indexed summary against a model summary.
+
+        :param model: The model summary.
+        :type model: str
+        :return: Recall, precision and F-measure of ROUGE-1, ROUGE-2 and ROUGE-L.
+        :rtype: Dict[str, float]
+        """
+        return self.score_batch([model])[0]
+
+    def score_batch(self, models: List[str]) -> List[Dict[str, float]]:
+        """
+        Compute the scores of `score` for many model summaries in one pass.
+        The n-gram counts of all model summaries are gathered into a matrix over the n-grams
+        of the indexed summary, so the hits of all summaries are computed with a single vectorised minimum.
+
+        :param models: The model summaries.
+        :type models: List[str]
+        :return: The scores for each model summary, in the same order.
+        :rtype: List[Dict[str, float]]
+        """
+        all_model_sentences = [split_sentences(model) for model in models]
+        all_model_tokens = [
+            [token for sentence in model_sentences for token in sentence]
+            for model_sentences in all_model_sentences
+        ]
+
+        results = [{} for _ in models]
+        for n in (1, 2):
+            vocabulary = self.vocabularies[n]
+            model_counts = np.zeros((len(models), len(vocabulary)), dtype=np.int64)
+            model_totals = np.zeros(len(models), dtype=np.int64)
+            for row, model_tokens in enumerate(all_model_tokens):
+                model_ngrams = ngrams(model_tokens, n)
+                model_totals[row] = sum(model_ngrams.values())
+                for ngram, count in model_ngrams.items():
+                    column = vocabulary.get(ngram)
+                    if column is not None:
+                        model_counts[row, column] = count
+            hits = np.minimum(model_counts, self.counts[n]).sum(axis=1)
+            peer_total = int(self.counts[n].sum())
+            for row, result in enumerate(results):
+                recall, precision, f_score = _scores(
+                    int(hits[row]), int(model_totals[row]), peer_total
+                )
+                result[f"rouge_{n}_recall"] = recall
+                result[f"rouge_{n}_precision"] = precision
+                result[f"rouge_{n}_f_score"] = f_score
+
+        for model_sentences, model_tokens, result in zip(
+            all_model_sentences, all_model_tokens, results
+        ):
+            if self.masks is not None and len(model_sentences) == 1:
+                # the LCS length is symmetric, so the masks of the indexed summary are reused
+                hits = lcs_length(self.sentences[0], model_sentences[0], self.masks)
+            else:
+                hits = union_lcs_hits(model_sentences, self.sentences)
+            recall, precision, f_score = _scores(
+                hits, len(model_tokens), len(self.tokens)
+            )
+            result["rouge_l_recall"] = recall
+            result["rouge_l_precision"] = precision
+            result["rouge_l_f_score"] = f_score
+        return results
+
+
+def evaluate_rouge(peer: str, model: str) -> Dict[str, float]:
+    """
+    Compute ROUGE-1, ROUGE-2 and ROUGE-L of a peer (system) summary against a model (reference) summary.
+    The result has the keys of pyrouge's `Rouge155.output_to_dict`, e.g. "rouge_1_f_score".
+
+    :param peer: The peer summary.
+    :type peer: str
+    :param model: The model summary.
+    :type model: str
+    :return: Recall, precision and F-measure of ROUGE-1, ROUGE-2 and ROUGE-L.
+    :rtype: Dict[str, float]
+    """
+    return ReferenceIndex(peer).score(model)
+
+
+def evaluate_rouge_batch(peer: str, models: List[str]) -> List[Dict[str, float]]:
+    """
+    Compute the scores of `evaluate_rouge` for one peer summary and many model summaries in one pass.
+    The peer summary is tokenized and its n-grams are counted only once.
+
+    :param peer: The peer summary shared by all comparisons.
+    :type peer: str
+    :param models: The model summaries.
+    :type models: List[str]
+    :return: The scores for each model summary, in the same order.
+    :rtype: List[Dict[str, float]]
+    """
+    return ReferenceIndex(peer).score_batch(models)
@@ -0,0 +1,146 @@
+# author: Jayce Ning
+
+from array import array
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Optional, Sequence, Tuple
+import threading
+
+import tiktoken
+
+
+@lru_cache(maxsize=None)
+def get_encoding_for_model(model_name: str) -> tiktoken.Encoding:
+    """
+    Function to get the tokenizer of a model, it is loaded only once per process.
+
+    :param model_name: Name of the model, e.g. "gpt-3.5-turbo".
+    :type model_name: str
+    :return: The tokenizer.
+    :rtype: tiktoken.Encoding
+    """
+    return tiktoken.encoding_for_model(model_name)
+
+
+class TokenCache:
+    """
+    LRU memo of the encoded content blocks of the prompts (origin articles, references, prompt templates).
+    The same blocks are encoded for every thought and operation of an article, so their tokens are kept
+    as compact arrays and evicted when the number of stored tokens exceeds `max_tokens`.
+    Texts that are encoded only once, like whole prompts, should not be memoised: the memo keeps every
+    text as part of its key.
+    """
+
+    def __init__(self, max_tokens: int = 4_000_000) -> None:
+        """
+        Initialize the memo.
+
+        :param max_tokens: Maximum number of stored tokens. Defaults to 4,000,000, which take 16 MB, plus
+                           the memoised texts of about four characters per token.
+        :type max_tokens: int
+        """
+        self.max_tokens: int = max_tokens
+        self.num_tokens: int = 0
+        self.entries: OrderedDict = OrderedDict()
+        self.lock: threading.Lock = threading.Lock()
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def encode(self, text: str, encoding: tiktoken.Encoding) -> Sequence[int]:
+        """
+        Encode a text, or return its memoised tokens.
+
+        :param text: The text.
+        :type text: str
+        :param encoding: The tokenizer.
+        :type encoding: tiktoken.Encoding
+        :return: The tokens of the text.
+        :rtype: Sequence[int]
+        """
+        key = (encoding.name, text)
+        with self.lock:
+            tokens = self.entries.get(key)
+            if tokens is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return tokens
+            self.misses += 1
+        tokens = array("I", encoding.encode(text))
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = tokens
+                self.num_tokens += len(tokens)
+            while self.num_tokens > self.max_tokens and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.num_tokens -= len(evicted)
+        return tokens
+
+    def clear(self) -> None:
+        """
+        Remove all memoised tokens.
+        """
+        with self.lock:
+            self.entries.clear()
+            self.num_tokens = 0
+
+
+token_cache = TokenCache()
+
+
+def count_tokens(text: str, encoding: tiktoken.Encoding) -> int:
+    """
+    Function to count the tokens of a reusable text, served from `token_cache` if it was encoded before.
+
+    :param text: The text.
+    :type text: str
+    :param encoding: The tokenizer.
+    :type encoding: tiktoken.Encoding
+    :return: Number of tokens of the text.
+    :rtype: int
+    """
+    return len(token_cache.encode(text, encoding))
+
+
+def truncate_to_tokens(
+    text: str, max_tokens: int, encoding: tiktoken.Encoding
+) -> Tuple[str, Optional[int]]:
+    """
+    Function to cut a text to at most `max_tokens` tokens.
+    The text is encoded once, without memoising it in `token_cache`, and cut at the start of the first token
+    that does not fit anymore, or before the character that this token splits, since byte-level tokens can
+    end inside a multi-byte character.
+    Since encoding the cut text can merge its last characters differently, the result is encoded once more;
+    only if it is still too long, the cut is moved by a binary search over the character offsets.
+
+    :param text: The text to be truncated.
+    :type text: str
+    :param max_tokens: Maximum number of tokens of the truncated text.
+    :type max_tokens: int
+    :param encoding: The tokenizer.
+    :type encoding: tiktoken.Encoding
+    :return: The truncated text and the character offset of the cut, None if the text was not truncated.
+    :rtype: Tuple[str, Optional[int]]
+    """
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text, None
+    if max_tokens <= 0:
+        return "", 0
+    data = text.encode("utf-8")
+    cut_bytes = sum(len(token) for token in encoding.decode_tokens_bytes(tokens[:max_tokens]))
+    # step back to the lead byte of the character in which the cut falls
+    while cut_bytes > 0 and data[cut_bytes] & 0xC0 == 0x80:
+        cut_bytes -= 1
+    cut = len(data[:cut_bytes].decode("utf-8"))
+    if len(encoding.encode(text[:cut])) <= max_tokens:
+        return text[:cut], cut
+
+    # largest prefix that fits, the token count grows with the length of the prefix
+    low, high = 0, cut
+    while low < high:
+        middle = (low + high + 1) // 2
+        if len(encoding.encode(text[:middle])) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low], low
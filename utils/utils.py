@@ -1,38 +1,125 @@
 # author: Jayce Ning
 
-from typing import Dict, List
-import tempfile
-import os
-from .cal_rouge import test_rouge
+from typing import Dict, Iterator, List, Optional, Union
+from contextlib import contextmanager
+from .rouge import ReferenceIndex
 import logging
 import json
-import codecs
+import threading
 global rouge1f_num
 rouge1f_num = 0
 
+# reference indexes of the articles whose graphs are currently executed,
+# keyed by the unprocessed gold summary together with a reference count
+reference_indexes: Dict[str, List] = {}
+reference_indexes_lock = threading.Lock()
+
+def get_reference_index(gold_summary: str) -> ReferenceIndex:
+    """
+    Function to get the reference index of a gold summary.
+    Indexes registered by `scoring_context` are reused, otherwise a new index is built.
+
+    :param gold_summary: The gold summary.
+    :type gold_summary: str
+    :return: The reference index.
+    :rtype: ReferenceIndex
+    """
+    with reference_indexes_lock:
+        entry = reference_indexes.get(gold_summary)
+    if entry is not None:
+        return entry[0]
+    return ReferenceIndex(gold_summary.replace("\n", " "))
+
+@contextmanager
+def scoring_context(problem_parameters: Dict) -> Iterator[None]:
+    """
+    Context manager that builds the reference indexes of an article's introduction and abstract once,
+    so that every scoring call of the graph reuses them, and releases them when the last user leaves.
+    Pass it as `scoring_context_factory` to the Controller.
+
+    :param problem_parameters: Initial state of the problem with "origin_introduction" and "origin_abstract".
+    :type problem_parameters: Dict
+    """
+    gold_summaries = [
+        problem_parameters[key]
+        for key in ("origin_introduction", "origin_abstract")
+        if isinstance(problem_parameters.get(key), str)
+    ]
+    for gold_summary in gold_summaries:
+        with reference_indexes_lock:
+            entry = reference_indexes.get(gold_summary)
+            if entry is not None:
+                entry[1] += 1
+                continue
+        index = ReferenceIndex(gold_summary.replace("\n", " "))
+        with reference_indexes_lock:
+            entry = reference_indexes.setdefault(gold_summary, [index, 0])
+            entry[1] += 1
+    try:
+        yield
+    finally:
+        with reference_indexes_lock:
+            for gold_summary in gold_summaries:
+                entry = reference_indexes[gold_summary]
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del reference_indexes[gold_summary]
+
+def rouge_scores(gold_summary: str, generate_abstract: str) -> Dict[str, float]:
+    """
+    Function to calculate the rouge scores of a generated abstract in-process, without temporary files or the Perl ROUGE toolkit.
+    The texts are prepared like the files that used to be passed to ROUGE-1.5.5.
+
+    :param gold_summary: The gold summary.
+    :type gold_summary: str
+    :param generate_abstract: The generated abstract.
+    :type generate_abstract: str
+    :return: Recall, precision and f score of rouge-1, rouge-2 and rouge-l.
+    :rtype: Dict[str, float]
+    """
+    generate_abstract = generate_abstract.replace("\n", " ").replace("<", " ").replace(">", " ")
+    return get_reference_index(gold_summary).score(generate_abstract)
+
+def rouge_scores_states(states: List[Dict], gold_key: str) -> List[Optional[Dict[str, float]]]:
+    """
+    Function to calculate the rouge scores of many thought states at once.
+    States with the same gold summary are scored in one batch, so the gold summary is tokenized only once.
+
+    :param states: Thought states to be scored.
+    :type states: List[Dict]
+    :param gold_key: Key of the gold summary in the states.
+    :type gold_key: str
+    :return: Rouge scores of each state, None for states that could not be scored.
+    :rtype: List[Optional[Dict[str, float]]]
+    """
+    results = [None] * len(states)
+    batches = {}
+    for i, state in enumerate(states):
+        try:
+            gold_summary = state[gold_key]
+            assert isinstance(gold_summary, str)
+            generate_abstract = state["current"].replace("\n", " ").replace("<", " ").replace(">", " ")
+        except Exception:
+            continue
+        batches.setdefault(gold_summary, []).append((i, generate_abstract))
+    for gold_summary, batch in batches.items():
+        try:
+            batch_results = get_reference_index(gold_summary).score_batch([generate_abstract for _, generate_abstract in batch])
+        except Exception:
+            continue
+        for (i, _), results_dict in zip(batch, batch_results):
+            results[i] = results_dict
+    return results
+
 def cal_rouge_f(gold_summary, generate_abstract):
     try:
-        # 创建临时文件并将内容写入
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8') as temp_file:
-            temp_file.write(gold_summary.replace("\n", " "))
-            gold_summary_file_path = temp_file.name
-        # 创建临时文件并将内容写入
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8') as temp_file:
-            temp_file.write(generate_abstract.replace("\n", " ").replace("<", " ").replace(">", " "))
-            generate_abstract_file_path = temp_file.name
-
-        gold_summary = codecs.open(gold_summary_file_path, encoding="utf-8")
-        generate_abstract = codecs.open(generate_abstract_file_path, encoding="utf-8")
-        results_dict = test_rouge(gold_summary, generate_abstract, 1)
+        results_dict = rouge_scores(gold_summary, generate_abstract)
         global rouge1f_num
         if results_dict["rouge_1_f_score"]>0:
             rouge1f_num += 1
             print("==============================================================")
         else:
             pass
-        # 删除临时文件
-        os.remove(gold_summary_file_path)
-        os.remove(generate_abstract_file_path)
 
         rouge1f = results_dict["rouge_1_f_score"]
         rouge2f = results_dict["rouge_2_f_score"]
@@ -43,85 +130,58 @@ def cal_rouge_f(gold_summary, generate_abstract):
     except:
         return 0, 0, 0
 
-def rouge1_f_test_introduction(state: Dict) -> float:
+def rouge1_f_test_introduction(state: Union[Dict, List[Dict]]) -> Union[float, List[float]]:
     """
     Function to locally calculate rouge f1 score.
+    A list of states is scored in one batch, so the function can be used with combined scoring.
 
-    :param state: Thought state to be scored.
-    :type state: Dict
-    :return: Number of errors.
-    :rtype: float
+    :param state: Thought state or list of thought states to be scored.
+    :type state: Union[Dict, List[Dict]]
+    :return: Rouge-1 f score of the state or of each state.
+    :rtype: Union[float, List[float]]
     """
 
+    if isinstance(state, list):
+        return [
+            0 if results_dict is None else results_dict["rouge_1_f_score"]
+            for results_dict in rouge_scores_states(state, "origin_introduction")
+        ]
+
     try:
-        gold_summary = state["origin_introduction"].replace("\n", " ")  # 对于测试集，使用 introduction 作为 gold summary
-        generate_abstract = state["current"].replace("\n", " ").replace("<", " ").replace(">", " ")
-        #logging.warning(f"=========================================")
-        #logging.warning(gold_summary)
-        #logging.warning(generate_abstract)
-
-        # 创建临时文件并将内容写入
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8') as temp_file:
-            temp_file.write(gold_summary)
-            gold_summary_file_path = temp_file.name
-        # 创建临时文件并将内容写入
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8') as temp_file:
-            temp_file.write(generate_abstract)
-            generate_abstract_file_path = temp_file.name
-
-        gold_summary = codecs.open(gold_summary_file_path, encoding="utf-8")
-        generate_abstract = codecs.open(generate_abstract_file_path, encoding="utf-8")
-        results_dict = test_rouge(gold_summary, generate_abstract, 1)
-        #logging.warning(results_dict)
-        # 删除临时文件
-        os.remove(gold_summary_file_path)
-        os.remove(generate_abstract_file_path)
+        # 对于测试集，使用 introduction 作为 gold summary
+        results_dict = rouge_scores(state["origin_introduction"], state["current"])
 
         rouge1f = results_dict["rouge_1_f_score"]
-        #logging.warning(rouge1f)
-        #logging.warning(type(rouge1f))
 
         return rouge1f
     except:
         return 0
 
-def rouge1_f_gold_summary(state: Dict) -> float:
+def rouge1_f_gold_summary(state: Union[Dict, List[Dict]]) -> Union[float, List[float]]:
     """
-    Function to locally calculate rouge f1 score.
+    Function to locally calculate rouge f1 score and store all rouge scores in the state.
+    A list of states is scored in one batch, so the function can be used with combined scoring.
 
-    :param state: Thought state to be scored.
-    :type state: Dict
-    :return: Number of errors.
-    :rtype: float
+    :param state: Thought state or list of thought states to be scored.
+    :type state: Union[Dict, List[Dict]]
+    :return: Rouge-1 f score of the state or of each state.
+    :rtype: Union[float, List[float]]
     """
 
+    if isinstance(state, list):
+        scores = []
+        for single_state, results_dict in zip(state, rouge_scores_states(state, "origin_abstract")):
+            if results_dict is None:
+                scores.append(0)
+            else:
+                single_state["rouge"] = results_dict
+                scores.append(results_dict["rouge_1_f_score"])
+        return scores
+
     try:
-        gold_summary = state["origin_abstract"].replace("\n", " ")  # 对于测试集，使用 introduction 作为 gold summary
-        generate_abstract = state["current"].replace("\n", " ").replace("<", " ").replace(">", " ")
-        #logging.warning(f"=========================================")
-        #logging.warning(gold_summary)
-        #logging.warning(generate_abstract)
-
-        # 创建临时文件并将内容写入
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8') as temp_file:
-            temp_file.write(gold_summary)
-            gold_summary_file_path = temp_file.name
-        # 创建临时文件并将内容写入
-        with tempfile.NamedTemporaryFile(mode='w', delete=False, encoding='utf-8') as temp_file:
-            temp_file.write(generate_abstract)
-            generate_abstract_file_path = temp_file.name
-
-        gold_summary = codecs.open(gold_summary_file_path, encoding="utf-8")
-        generate_abstract = codecs.open(generate_abstract_file_path, encoding="utf-8")
-        results_dict = test_rouge(gold_summary, generate_abstract, 1)
-        #logging.warning(results_dict)
-        # 删除临时文件
-        os.remove(gold_summary_file_path)
-        os.remove(generate_abstract_file_path)
+        results_dict = rouge_scores(state["origin_abstract"], state["current"])
 
         rouge1f = results_dict["rouge_1_f_score"]
-        #logging.warning(rouge1f)
-        #logging.warning(type(rouge1f))
         state["rouge"] = results_dict
 
         return rouge1f